@@ -0,0 +1,151 @@
+from collections import OrderedDict
+
+import numpy as np
+
+from config import BUFFER_POOL_BYTES
+from utils import using_xrt
+
+# smallest bucket, in bytes
+MIN_BUCKET_BYTES = 4096
+
+
+class PLBufferPool:
+    '''Device buffers reused across kernel calls.
+
+       Buffers are bucketed by dtype and by element count rounded up to a
+       power of two. A released buffer goes back to its bucket and is handed
+       out again by the next acquire() of the same bucket. When the pool
+       grows beyond max_bytes, the least recently released buffers are freed.
+
+       acquire() returns a view of the bucket buffer with the requested
+       shape; the runtime recognizes such views (and contiguous slices of
+       them) and passes their device address to the accelerator without
+       copying.
+    '''
+
+    pools = {}
+
+    @classmethod
+    def get(cls, board):
+        kind = 'xrt' if using_xrt(board) else 'soc'
+        pool = cls.pools.get(kind)
+        if pool is None:
+            pool = cls(xrt=(kind == 'xrt'))
+            cls.pools[kind] = pool
+        return pool
+
+    @classmethod
+    def total_allocated(cls):
+        return sum(pool.allocated_bytes for pool in cls.pools.values())
+
+    def __init__(self, xrt=False, max_bytes=BUFFER_POOL_BYTES):
+        self.xrt = xrt
+        self.max_bytes = max_bytes
+        self.allocated_bytes = 0
+        self.xlnk = None
+        # bucket -> list of free buffers, least recently used bucket first
+        self.free_buffers = OrderedDict()
+        # data pointer -> (bucket, buffer) for buffers handed out
+        self.live = {}
+        self.hits = 0
+        self.misses = 0
+
+    def bucket(self, shape, dtype):
+        dtype = np.dtype(dtype)
+        count = max(int(np.prod(shape)), 1)
+        min_count = max(MIN_BUCKET_BYTES // dtype.itemsize, 1)
+        capacity = max(1 << (count - 1).bit_length(), min_count)
+        return (dtype.str, capacity)
+
+    def device_alloc(self, capacity, dtype):
+        if self.xrt:
+            from pynq import allocate  # requires PYNQ v2.5 or newer
+            return allocate(shape=(capacity,), dtype=dtype)
+        else:
+            if self.xlnk is None:
+                from pynq import Xlnk
+                self.xlnk = Xlnk()
+            return self.xlnk.cma_array((capacity,), dtype)
+
+    def evict(self, needed_bytes):
+        '''Free least recently used buffers until needed_bytes fit.'''
+        while self.free_buffers and \
+              self.allocated_bytes + needed_bytes > self.max_bytes:
+            bucket, buffers = next(iter(self.free_buffers.items()))
+            buf = buffers.pop(0)
+            if not buffers:
+                del self.free_buffers[bucket]
+            self.allocated_bytes -= buf.nbytes
+            buf.close()
+
+    def acquire(self, shape, dtype):
+        dtype = np.dtype(dtype)
+        bucket = self.bucket(shape, dtype)
+        buffers = self.free_buffers.get(bucket)
+
+        if buffers:
+            self.hits += 1
+            buf = buffers.pop()
+            if not buffers:
+                del self.free_buffers[bucket]
+        else:
+            self.misses += 1
+            nbytes = bucket[1] * dtype.itemsize
+            self.evict(nbytes)
+            if self.allocated_bytes + nbytes > self.max_bytes:
+                print(f'WARNING: buffer pool exceeds its limit of ' + \
+                      f'{self.max_bytes} bytes.')
+            buf = self.device_alloc(bucket[1], dtype)
+            self.allocated_bytes += buf.nbytes
+
+        self.live[buf.ctypes.data] = (bucket, buf)
+        count = int(np.prod(shape))
+        return buf[:count].reshape(shape)
+
+    def release(self, array):
+        bucket, buf = self.find(array)
+        if buf is None:
+            return
+        del self.live[buf.ctypes.data]
+        self.free_buffers.setdefault(bucket, []).append(buf)
+        self.free_buffers.move_to_end(bucket)
+
+    def find(self, array):
+        '''Return (bucket, buffer) of the pooled buffer holding array.'''
+        if not isinstance(array, np.ndarray):
+            return None, None
+        start = array.ctypes.data
+        for bucket, buf in self.live.values():
+            offset = start - buf.ctypes.data
+            if 0 <= offset and offset + array.nbytes <= buf.nbytes:
+                return bucket, buf
+        return None, None
+
+    def owns(self, array):
+        '''Whether array can be passed to the device without a copy.'''
+        if not array.flags['C_CONTIGUOUS']:
+            return False
+        return self.find(array)[1] is not None
+
+    def device_address(self, array):
+        bucket, buf = self.find(array)
+        return buf.physical_address + (array.ctypes.data - buf.ctypes.data)
+
+    def clear(self):
+        '''Free every idle buffer.'''
+        for buffers in self.free_buffers.values():
+            for buf in buffers:
+                self.allocated_bytes -= buf.nbytes
+                buf.close()
+        self.free_buffers.clear()
+
+
+def pl_allocate(shape, dtype, board='pynq-z2'):
+    '''Allocate an array directly in pooled device memory. Passing it to a
+       deployed kernel skips the copy into and out of device buffers.'''
+    return PLBufferPool.get(board).acquire(shape, dtype)
+
+
+def pl_free(array, board='pynq-z2'):
+    '''Return an array from pl_allocate to the pool.'''
+    PLBufferPool.get(board).release(array)
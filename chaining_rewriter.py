@@ -3,9 +3,10 @@ import copy
 
 from utils import *
 from nodes import *
+from visitors import PLVisitor
 
 
-class PLChainingRewriter:
+class PLChainingRewriter(PLVisitor):
     NOT_IN_CHAINING_OR_DONT_CARE = 0
     IN_CHAINING = 1
     IN_CHAINING_AND_TOP_NODE = 2
@@ -19,9 +20,8 @@ class PLChainingRewriter:
         if self.debug:
             print(f'Visiting {node.__class__.__name__}, {node}')
 
-        method = 'visit_' + node.__class__.__name__
-        visitor = getattr(self, method, self.generic_visit)
-        visit_return = visitor(node, stmt_node)
+        visitor = self.dispatch(node)
+        visit_return = visitor(self, node, stmt_node)
 
         # If visit_return == IN_CHAINING_AND_TOP_NODE, wrap the current node with a new PLChainingTop to handle this
         if visit_return == self.IN_CHAINING_AND_TOP_NODE:
@@ -29,7 +29,7 @@ class PLChainingRewriter:
             node.pl_type.dim = 0
             node.pl_shape = ()  # can safely change the PLChainingTop.stmt typer information to scalar now
             replace_child(node.parent, node, new_PLChainingTop)
-            node.parent = new_PLChainingTop
+            link_child(new_PLChainingTop, node, 'stmt')
             return self.NOT_IN_CHAINING_OR_DONT_CARE  # no chaining to handle at this moment
 
         return visit_return
@@ -255,7 +255,7 @@ class PLChainingRewriter:
                 new_PLSubscript.pl_type.dim = 0
 
             replace_child(node.parent, node, new_PLSubscript)
-            node.parent = new_PLSubscript
+            link_child(new_PLSubscript, node, 'var')
             return self.IN_CHAINING
         else:
             return self.NOT_IN_CHAINING_OR_DONT_CARE
@@ -1,10 +1,10 @@
-import copy
 from nodes import *
 from cgen.c_ast import *
 from cgen.pylog_cast import *
 from cgen.c_generator import *
 from typer import PLType
 import IPanalyzer
+from visitors import PLVisitor
 
 
 def filter_none(lst):
@@ -12,13 +12,7 @@ def filter_none(lst):
 
 
 def is_in_chaining(node):
-    if isinstance(node, PLChainingTop):
-        return True
-    while hasattr(node, 'parent'):
-        node = node.parent
-        if isinstance(node, PLChainingTop):
-            return True
-    return False
+    return chaining_top(node) is not None
 
 
 class CCode:
@@ -67,7 +61,7 @@ class CCode:
         return generator.visit(self.ast)
 
 
-class PLCodeGenerator:
+class PLCodeGenerator(PLVisitor):
     def __init__(self, arg_info=None,
                        backend='vhls',
                        board='ultra96',
@@ -80,6 +74,7 @@ class PLCodeGenerator:
         self.num_mem_ports = 4
         self.recordip = 0
         self.max_idx = 1
+        self.return_type = 'void'
     ##@@ project_path
     def codegen(self, node, project_path, config=None):
         self.project_path = project_path
@@ -115,11 +110,10 @@ class PLCodeGenerator:
 
     def visit(self, node, config=None):
         """Visit a node."""
-        method = 'visit_' + node.__class__.__name__
-        visitor = getattr(self, method, self.generic_visit)
+        visitor = self.dispatch(node)
         if self.debug:
             print(f'CODEGEN visiting {node.__class__.__name__}: {node}')
-        visit_return = visitor(node, config)
+        visit_return = visitor(self, node, config)
         return visit_return
 
     def generic_visit(self, node, config=None):
@@ -549,8 +543,51 @@ class PLCodeGenerator:
 
                 sim_for = [merlin_pragma, sim_for]
 
+        if self.backend == 'swemu' and node.source == 'map' and \
+           not self.in_map_loop(node) and self.map_parallel(node):
+            sim_for = [Pragma('omp parallel for'), sim_for]
+
         return sim_for
 
+    def map_parallel(self, node):
+        '''Whether the iterations of a map loop are shown independent: no
+           array it writes is also read, it assigns no variable declared
+           outside it and passes no whole array to a call.'''
+        from partition import array_accesses
+        accesses = array_accesses(node.body)
+        written = { name for name, _, write in accesses if write }
+        read = { name for name, _, write in accesses if not write }
+        if written & read:
+            return False
+        local = set()
+        for n in plnode_walk(node):
+            if isinstance(n, PLFor):
+                local.add(n.target.name)
+            elif isinstance(n, (PLVariableDecl, PLArrayDecl)):
+                local.add(n.name.name)
+            elif isinstance(n, PLAssign) and \
+                 isinstance(n.target, PLVariable) and \
+                 getattr(n, 'is_decl', False):
+                local.add(n.target.name)
+        for n in plnode_walk(node):
+            if isinstance(n, PLAssign) and \
+               isinstance(n.target, PLVariable) and \
+               n.target.name not in local:
+                return False
+            if isinstance(n, PLCall) and \
+               any(isinstance(arg, PLVariable) and \
+                   getattr(arg, 'pl_shape', ()) not in {(), (1,)} \
+                   for arg in n.args):
+                return False
+        return True
+
+    def in_map_loop(self, node):
+        while hasattr(node, 'parent'):
+            node = node.parent
+            if isinstance(node, PLFor) and node.source == 'map':
+                return True
+        return False
+
     def visit_PLWhile(self, node, config=None):
         while_body = Compound(block_items=self.visit(node.body, config))
         while_stmt = While(cond=self.visit(node.test, config),
@@ -596,6 +633,7 @@ class PLCodeGenerator:
                                for e in node.decorator_list]
             if "pylog" in decorator_names:
                 self.top_func_name = node.name
+                self.return_type = node.return_type.ty
                 self.return_void = (node.return_type.ty == 'void')
 
                 if self.backend == 'vhls':
@@ -620,13 +658,10 @@ class PLCodeGenerator:
 
     def visit_PLLambda(self, node, config=None):
         if hasattr(node, 'arg_map') and hasattr(node, 'target'):
-            new_config = copy.deepcopy(config)
-            if new_config is None:
-                new_config = {'arg_map': node.arg_map,
-                              'target': node.target}
-            else:
-                new_config['arg_map'] = node.arg_map
-                new_config['target'] = node.target
+            frame = {'arg_map': node.arg_map, 'target': node.target}
+            if not isinstance(config, PLScope):
+                config = PLScope(config or {})
+            new_config = config.push(frame)
 
         else:
             new_config = config
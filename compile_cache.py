@@ -0,0 +1,267 @@
+import io
+import os
+import ast
+import json
+import pickle
+import hashlib
+
+from config import FUSE_MAPS, AUTO_UNROLL_TRIP, AUTO_UNROLL_OPS
+from visitors import recursion_budget
+
+# Bump when a compiler pass changes the generated code, so that stale
+# on-disk entries are not reused.
+PYLOG_CACHE_VERSION = 10
+
+CACHE_DIR_NAME = '.pylog_cache'
+
+# Bump when the layout of the PyLog IR nodes changes, so that pickled IR
+# from an older tree is not loaded.
+PYLOG_IR_FORMAT = 1
+
+
+def compile_options():
+    '''Options of config.py that change the generated code.'''
+    return { 'FUSE_MAPS':        FUSE_MAPS,
+             'AUTO_UNROLL_TRIP': AUTO_UNROLL_TRIP,
+             'AUTO_UNROLL_OPS':  AUTO_UNROLL_OPS }
+
+
+def cache_key(src, arg_info, backend, board, freq, path, design=None):
+    '''Content hash identifying one compilation of a PyLog kernel.'''
+    key_info = {
+        'version':  PYLOG_CACHE_VERSION,
+        'src':      src,
+        'arg_info': [ (name, type_name, list(shape)) \
+                      for name, (type_name, shape) in arg_info.items() ],
+        'backend':  backend,
+        'board':    board,
+        'freq':     freq,
+        'path':     path,
+        'options':  compile_options()
+    }
+    if design:
+        key_info['design'] = design
+    key_str = json.dumps(key_info, sort_keys=True)
+    return hashlib.sha256(key_str.encode('UTF-8')).hexdigest()
+
+
+def ir_key(src, arg_info, stage, backend=None, design=None, freq=None):
+    '''Content hash identifying the PyLog IR of a kernel after stage:
+       'typed' (front end) depends on the source and arguments only,
+       'optimized' (optimizer and chaining rewriter) also on the backend,
+       the design and the frequency.'''
+    key_info = {
+        'version':  PYLOG_CACHE_VERSION,
+        'format':   PYLOG_IR_FORMAT,
+        'stage':    stage,
+        'src':      src,
+        'arg_info': [ (name, type_name, list(shape)) \
+                      for name, (type_name, shape) in arg_info.items() ]
+    }
+    if stage != 'typed':
+        key_info['backend'] = backend
+        key_info['design'] = design
+        key_info['freq'] = freq
+        key_info['options'] = compile_options()
+    key_str = json.dumps(key_info, sort_keys=True)
+    return hashlib.sha256(key_str.encode('UTF-8')).hexdigest()
+
+
+class PLIRPickler(pickle.Pickler):
+    '''Leaves out the Python AST behind the nodes (ast_node), which no
+       pass after the analyzer reads.'''
+
+    def persistent_id(self, obj):
+        if isinstance(obj, ast.AST):
+            return 'ast'
+        return None
+
+
+class PLIRUnpickler(pickle.Unpickler):
+
+    def persistent_load(self, pid):
+        return None
+
+
+def dump_ir(top_func, pylog_ir):
+    '''Serialize a PyLog IR (with its top function name) to bytes.'''
+    buf = io.BytesIO()
+    with recursion_budget(pylog_ir):
+        PLIRPickler(buf, protocol=pickle.HIGHEST_PROTOCOL).dump(
+            (PYLOG_IR_FORMAT, top_func, pylog_ir))
+    return buf.getvalue()
+
+
+def load_ir(data):
+    '''Inverse of dump_ir: (top_func, pylog_ir), or None if data was
+       written by another IR format.'''
+    ir_format, top_func, pylog_ir = PLIRUnpickler(io.BytesIO(data)).load()
+    if ir_format != PYLOG_IR_FORMAT:
+        return None
+    return top_func, pylog_ir
+
+
+class PLIRCache:
+    '''PyLog IR of kernels between passes, so that compilations that differ
+       only in later passes restart from it: pylog_compile stores the IR
+       after the front end and after the optimizer and chaining rewriter,
+       and only the code generator reruns for another board. Entries are
+       kept in memory as bytes (see dump_ir), since passes modify the IR in
+       place and every lookup must return a fresh copy, and on disk as
+       {key}.ir in the directory of PLCompileCache, so that worker
+       processes and new processes can load them.
+    '''
+
+    def __init__(self):
+        self.entries = {}
+
+    def cache_dir(self, path):
+        return f'{path}/{CACHE_DIR_NAME}'
+
+    def lookup(self, key, path):
+        '''(top_func, pylog_ir) for key, or None on a miss.'''
+        data = self.entries.get(key)
+        if data is None:
+            ir_file = f'{self.cache_dir(path)}/{key}.ir'
+            if not os.path.exists(ir_file):
+                return None
+            try:
+                with open(ir_file, 'rb') as fin:
+                    data = fin.read()
+            except OSError:
+                return None
+        try:
+            result = load_ir(data)
+        except (pickle.UnpicklingError, AttributeError, EOFError,
+                ImportError, IndexError, TypeError, ValueError):
+            # written by an incompatible tree
+            result = None
+        if result is not None:
+            self.entries[key] = data
+        return result
+
+    def insert(self, key, path, top_func, pylog_ir, persist=True):
+        '''Snapshot pylog_ir; later changes to it do not affect the
+           entry.'''
+        data = dump_ir(top_func, pylog_ir)
+        self.entries[key] = data
+        if persist:
+            cache_dir = self.cache_dir(path)
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir, exist_ok=True)
+            tmp_file = f'{cache_dir}/{key}.ir.{os.getpid()}.tmp'
+            with open(tmp_file, 'wb') as fout:
+                fout.write(data)
+            os.replace(tmp_file, f'{cache_dir}/{key}.ir')
+
+    def clear(self):
+        self.entries.clear()
+
+
+class PLCompileCache:
+    '''Compile results of @pylog kernels, kept in memory and indexed on disk.
+
+       An entry records what the wrapper needs after pylog_compile:
+       project_path, top_func, max_idx, return_type, return_void and the
+       generated HLS C code. The disk index lives in
+       {WORKSPACE}/.pylog_cache, one {key}.json plus {key}.cpp per entry, so
+       that a new process can reuse the generated code without rerunning
+       any pass.
+    '''
+
+    def __init__(self):
+        self.entries = {}
+        # key of the entry whose code currently sits in each project_path
+        self.current = {}
+
+    def cache_dir(self, path):
+        return f'{path}/{CACHE_DIR_NAME}'
+
+    def lookup(self, key, path, restore=True):
+        '''Return the entry for key, or None on a miss. With restore, the
+           generated code is also put back into the project directory.'''
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.load(key, path)
+            if entry is None:
+                return None
+            self.entries[key] = entry
+
+        if restore and self.current.get(entry['project_path']) != key:
+            self.restore(entry)
+        return entry
+
+    def insert(self, key, path, entry, persist=True, written=True):
+        '''Add a freshly compiled entry. written tells whether its code was
+           just written into the project directory.'''
+        self.entries[key] = entry
+        if written:
+            self.current[entry['project_path']] = key
+        else:
+            self.current.pop(entry['project_path'], None)
+        if persist:
+            self.store(key, path, entry)
+
+    def restore(self, entry):
+        '''Put the cached HLS C code back into the project directory when
+           another compilation of the same top function overwrote it.'''
+        project_path = entry['project_path']
+        output_file = f"{project_path}/{entry['top_func']}.cpp"
+
+        if os.path.exists(output_file):
+            with open(output_file) as fin:
+                if fin.read() == entry['hls_c']:
+                    self.current[project_path] = entry['key']
+                    return
+
+        if not os.path.exists(project_path):
+            os.makedirs(project_path)
+        with open(output_file, 'w') as fout:
+            fout.write(entry['hls_c'])
+        self.current[project_path] = entry['key']
+
+    def load(self, key, path):
+        index_file = f'{self.cache_dir(path)}/{key}.json'
+        code_file = f'{self.cache_dir(path)}/{key}.cpp'
+        if not (os.path.exists(index_file) and os.path.exists(code_file)):
+            return None
+
+        try:
+            with open(index_file) as fin:
+                entry = json.load(fin)
+            with open(code_file) as fin:
+                entry['hls_c'] = fin.read()
+        except (OSError, ValueError):
+            return None
+
+        if entry.get('version') != PYLOG_CACHE_VERSION:
+            return None
+        return entry
+
+    def store(self, key, path, entry):
+        cache_dir = self.cache_dir(path)
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+
+        index = { k: v for k, v in entry.items() if k != 'hls_c' }
+        index['version'] = PYLOG_CACHE_VERSION
+
+        # write to temporary files first so that concurrent readers never
+        # see a partially written entry
+        for ext, content in (('cpp', entry['hls_c']),
+                             ('json', json.dumps(index, indent=2))):
+            tmp_file = f'{cache_dir}/{key}.{ext}.{os.getpid()}.tmp'
+            with open(tmp_file, 'w') as fout:
+                fout.write(content)
+            os.replace(tmp_file, f'{cache_dir}/{key}.{ext}')
+
+    def clear(self, path=None):
+        self.entries.clear()
+        self.current.clear()
+        if path is not None and os.path.exists(self.cache_dir(path)):
+            for f in os.listdir(self.cache_dir(path)):
+                os.remove(f'{self.cache_dir(path)}/{f}')
+
+
+PYLOG_COMPILE_CACHE = PLCompileCache()
+PYLOG_IR_CACHE = PLIRCache()
@@ -16,3 +16,38 @@ TARGET_BASE = os.getcwd() + '/pylog_projects'
 TEMPLATE_DIR = PYLOG_ROOT_DIR + '/boards/'
 
 HLS_CMD = 'vitis_hls'
+
+# Used in swemu.py
+SWEMU_CXX = 'g++'
+SWEMU_CXXFLAGS = '-std=c++11 -O3 -Wno-unknown-pragmas -shared -fPIC'
+SWEMU_INCLUDE_DIR = PYLOG_ROOT_DIR + '/swemu_include'
+
+# Upper bound of device memory kept by the runtime buffer pool (bytes)
+BUFFER_POOL_BYTES = 128 * 1024 * 1024
+
+# Parallel HLS runs when design-space exploration verifies its Pareto front
+DSE_HLS_JOBS = 4
+
+# Used in scheduler.py: cores and memory (GB) shared by concurrent builds,
+# and what one HLS-only or full (HLS + Vivado) build is assumed to need
+BUILD_CORES = os.cpu_count() or 1
+BUILD_MEMORY_GB = os.sysconf('SC_PAGE_SIZE') * \
+                  os.sysconf('SC_PHYS_PAGES') / 2**30
+HLS_JOB_CORES = 1
+HLS_JOB_MEMORY_GB = 4
+SYN_JOB_CORES = 2
+SYN_JOB_MEMORY_GB = 12
+
+# SQLite database of HLS results, see results_db.py
+RESULTS_DB = WORKSPACE + '/.pylog_results.db'
+
+# Used in optimizer.py by the automatic loop optimization (mode 'autoopt'):
+# inner loops with at most AUTO_UNROLL_TRIP iterations are fully unrolled
+# as long as the unrolled body has at most AUTO_UNROLL_OPS operations
+AUTO_UNROLL_TRIP = 8
+AUTO_UNROLL_OPS = 64
+
+# Used in optimizer.py by mode 'autoopt': fuse the loop nests of consecutive
+# plmaps with the same iteration domain, turning intermediate arrays into
+# scalars (fusion.py)
+FUSE_MAPS = True
@@ -0,0 +1,317 @@
+import re
+import math
+
+from nodes import *
+from partition import affine, array_accesses
+from optimizer import const_trip_count
+
+# result of the dependence test of one dimension, or of a pair of accesses
+INDEPENDENT = 'independent'
+ALL = 'all'         # the same element in every pair of iterations
+MAYBE = 'maybe'     # not decided
+
+
+class PLDependence:
+    '''A dependence of loop on array between two accesses.
+
+       kind:     'RAW', 'WAR' or 'WAW'
+       carried:  loop-carried (between iterations) or intra-iteration
+       distance: in iterations of loop, None if any distance
+       proven:   the dependence exists; otherwise it could not be ruled out
+    '''
+
+    def __init__(self, array, kind, carried, distance, proven):
+        self.array = array
+        self.kind = kind
+        self.carried = carried
+        self.distance = distance
+        self.proven = proven
+
+    def __repr__(self):
+        return f"{self.kind}({self.array}, " + \
+               ('inter' if self.carried else 'intra') + \
+               (f', d={self.distance}' if self.distance is not None else '') + \
+               ('' if self.proven else ', maybe') + ')'
+
+
+class PLDependenceAnalyzer:
+    '''Loop-carried and intra-iteration dependences of array accesses.
+
+       For every loop, pairs of accesses to the same array (at least one of
+       them a write) in its body are tested dimension by dimension, with
+       indices that are affine in the loop iterators: a dimension indexed
+       by the loop iterator with the same coefficient in both accesses
+       gives an exact distance (strong SIV test); otherwise the GCD test and
+       the bounds of the iterators can rule a dependence out. Indices with
+       other variables assigned in the loop, or that are not affine, and
+       arrays passed to calls decide nothing.
+
+       check_pragmas warns about DEPENDENCE ... false pragmas of the user
+       that a proven dependence contradicts; insert_pragmas adds DEPENDENCE
+       pragmas to pipelined loops where independence (or the distance of
+       the dependences) is proven.
+    '''
+
+    def __init__(self, debug=False):
+        self.debug = debug
+
+    def analyze(self, loops):
+        '''{path: (loop, [PLDependence, ...])} of loops and their nested
+           loops.'''
+        self.results = {}
+        self.analyze_loops(loops, '')
+        if self.debug:
+            for path, (loop, deps) in self.results.items():
+                print(f'PLDependenceAnalyzer loop {path}', deps)
+        return self.results
+
+    def analyze_loops(self, loops, prefix):
+        for i, loop in enumerate(loops):
+            path = f'{prefix}{i}'
+            self.results[path] = (loop, self.loop_dependences(loop.plnode))
+            self.analyze_loops(loop.subloops, f'{path}.')
+
+    ######## Dependences of a loop ########
+
+    def loop_dependences(self, plfor):
+        var = plfor.target.name
+        self.ranges = { var: self.iter_range(plfor) }
+        self.assigned = set()
+        opaque = set()
+        for node in plnode_walk(plfor.body):
+            if isinstance(node, PLFor):
+                self.ranges[node.target.name] = self.iter_range(node)
+            elif isinstance(node, PLAssign) and \
+                 isinstance(node.target, PLVariable):
+                self.assigned.add(node.target.name)
+            elif isinstance(node, PLVariableDecl):
+                self.assigned.add(node.name.name)
+            elif isinstance(node, PLCall):
+                opaque.update(arg.name for arg in node.args \
+                              if isinstance(arg, PLVariable))
+        self.assigned -= set(self.ranges)
+
+        step = plfor.iter_dom.step
+        step = step.value if isinstance(step, PLConst) else None
+        trip = const_trip_count(plfor)
+
+        accesses = array_accesses(plfor.body)
+        deps = []
+        for p, (name, p_idx, p_write) in enumerate(accesses):
+            for q in range(p, len(accesses)):
+                q_name, q_idx, q_write = accesses[q]
+                if q_name != name or not (p_write or q_write) or \
+                   (p == q and not p_write):
+                    continue
+                if name in opaque or len(p_idx) != len(q_idx) or \
+                   not isinstance(step, int) or step == 0:
+                    result, proven = None, False
+                else:
+                    result, proven = self.distance(p_idx, q_idx, var, step,
+                                                   trip)
+                if result == INDEPENDENT:
+                    continue
+                deps += self.classify(name, result, proven, p == q,
+                                      p_write, q_write, trip)
+        return deps
+
+    def classify(self, name, distance, proven, same, p_write, q_write,
+                 trip):
+        '''Dependences between accesses p and q (p first in the body) to
+           the same element when q runs distance iterations after p (None:
+           any distance).'''
+        kinds = {(True, False): 'RAW', (False, True): 'WAR',
+                 (True, True): 'WAW'}
+        # a loop-carried dependence needs two iterations
+        carried_proven = proven and trip is not None and trip > 1
+        deps = []
+        if distance is None:
+            orders = [(p_write, q_write)] if same else \
+                     [(p_write, q_write), (q_write, p_write)]
+            for order in orders:
+                deps.append(PLDependence(name, kinds[order], True, None,
+                                         carried_proven))
+            if not same:
+                deps.append(PLDependence(name, kinds[(p_write, q_write)],
+                                         False, 0, proven))
+        elif distance == 0:
+            if not same:
+                deps.append(PLDependence(name, kinds[(p_write, q_write)],
+                                         False, 0, proven))
+        else:
+            order = (p_write, q_write) if distance > 0 else \
+                    (q_write, p_write)
+            deps.append(PLDependence(name, kinds[order], True,
+                                     abs(distance), carried_proven))
+        return deps
+
+    def distance(self, p_idx, q_idx, var, step, trip):
+        '''(distance, proven): the distance in iterations of var at which
+           access q_idx reaches the element p_idx accessed (None: any
+           distance), or INDEPENDENT.'''
+        exact = set()
+        proven = True
+        for p_index, q_index in zip(p_idx, q_idx):
+            result = self.dim_distance(affine(p_index), affine(q_index),
+                                       var, step, trip)
+            if result == INDEPENDENT:
+                return INDEPENDENT, True
+            if result == MAYBE:
+                proven = False
+            elif result != ALL:
+                exact.add(result)
+        if len(exact) > 1:
+            return INDEPENDENT, True
+        if exact:
+            return exact.pop(), proven
+        return None, proven
+
+    def dim_distance(self, a, b, var, step, trip):
+        '''Test of one dimension with affine indices a (first access) and
+           b: INDEPENDENT, ALL, MAYBE or the exact distance.'''
+        if a is None or b is None:
+            return MAYBE
+        names = (set(a) | set(b)) - {None}
+        if names & self.assigned:
+            return MAYBE
+        # variables not changing in the loop must appear alike
+        invariant = lambda e: { v: c for v, c in e.items() \
+                                if v is not None and v not in self.ranges }
+        if invariant(a) != invariant(b):
+            return MAYBE
+        va = { v: c for v, c in a.items() if v in self.ranges }
+        vb = { v: c for v, c in b.items() if v in self.ranges }
+        # sum(va x) - sum(vb y) = diff
+        diff = b.get(None, 0) - a.get(None, 0)
+
+        if not va and not vb:
+            return ALL if diff == 0 else INDEPENDENT
+        if set(va) == set(vb) == {var} and va[var] == vb[var]:
+            # c x - c y = diff: y - x = -diff / c
+            c = va[var]
+            if diff % c or (-diff // c) % step:
+                return INDEPENDENT
+            d = (-diff // c) // step
+            if trip is not None and abs(d) >= trip:
+                return INDEPENDENT
+            return d
+
+        g = 0
+        for c in list(va.values()) + list(vb.values()):
+            g = math.gcd(g, c)
+        if diff % g:
+            return INDEPENDENT
+        lo = hi = 0
+        for coefs, sign in ((va, 1), (vb, -1)):
+            for v, c in coefs.items():
+                if self.ranges[v] is None:
+                    return MAYBE
+                first, last = self.ranges[v]
+                lo += min(sign * c * first, sign * c * last)
+                hi += max(sign * c * first, sign * c * last)
+        if not lo <= diff <= hi:
+            return INDEPENDENT
+        return MAYBE
+
+    def iter_range(self, plfor):
+        '''First and last value of the iterator of a loop with constant
+           bounds, or None.'''
+        trip = const_trip_count(plfor)
+        if not trip:
+            return None
+        start = plfor.iter_dom.start.value
+        last = start + (trip - 1) * plfor.iter_dom.step.value
+        return (min(start, last), max(start, last))
+
+    ######## Pragmas ########
+
+    def check_pragmas(self, node):
+        '''Warn about DEPENDENCE ... false pragmas contradicted by a proven
+           dependence of a loop they apply to (the loop whose body has the
+           pragma, or every loop of the function).'''
+        paths = { id(loop.plnode): path \
+                  for path, (loop, _) in self.results.items() }
+        for n in plnode_walk(node):
+            if isinstance(n, (PLFor, PLFunctionDef)):
+                for stmt in n.body:
+                    pragma = dependence_pragma(stmt)
+                    if pragma is None or pragma['dependent']:
+                        continue
+                    scope = [n] if isinstance(n, PLFor) else \
+                            [ l for l in plnode_walk(n.body) \
+                              if isinstance(l, PLFor) ]
+                    for plfor in scope:
+                        if id(plfor) in paths:
+                            self.check_pragma(pragma, paths[id(plfor)])
+
+    def check_pragma(self, pragma, path):
+        loop, deps = self.results[path]
+        for dep in deps:
+            if dep.proven and dep.array == pragma['variable'] and \
+               dep.carried == (pragma['class'] != 'intra') and \
+               pragma['type'] in (None, dep.kind):
+                what = 'a loop-carried' if dep.carried else \
+                       'an intra-iteration'
+                print(f"WARNING: pragma '{pragma['text']}' is wrong: loop " + \
+                      f"{path} ({loop.plnode.target.name}) has {what} " + \
+                      f"{dep.kind} dependence on {dep.array}" + \
+                      (f' with distance {dep.distance}' \
+                       if dep.distance else '') + '.')
+                return
+
+    def insert_pragmas(self, plfors):
+        '''Add DEPENDENCE pragmas to the bodies of the pipelined loops in
+           plfors, for the arrays they update: inter false if no loop-carried
+           dependence is possible, inter RAW distance=d true if all of them
+           are read-after-writes at a proven distance d > 1. Returns
+           (path, loop variable, pragma) of each.'''
+        inserted = []
+        for path, (loop, deps) in self.results.items():
+            plfor = loop.plnode
+            if id(plfor) not in plfors or plfor.iter_dom.attr != 'pipeline':
+                continue
+            user = { p['variable'] for p in map(dependence_pragma,
+                                                plfor.body) if p }
+            # arrays written, and read or written again: a single write
+            # has no dependence to relax
+            counts = {}
+            for name, _, write in array_accesses(plfor.body):
+                reads, writes = counts.get(name, (0, 0))
+                counts[name] = (reads + (not write), writes + write)
+            for name, (reads, writes) in counts.items():
+                if name in user or not writes or reads + writes < 2:
+                    continue
+                carried = [ d for d in deps if d.array == name and d.carried ]
+                if not carried:
+                    pragma = f'HLS DEPENDENCE variable={name} inter false'
+                elif all(d.proven and d.kind == 'RAW' and d.distance \
+                         for d in carried) and \
+                     min(d.distance for d in carried) > 1:
+                    distance = min(d.distance for d in carried)
+                    pragma = f'HLS DEPENDENCE variable={name} inter RAW ' + \
+                             f'distance={distance} true'
+                else:
+                    continue
+                plfor.body.insert(0, PLPragma(PLConst(pragma)))
+                link_field(plfor, 'body')
+                inserted.append((path, plfor.target.name, pragma))
+        return inserted
+
+
+def dependence_pragma(stmt):
+    '''Fields of a DEPENDENCE pragma statement, or None.'''
+    if not isinstance(stmt, PLPragma) or \
+       not isinstance(stmt.pragma, PLConst):
+        return None
+    text = str(stmt.pragma.value)
+    words = text.split()
+    if len(words) < 2 or words[1].upper() != 'DEPENDENCE':
+        return None
+    lower = [ w.lower() for w in words ]
+    args = dict(re.findall(r'(\w+)\s*=\s*(\w+)', text))
+    kind = [ w.upper() for w in words if w.upper() in ('RAW', 'WAR', 'WAW') ]
+    return {'text': text,
+            'variable': args.get('variable'),
+            'class': 'intra' if 'intra' in lower else 'inter',
+            'type': kind[0] if kind else None,
+            'dependent': 'false' not in lower}
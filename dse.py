@@ -0,0 +1,281 @@
+import os
+import json
+import random
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+from nodes import *
+from optimizer import PLOptimizer, get_loop_structure
+from estimator import PLEstimator, board_resources
+from codegen import PLCodeGenerator
+from chaining_rewriter import PLChainingRewriter
+from sysgen import PLSysGen
+from compile_cache import cache_key
+from results_db import PLResultsDB
+
+# candidate tile sizes, unroll and cyclic partition factors
+DSE_FACTORS = (2, 4, 8, 16)
+# loops whose body would be unrolled more than this are not pipelined
+DSE_MAX_UNROLL = 256
+# arrays up to this size may be partitioned completely
+DSE_MAX_COMPLETE = 64
+
+
+class PLDSE:
+    '''Design-space exploration of a typed PyLog kernel.
+
+       A design point (see PLOptimizer) combines a schedule of each plmap
+       loop nest (none, an interchange or a tile from iter_schedule), for
+       each top-level loop nest either nothing, pipelining one of its loops
+       or unrolling its innermost loop, and a partitioning of each local
+       array. All points are scored with PLEstimator; points that do not fit
+       the board are dropped, and the survivors on the Pareto front of
+       latency vs. DSP/BRAM/LUT can optionally be run through HLS in
+       parallel to replace the estimates with the csynth reports. Given the
+       kernel source src, HLS results of a point already in the results
+       database (see results_db.py) are reused instead of running HLS.
+    '''
+
+    def __init__(self, pylog_ir, arg_info, backend='vhls', board='pynq-z2',
+                 freq=100.0, max_points=512, max_utilization=1.0, seed=0,
+                 src=None, debug=False):
+        self.pylog_ir = pylog_ir
+        self.src = src
+        self.arg_info = arg_info
+        self.backend = backend
+        self.board = board if board in board_resources else 'pynq-z2'
+        self.freq = freq
+        self.max_points = max_points
+        self.max_utilization = max_utilization
+        self.seed = seed
+        self.debug = debug
+
+    ######## Design space ########
+
+    def optimized(self, design):
+        '''A copy of the IR optimized with design, and its optimizer.'''
+        pylog_ir = plnode_copy(self.pylog_ir)
+        optimizer = PLOptimizer(backend=self.backend, design=design,
+                                freq=self.freq)
+        optimizer.opt(pylog_ir)
+        return pylog_ir, optimizer
+
+    def map_schedules(self):
+        '''Candidate schedules of each plmap loop nest.'''
+        maps = [ n for n in plnode_walk(self.pylog_ir) \
+                 if isinstance(n, PLMap) ]
+        choices = []
+        for plmap in maps:
+            shape = list(plmap.pl_shape)
+            schedules = [[]]
+            for a, b in itertools.combinations(range(len(shape)), 2):
+                if shape[a] > 1 and shape[b] > 1:
+                    schedules.append([['interchange', a, b]])
+            for i, n in enumerate(shape):
+                for t in DSE_FACTORS:
+                    if t < n and n % t == 0:
+                        schedules.append([['tile', i, t]])
+            choices.append(schedules)
+        return choices
+
+    def trip_count(self, loop):
+        iter_dom = loop.plnode.iter_dom
+        bounds = (iter_dom.start, iter_dom.end, iter_dom.step)
+        if iter_dom.type == 'expr' or \
+           not all(isinstance(b, PLConst) for b in bounds) or \
+           not iter_dom.step.value:
+            return None
+        return max(0, -(-(iter_dom.end.value - iter_dom.start.value) // \
+                        iter_dom.step.value))
+
+    def nest_choices(self, loop, path):
+        '''Loop directives for the loop nest rooted at loop.'''
+        choices = [{}]
+
+        def visit(loop, path):
+            # trip count of everything below loop, unrolled when pipelined
+            inner = 1
+            for i, sub in enumerate(loop.subloops):
+                inner *= visit(sub, f'{path}.{i}') or DSE_MAX_UNROLL + 1
+            if inner <= DSE_MAX_UNROLL:
+                choices.append({path: ['pipeline']})
+            trip = self.trip_count(loop)
+            if not loop.subloops and trip:
+                for f in DSE_FACTORS:
+                    if f < trip and trip % f == 0:
+                        choices.append({path: ['unroll', f]})
+            return inner * trip if trip else None
+
+        visit(loop, path)
+        return choices
+
+    def partition_choices(self, pylog_ir):
+        '''Partitionings of each local array.'''
+        choices = []
+        for node in plnode_walk(pylog_ir):
+            if not isinstance(node, PLArrayDecl):
+                continue
+            name = node.name.name
+            dims = [ e.value for e in node.dims.elts ]
+            options = [{}]
+            for dim, n in enumerate(dims, 1):
+                for f in DSE_FACTORS:
+                    if f < n and n % f == 0:
+                        options.append({name: ['cyclic', f, dim]})
+                if n <= DSE_MAX_COMPLETE:
+                    options.append({name: ['complete', None, dim]})
+            choices.append(options)
+        return choices
+
+    def designs(self):
+        '''All design points, sampled down to max_points.'''
+        rng = random.Random(self.seed)
+        points = []
+        schedule_space = list(itertools.product(*self.map_schedules()))
+        for schedules in schedule_space:
+            base = {'schedules': [ list(s) for s in schedules ]}
+            pylog_ir, optimizer = self.optimized(base)
+
+            axes = [ self.nest_choices(loop, str(i)) \
+                     for i, loop in enumerate(optimizer.loops) ]
+            axes += self.partition_choices(pylog_ir)
+
+            space = []
+            for combo in itertools.product(*axes):
+                design = dict(base, loops={}, partitions={})
+                for choice in combo:
+                    for key, value in choice.items():
+                        if isinstance(value[0], str) and \
+                           value[0] in {'pipeline', 'unroll'}:
+                            design['loops'][key] = value
+                        else:
+                            design['partitions'][key] = value
+                space.append(design)
+                if len(space) > self.max_points * 8:
+                    break
+            points += space
+
+        if len(points) > self.max_points:
+            # keep the default design, sample the rest
+            points = points[:1] + rng.sample(points[1:], self.max_points - 1)
+        return points
+
+    ######## Evaluation ########
+
+    def estimate(self, design):
+        pylog_ir, _ = self.optimized(design)
+        estimator = PLEstimator(board=self.board, freq=self.freq)
+        result = estimator.estimate(pylog_ir)
+        return {
+            'design': design,
+            'latency': result['latency'],
+            'resources': result['resources'],
+            'utilization': result['utilization'],
+            'source': 'estimate'
+        }
+
+    def fits(self, point):
+        return all(u <= self.max_utilization \
+                   for u in point['utilization'].values())
+
+    def pareto(self, points):
+        '''Points not dominated in latency and every resource.'''
+        def objectives(p):
+            return (p['latency'],) + tuple(p['resources'][k] \
+                                           for k in ('DSP', 'BRAM', 'LUT'))
+
+        front = []
+        for p in points:
+            op = objectives(p)
+            dominated = False
+            for q in points:
+                oq = objectives(q)
+                if oq != op and all(a <= b for a, b in zip(oq, op)):
+                    dominated = True
+                    break
+            if not dominated and \
+               all(objectives(f) != op for f in front):
+                front.append(p)
+        return sorted(front, key=lambda p: p['latency'])
+
+    def hls_eval(self, points, path, top_func, jobs):
+        '''Replace the estimates of points with HLS results, running up to
+           jobs HLS processes at a time.'''
+
+        results_db = PLResultsDB()
+
+        def run(idx, point):
+            project_path = f'{path}/{top_func}_dse/p{idx}'
+            key = cache_key(self.src, self.arg_info, self.backend, self.board,
+                            self.freq, path, point['design']) \
+                  if self.src is not None else None
+
+            previous = results_db.latest(key) if key is not None else None
+            if previous is not None:
+                record = previous['record']
+            else:
+                if not os.path.exists(project_path):
+                    os.makedirs(project_path)
+
+                pylog_ir, _ = self.optimized(point['design'])
+                PLChainingRewriter().visit(pylog_ir)
+                codegen = PLCodeGenerator(self.arg_info, backend=self.backend,
+                                          board=self.board)
+                with open(f'{project_path}/{top_func}.cpp', 'w') as fout:
+                    fout.write(codegen.codegen(pylog_ir, project_path))
+
+                config = {
+                    'project_name': top_func,
+                    'project_path': project_path,
+                    'freq': self.freq,
+                    'top_name': top_func,
+                    'num_bundles': codegen.max_idx,
+                    'cache_key': key
+                }
+                record = PLSysGen(backend=self.backend, board=self.board) \
+                    .generate_system(config, run_hls=True, run_syn=False)
+
+            if record is None or record['latency'] is None:
+                print(f'WARNING: HLS of design point {idx} failed.')
+                return point
+
+            resources = { k: record['resources'][k] or 0 \
+                          for k in ('DSP', 'BRAM', 'LUT') }
+            available = board_resources[self.board]
+            return dict(point,
+                        latency=record['latency'],
+                        resources=resources,
+                        utilization={ k: resources[k] / available[k] \
+                                      for k in resources },
+                        source='hls')
+
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            return list(pool.map(run, range(len(points)), points))
+
+    def explore(self, path=None, top_func=None, hls_jobs=0):
+        '''Returns the Pareto front, best (lowest latency) point first.'''
+        designs = self.designs()
+        print(f'DSE: estimating {len(designs)} design points ...')
+
+        points = [ self.estimate(d) for d in designs ]
+        survivors = [ p for p in points if self.fits(p) ]
+        print(f'DSE: {len(survivors)} fit on {self.board}')
+        front = self.pareto(survivors)
+
+        if hls_jobs and front:
+            print(f'DSE: running HLS on {len(front)} Pareto points ...')
+            front = self.pareto([ p for p in \
+                                  self.hls_eval(front, path, top_func,
+                                                hls_jobs) \
+                                  if self.fits(p) ])
+        return front
+
+
+def dse_report(front):
+    lines = ['== Pareto front (latency vs. resources)']
+    for p in front:
+        r = p['resources']
+        lines.append(f"  latency={p['latency']:<10} DSP={r['DSP']:<6} " + \
+                     f"BRAM={r['BRAM']:<6} LUT={r['LUT']:<8} " + \
+                     f"({p['source']}) {json.dumps(p['design'])}")
+    return '\n'.join(lines)
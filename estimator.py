@@ -0,0 +1,724 @@
+import re
+import math
+import numbers
+
+from nodes import *
+
+# Analytical latency and resource model of the code Vitis HLS generates for
+# a PyLog kernel. Numbers are for 7-series/UltraScale devices at 100 MHz
+# and are scaled with the clock frequency; they are meant for ranking design
+# points quickly, not for replacing the HLS report.
+
+# operation class -> (latency in cycles at 100 MHz, DSP, LUT)
+op_cost_table = {
+    ('add', 'float'):   (4, 2, 220),
+    ('mul', 'float'):   (3, 3, 130),
+    ('div', 'float'):   (10, 0, 760),
+    ('cmp', 'float'):   (1, 0, 70),
+    ('math', 'float'):  (16, 0, 800),
+    ('add', 'double'):  (5, 3, 700),
+    ('mul', 'double'):  (6, 11, 300),
+    ('div', 'double'):  (22, 0, 3200),
+    ('cmp', 'double'):  (1, 0, 130),
+    ('math', 'double'): (30, 0, 2500),
+    ('add', 'int'):     (1, 0, 32),
+    ('mul', 'int'):     (2, 3, 20),
+    ('div', 'int'):     (36, 0, 1100),
+    ('cmp', 'int'):     (0, 0, 16),
+    ('math', 'int'):    (10, 0, 400),
+    ('logic', 'int'):   (0, 0, 32),
+    ('shift', 'int'):   (0, 0, 100),
+}
+
+op_class_map = {
+    '+': 'add', '-': 'add', '*': 'mul', '/': 'div', '%': 'div', '//': 'div',
+    '**': 'math', '<': 'cmp', '<=': 'cmp', '>': 'cmp', '>=': 'cmp',
+    '==': 'cmp', '!=': 'cmp', '&&': 'logic', '||': 'logic', '&': 'logic',
+    '|': 'logic', '^': 'logic', '~': 'logic', '!': 'logic', 'not': 'logic',
+    '<<': 'shift', '>>': 'shift'
+}
+
+# memory access latency in cycles
+BRAM_READ_LATENCY = 2
+MAXI_READ_LATENCY = 8
+STORE_LATENCY = 1
+LOOP_OVERHEAD = 1       # per iteration of a loop that is not pipelined
+PIPELINE_OVERHEAD = 2   # pipeline fill and exit
+
+# read/write ports of a BRAM bank and of an AXI master bundle
+BRAM_PORTS = 2
+MAXI_PORTS = 1
+MAXI_BUNDLES = 4        # see insert_interface_pragmas
+
+# interface logic
+MAXI_BUNDLE_LUT = 1500
+MAXI_BUNDLE_BRAM = 2
+CTRL_LUT = 300
+LOOP_LUT = 40
+
+# assumed trip count of loops whose bounds are not known statically
+DEFAULT_TRIP_COUNT = 16
+
+# available resources per board (DSP, BRAM18K, LUT)
+board_resources = {
+    'zedboard':   {'DSP': 220,   'BRAM': 280,  'LUT': 53200},
+    'pynq-z1':    {'DSP': 220,   'BRAM': 280,  'LUT': 53200},
+    'pynq-z2':    {'DSP': 220,   'BRAM': 280,  'LUT': 53200},
+    'ultra96':    {'DSP': 360,   'BRAM': 432,  'LUT': 70560},
+    'aws_f1':     {'DSP': 6840,  'BRAM': 4320, 'LUT': 1182240},
+    'alveo_u200': {'DSP': 6840,  'BRAM': 4320, 'LUT': 1182240},
+    'alveo_u250': {'DSP': 12288, 'BRAM': 5376, 'LUT': 1728000},
+    'alveo_u280': {'DSP': 9024,  'BRAM': 4032, 'LUT': 1303680},
+}
+
+
+def type_class(ty):
+    '''Operation class of a PyLog element type: float, double or int.'''
+    if ty in {'float', 'double'}:
+        return ty
+    if ty is not None and ty.startswith(('ap_fixed', 'ap_ufixed')):
+        return 'int'  # fixed-point arithmetic is integer arithmetic
+    return 'int'
+
+
+def type_width(ty):
+    '''Bit width of a PyLog element type.'''
+    m = re.match(r'ap_u?(int|fixed)<\s*([0-9]+)', ty)
+    if m:
+        return int(m.group(2))
+    return {'double': 64, 'bool': 1}.get(ty, 32)
+
+
+def op_cost(op_class, ty, freq=100.0):
+    '''Latency (cycles at freq MHz), DSP and LUT of one operation on ty.'''
+    tc = type_class(ty)
+    latency, dsp, lut = op_cost_table[(op_class, tc)]
+    latency = math.ceil(latency * freq / 100.0)
+    if tc == 'int':
+        width = type_width(ty)
+        lut = math.ceil(lut * width / 32)
+        if op_class == 'mul':
+            dsp = math.ceil(width / 18) * math.ceil(width / 25)
+    return latency, dsp, lut
+
+
+def op_latency(op, ty, freq=100.0):
+    '''Latency in cycles of binary operator op (e.g. '+') on ty.'''
+    return op_cost(op_class_map[op], ty, freq)[0]
+
+
+def bram_blocks(depth, width):
+    '''BRAM18K blocks holding depth words of width bits.'''
+    for max_width, max_depth in ((1, 16384), (2, 8192), (4, 4096),
+                                 (9, 2048), (18, 1024), (36, 512)):
+        if width <= max_width:
+            return math.ceil(depth / max_depth)
+    return math.ceil(width / 36) * math.ceil(depth / 512)
+
+
+class PLMemory:
+    '''An array as seen by the memory model.
+
+       kind:  'bram' (local array), 'reg' (completely partitioned) or
+              'maxi' (argument on an AXI master bundle)
+       banks: number of banks after array_partition
+    '''
+
+    def __init__(self, name, ty, shape, kind, bundle=None):
+        self.name = name
+        self.ty = ty
+        self.shape = shape
+        self.kind = kind
+        self.bundle = bundle
+        self.banks = 1
+        self.no_dependence = False
+
+    @property
+    def size(self):
+        return math.prod(self.shape) if self.shape else 1
+
+    @property
+    def port(self):
+        '''Memories sharing read/write ports.'''
+        return f'data{self.bundle}' if self.kind == 'maxi' else self.name
+
+    @property
+    def ports(self):
+        if self.kind == 'reg':
+            return math.inf
+        if self.kind == 'maxi':
+            return MAXI_PORTS
+        return BRAM_PORTS * self.banks
+
+    @property
+    def read_latency(self):
+        return {'reg': 0, 'bram': BRAM_READ_LATENCY,
+                'maxi': MAXI_READ_LATENCY}[self.kind]
+
+
+class PLBlockCost:
+    '''Cost of executing a list of statements once.
+
+       latency:  cycles
+       accesses: memory port -> (reads, writes)
+       updates:  read-modify-writes as (name, index variables or None for a
+                 scalar, recurrence latency), for finding loop-carried
+                 dependences
+       decls:    names declared in the block
+    '''
+
+    def __init__(self, latency=0):
+        self.latency = latency
+        self.accesses = {}
+        self.updates = []
+        self.decls = set()
+
+    def access(self, port, reads=0, writes=0):
+        r, w = self.accesses.get(port, (0, 0))
+        self.accesses[port] = (r + reads, w + writes)
+
+    def merge(self, other, copies=1):
+        for port, (r, w) in other.accesses.items():
+            self.access(port, r * copies, w * copies)
+        self.updates += other.updates
+        self.decls |= other.decls
+
+
+class PLEstimator:
+    '''Estimates latency, initiation intervals, resources and memory port
+       pressure of a PyLog kernel from its IR after PLOptimizer.opt.
+
+       Loops follow the HLS scheduling rules: a pipelined loop runs in
+       (trip - 1) * II + depth cycles and fully unrolls the loops inside it,
+       where II is bounded by loop-carried dependences (e.g. an accumulator)
+       and by the ports of the memories it accesses; other loops run their
+       body trip times, with unroll factors running copies of the body in
+       parallel. Pipeline and unroll come from the loop attributes and HLS
+       pragmas, memory banks from array_partition pragmas.
+    '''
+
+    def __init__(self, board='pynq-z2', freq=100.0, debug=False):
+        self.board = board if board in board_resources else 'pynq-z2'
+        self.freq = freq
+        self.debug = debug
+
+    def estimate(self, pylog_ir):
+        stmts = pylog_ir if isinstance(pylog_ir, list) else [pylog_ir]
+        top = None
+        for stmt in stmts:
+            if isinstance(stmt, PLFunctionDef) and stmt.pl_top:
+                top = stmt
+        assert (top is not None), 'no @pylog function found'
+
+        self.memories = {}
+        self.loops = []
+        self.resources = {'DSP': 0, 'BRAM': 0, 'LUT': CTRL_LUT}
+        self.exact = True
+        self.in_pipeline = False
+
+        bundle = -1
+        for arg in top.args:
+            if arg.pl_shape not in {(1,), ()}:
+                bundle = (bundle + 1) % MAXI_BUNDLES
+                self.memories[arg.name] = PLMemory(arg.name, arg.pl_type.ty,
+                                                   arg.pl_shape, 'maxi',
+                                                   bundle)
+        num_bundles = bundle + 1
+        self.resources['LUT'] += num_bundles * MAXI_BUNDLE_LUT
+        self.resources['BRAM'] += num_bundles * MAXI_BUNDLE_BRAM
+
+        for node in self.walk(top.body):
+            if isinstance(node, PLArrayDecl):
+                shape = tuple(e.value for e in node.dims.elts)
+                self.memories[node.name.name] = PLMemory(
+                    node.name.name, node.ele_type, shape, 'bram')
+        for node in self.walk(top.body):
+            if isinstance(node, PLPragma):
+                self.apply_pragma(self.pragma_str(node))
+        for mem in self.memories.values():
+            self.resources['BRAM'] += self.memory_blocks(mem)
+
+        cost = self.block(top.body, env={}, copies=1, in_pipeline=False)
+        latency = cost.latency + 1
+
+        pressure = {}
+        for loop in self.loops:
+            for port, info in loop['memory'].items():
+                pressure[port] = max(pressure.get(port, 0), info['pressure'])
+
+        usage = board_resources[self.board]
+        report = {
+            'top': top.name,
+            'board': self.board,
+            'freq': self.freq,
+            'latency': latency,
+            'time_us': latency / self.freq,
+            'exact_trip_counts': self.exact,
+            'loops': self.loops,
+            'resources': dict(self.resources),
+            'utilization': { k: self.resources[k] / usage[k] \
+                             for k in self.resources },
+            'memory_pressure': pressure
+        }
+        return report
+
+    def walk(self, node):
+        '''plnode_walk, also into the nested statement lists that the typer
+           inserts for buffers.'''
+        if isinstance(node, list):
+            for item in node:
+                yield from self.walk(item)
+        elif isinstance(node, PLNode):
+            yield node
+            for name, field in iter_fields(node):
+                if isinstance(field, (PLNode, list)):
+                    yield from self.walk(field)
+
+    ######## Pragmas and memories ########
+
+    def pragma_str(self, node):
+        pragma = node.pragma
+        return pragma.value if isinstance(pragma, PLConst) else str(pragma)
+
+    def pragma_args(self, pragma):
+        return dict(re.findall(r'(\w+)\s*=\s*(\w+)', pragma))
+
+    def apply_pragma(self, pragma):
+        words = pragma.split()
+        if len(words) < 2 or words[0].upper() != 'HLS':
+            return
+        directive = words[1].upper()
+        args = self.pragma_args(pragma)
+        mem = self.memories.get(args.get('variable'))
+        if mem is None:
+            return
+
+        if directive == 'ARRAY_PARTITION':
+            dim = int(args.get('dim', 1))
+            length = mem.shape[dim - 1] if 0 < dim <= len(mem.shape) \
+                                        else mem.size
+            if ' complete' in pragma.lower():
+                if dim == 0 or len(mem.shape) == 1:
+                    mem.kind = 'reg'
+                else:
+                    mem.banks *= length
+            else:
+                mem.banks *= min(int(args.get('factor', 1)), length)
+        elif directive == 'DEPENDENCE' and 'false' in pragma.lower():
+            mem.no_dependence = True
+
+    def memory_blocks(self, mem):
+        if mem.kind != 'bram':
+            return 0
+        depth = math.ceil(mem.size / mem.banks)
+        width = type_width(mem.ty)
+        if depth * width <= 1024:
+            # small banks are mapped to LUTRAM
+            self.resources['LUT'] += mem.banks * math.ceil(depth*width / 64)
+            return 0
+        return mem.banks * bram_blocks(depth, width)
+
+    def loop_directives(self, node):
+        '''Pipeline II (0 if not pipelined) and unroll factor (None if not
+           unrolled, 0 for complete) of a loop.'''
+        ii, unroll = 0, None
+        attr = node.iter_dom.attr
+        attr_args = node.iter_dom.attr_args
+        factor = attr_args[0].value if attr_args and \
+                 isinstance(attr_args[0], PLConst) else None
+        if attr == 'pipeline':
+            ii = factor or 1
+        elif attr == 'unroll':
+            unroll = factor or 0
+
+        for stmt in node.body:
+            if not isinstance(stmt, PLPragma):
+                continue
+            pragma = self.pragma_str(stmt)
+            words = pragma.split()
+            if len(words) < 2:
+                continue
+            args = self.pragma_args(pragma)
+            if words[1].upper() == 'PIPELINE':
+                ii = int(args.get('II', 1))
+            elif words[1].upper() == 'UNROLL':
+                unroll = int(args.get('factor', 0))
+        return ii, unroll
+
+    ######## Statements ########
+
+    def value(self, node, env):
+        '''Value of an integer expression of constants and loop variables,
+           or None.'''
+        if isinstance(node, PLConst):
+            return node.value if isinstance(node.value, numbers.Real) \
+                              else None
+        if isinstance(node, PLVariable):
+            return env.get(node.name)
+        if isinstance(node, PLUnaryOp) and node.op == '-':
+            v = self.value(node.operand, env)
+            return None if v is None else -v
+        if isinstance(node, PLBinOp) and node.op in {'+', '-', '*', '//'}:
+            left = self.value(node.left, env)
+            right = self.value(node.right, env)
+            if left is None or right is None:
+                return None
+            return {'+': left + right, '-': left - right,
+                    '*': left * right,
+                    '//': left // right if right else None}[node.op]
+        return None
+
+    def trip_count(self, node, env):
+        iter_dom = node.iter_dom
+        if iter_dom.type == 'expr':
+            self.exact = False
+            return DEFAULT_TRIP_COUNT, None
+        start = self.value(iter_dom.start, env)
+        end = self.value(iter_dom.end, env)
+        step = self.value(iter_dom.step, env)
+        if start is None or end is None or not step:
+            self.exact = False
+            return DEFAULT_TRIP_COUNT, None
+        trip = max(0, math.ceil((end - start) / step))
+        # loops nested in this one see the average value of its variable
+        average = start + step * (trip - 1) / 2 if trip else start
+        return trip, average
+
+    def block(self, stmts, env, copies, in_pipeline):
+        cost = PLBlockCost()
+        if stmts is None:
+            return cost
+        if not isinstance(stmts, list):
+            stmts = [stmts]
+        for stmt in stmts:
+            if isinstance(stmt, list):
+                sub = self.block(stmt, env, copies, in_pipeline)
+            else:
+                sub = self.stmt(stmt, env, copies, in_pipeline)
+            cost.latency += sub.latency
+            cost.merge(sub)
+        return cost
+
+    def stmt(self, node, env, copies, in_pipeline):
+        if isinstance(node, PLFor):
+            return self.loop(node, env, copies, in_pipeline)
+
+        cost = PLBlockCost()
+        if isinstance(node, PLAssign):
+            self.assign(node, cost, env, copies)
+        elif isinstance(node, PLIf):
+            test = self.expr(node.test, cost, env, copies)
+            body = self.block(node.body, env, copies, in_pipeline)
+            orelse = self.block(node.orelse, env, copies, in_pipeline)
+            cost.latency = test + max(body.latency, orelse.latency)
+            cost.merge(body)
+            cost.merge(orelse)
+        elif isinstance(node, PLWhile):
+            self.exact = False
+            test = self.expr(node.test, cost, env, copies)
+            body = self.block(node.body, env, copies, in_pipeline)
+            cost.latency = DEFAULT_TRIP_COUNT * \
+                           (test + body.latency + LOOP_OVERHEAD)
+            cost.merge(body, DEFAULT_TRIP_COUNT)
+            self.resources['LUT'] += LOOP_LUT * copies
+        elif isinstance(node, PLVariableDecl):
+            cost.decls.add(node.name.name)
+            if node.init is not None:
+                cost.latency = self.expr(node.init, cost, env, copies)
+        elif isinstance(node, PLArrayDecl):
+            cost.decls.add(node.name.name)
+        elif isinstance(node, PLReturn):
+            if node.value is not None:
+                cost.latency = self.expr(node.value, cost, env, copies)
+        elif isinstance(node, (PLPragma, PLFunctionDef)):
+            pass
+        elif isinstance(node, PLNode):
+            cost.latency = self.expr(node, cost, env, copies)
+        return cost
+
+    def loop(self, node, env, copies, in_pipeline):
+        trip, average = self.trip_count(node, env)
+        ii, unroll = self.loop_directives(node)
+        name = node.target.name
+
+        if in_pipeline or unroll == 0:
+            # loops inside a pipeline are unrolled completely
+            unroll = max(trip, 1)
+        unroll = min(unroll or 1, max(trip, 1))
+        pipelined = ii > 0 and not in_pipeline
+        iterations = math.ceil(trip / unroll)
+
+        inner_env = dict(env)
+        inner_env[name] = average
+        outer_pipeline, self.in_pipeline = self.in_pipeline, \
+                                           in_pipeline or pipelined
+        body = self.block(node.body, inner_env, copies * unroll,
+                          self.in_pipeline)
+        self.in_pipeline = outer_pipeline
+
+        # loop-carried dependences: updates of a scalar declared outside
+        # the loop, or of an array element that does not depend on the
+        # loop variable
+        recurrence = 0
+        for target, index_vars, latency in body.updates:
+            if target in body.decls:
+                continue
+            if index_vars is not None:
+                mem = self.memories.get(target)
+                if name in index_vars or (mem and mem.no_dependence):
+                    continue
+            recurrence = max(recurrence, latency)
+
+        # copies of an unrolled body run in parallel unless they depend on
+        # each other
+        depth = body.latency
+        if recurrence:
+            depth += (unroll - 1) * recurrence
+
+        cost = PLBlockCost()
+        cost.merge(body, unroll)
+        cost.updates = [ u for u in body.updates if u[0] not in body.decls ]
+
+        memory = {}
+        mem_ii = 1
+        for port, (reads, writes) in cost.accesses.items():
+            ports = self.port_count(port)
+            if self.is_maxi(port):
+                # separate read and write channels
+                need = max(reads, writes) / ports
+            else:
+                need = (reads + writes) / ports
+            mem_ii = max(mem_ii, math.ceil(need))
+            memory[port] = {'reads': reads, 'writes': writes,
+                            'ports': ports, 'ii': math.ceil(need)}
+
+        if pipelined:
+            ii = max(ii, recurrence, mem_ii)
+            cost.latency = (iterations - 1) * ii + depth + \
+                           PIPELINE_OVERHEAD if iterations else 0
+        elif in_pipeline:
+            cost.latency = depth
+        else:
+            depth = max(depth, mem_ii)
+            cost.latency = iterations * (depth + LOOP_OVERHEAD)
+
+        if not in_pipeline:
+            # accesses of sequential loops are already in their latency
+            cost.accesses = {}
+
+        cycles = ii if pipelined else depth + LOOP_OVERHEAD
+        for info in memory.values():
+            info['pressure'] = (info['reads'] + info['writes']) / \
+                               (info['ports'] * max(cycles, 1))
+
+        self.resources['LUT'] += LOOP_LUT * copies
+        if not in_pipeline:
+            self.loops.append({
+                'name': name,
+                'source': node.source,
+                'trip_count': trip,
+                'pipelined': pipelined,
+                'ii': ii if pipelined else None,
+                'unroll': unroll,
+                'depth': depth,
+                'latency': cost.latency,
+                'memory': memory
+            })
+        if self.debug:
+            print(f'PLEstimator loop {name}: trip={trip} ii={ii} ' + \
+                  f'unroll={unroll} latency={cost.latency}')
+        return cost
+
+    def is_maxi(self, port):
+        return port.startswith('data') and port not in self.memories
+
+    def port_count(self, port):
+        if self.is_maxi(port):
+            return MAXI_PORTS
+        return self.memories[port].ports
+
+    ######## Expressions ########
+
+    def assign(self, node, cost, env, copies):
+        target = node.target
+        value = self.expr(node.value, cost, env, copies)
+        compound = node.op != '='
+        op = node.op[:-1] if compound else None
+
+        if isinstance(target, PLVariable):
+            name = target.name
+            if node.is_decl:
+                cost.decls.add(name)
+            mem = self.memories.get(name)
+            shape = self.actual_shape(node)
+            if mem is not None and shape != ():
+                # whole-array assignment, written element by element
+                size = math.prod(shape)
+                cost.latency = size * (value + STORE_LATENCY + LOOP_OVERHEAD)
+                cost.access(mem.port, writes=size)
+                return
+            update = compound or self.reads_var(node.value, name)
+            index_vars = None
+        elif isinstance(target, PLSubscript):
+            var, indices = self.subscript(target)
+            name = var.name
+            for idx in indices:
+                value = max(value, self.expr(idx, cost, env, copies))
+            mem = self.memories.get(name)
+            if mem is not None:
+                cost.access(mem.port, reads=int(compound), writes=1)
+            update = compound or self.reads_var(node.value, name)
+            index_vars = { n.name for idx in indices \
+                                  for n in plnode_walk(idx) \
+                                  if isinstance(n, PLVariable) }
+        else:
+            cost.latency = value
+            return
+
+        latency = value
+        if compound:
+            latency += self.binop_cost(op, self.node_type(node), copies)
+        if isinstance(target, PLSubscript):
+            latency += STORE_LATENCY
+        cost.latency = latency
+
+        if update:
+            # the chain from reading the old value to writing the new one
+            rec = self.binop_cost(op or '+', self.node_type(node), 0)
+            if index_vars is not None and mem is not None:
+                rec += mem.read_latency + STORE_LATENCY
+            cost.updates.append((name, index_vars, rec))
+
+    def subscript(self, node):
+        '''Array and indices of a subscript, also for chained ones such as
+           a[i][j].'''
+        indices = []
+        while isinstance(node, PLSubscript):
+            indices = node.indices + indices
+            node = node.var
+        return node, indices
+
+    def reads_var(self, node, name):
+        for n in plnode_walk(node):
+            if isinstance(n, PLVariable) and n.name == name:
+                return True
+        return False
+
+    def actual_shape(self, node):
+        shape = getattr(node, 'pl_shape', None) or ()
+        return tuple(d for d in shape if d != 1)
+
+    def node_type(self, node):
+        pl_type = getattr(node, 'pl_type', None)
+        return pl_type.ty if pl_type is not None else 'int'
+
+    def binop_cost(self, op, ty, copies):
+        '''Latency of one operation; adds its resources copies times.'''
+        if op not in op_class_map:
+            return 0
+        latency, dsp, lut = op_cost(op_class_map[op], ty, self.freq)
+        self.resources['DSP'] += dsp * copies
+        self.resources['LUT'] += lut * copies
+        return latency
+
+    def expr(self, node, cost, env, copies):
+        '''Critical path latency of an expression.'''
+        if isinstance(node, list):
+            return max([ self.expr(n, cost, env, copies) for n in node ],
+                       default=0)
+        if isinstance(node, (PLConst, PLPragma)) or node is None:
+            return 0
+
+        if isinstance(node, PLVariable):
+            mem = self.memories.get(node.name)
+            if mem is not None and self.actual_shape(node) != ():
+                size = mem.size
+                cost.access(mem.port, reads=size)
+                return size
+            return 0
+
+        if isinstance(node, PLSubscript):
+            var, indices = self.subscript(node)
+            latency = max([ self.expr(idx, cost, env, copies) \
+                            for idx in indices ], default=0)
+            mem = self.memories.get(var.name)
+            if mem is None:
+                return latency
+            cost.access(mem.port, reads=1)
+            return latency + mem.read_latency
+
+        if isinstance(node, PLSlice):
+            return max(self.expr(node.lower, cost, env, copies),
+                       self.expr(node.upper, cost, env, copies),
+                       self.expr(node.step, cost, env, copies))
+
+        if isinstance(node, PLBinOp):
+            left = self.expr(node.left, cost, env, copies)
+            right = self.expr(node.right, cost, env, copies)
+            ty = self.node_type(node)
+            if op_class_map.get(node.op) == 'cmp':
+                ty = self.node_type(node.left)
+            return max(left, right) + self.binop_cost(node.op, ty, copies)
+
+        if isinstance(node, PLUnaryOp):
+            operand = self.expr(node.operand, cost, env, copies)
+            op = 'logic' if node.op in {'!', 'not', '~'} else 'add'
+            if node.op == '+':
+                return operand
+            latency, dsp, lut = op_cost(op, self.node_type(node), self.freq)
+            self.resources['LUT'] += lut * copies
+            return operand + latency
+
+        if isinstance(node, PLIfExp):
+            test = self.expr(node.test, cost, env, copies)
+            body = self.expr(node.body, cost, env, copies)
+            orelse = self.expr(node.orelse, cost, env, copies)
+            self.resources['LUT'] += type_width(self.node_type(node)) * copies
+            return max(test, body, orelse)
+
+        if isinstance(node, PLCall):
+            args = self.expr(node.args, cost, env, copies)
+            if node.is_method:
+                return max(args, self.expr(node.obj, cost, env, copies))
+            if hasattr(node, 'func_def_node'):
+                body = self.block(node.func_def_node.body, env, copies,
+                                  self.in_pipeline)
+                cost.merge(body)
+                return args + body.latency
+            latency, dsp, lut = op_cost('math', self.node_type(node),
+                                        self.freq)
+            self.resources['DSP'] += dsp * copies
+            self.resources['LUT'] += lut * copies
+            return args + latency
+
+        if isinstance(node, PLIPcore):
+            self.exact = False
+            return self.expr(node.args, cost, env, copies)
+
+        return max([ self.expr(child, cost, env, copies) \
+                     for child in iter_child_nodes(node) ], default=0)
+
+    ######## Report ########
+
+    def report(self, estimate):
+        '''Text summary of an estimate, in the spirit of the HLS report.'''
+        lines = [f"== Estimate: {estimate['top']} on {estimate['board']} " + \
+                 f"@ {estimate['freq']} MHz",
+                 f"Latency: {estimate['latency']} cycles " + \
+                 f"({estimate['time_us']:.3f} us)" + \
+                 ('' if estimate['exact_trip_counts'] else \
+                  ' (some trip counts assumed)'),
+                 'Loops:']
+        for loop in estimate['loops']:
+            ii = loop['ii'] if loop['pipelined'] else '-'
+            lines.append(f"  {loop['name']:<12} trip={loop['trip_count']:<6}" +\
+                         f" II={ii:<4} unroll={loop['unroll']:<4}" + \
+                         f" latency={loop['latency']}")
+        lines.append('Resources:')
+        for k, v in estimate['resources'].items():
+            lines.append(f"  {k:<5} {v:>8} " + \
+                         f"({estimate['utilization'][k] * 100:.1f}%)")
+        lines.append('Memory port pressure (accesses per port per cycle):')
+        for port, pressure in estimate['memory_pressure'].items():
+            lines.append(f"  {port:<12} {pressure:.2f}")
+        return '\n'.join(lines)
@@ -0,0 +1,264 @@
+import re
+
+from nodes import *
+from partition import affine, array_access, array_accesses
+from optimizer import const_trip_count
+
+
+def map_nest(stmt):
+    '''Loops (outermost first) of a perfect loop nest a plmap was lowered
+       to, whose innermost body only assigns array elements; or None.'''
+    loops = []
+    node = stmt
+    while isinstance(node, PLFor) and node.source == 'map' and \
+          not node.orelse:
+        loops.append(node)
+        body = [ s for s in node.body if s is not None ]
+        if len(body) == 1 and isinstance(body[0], PLFor):
+            node = body[0]
+        else:
+            break
+    if not loops or isinstance(node, PLFor) and node is not loops[-1]:
+        return None
+    for s in loops[-1].body:
+        if not isinstance(s, PLAssign) or \
+           not isinstance(s.target, PLSubscript):
+            return None
+    return loops
+
+
+def same_domain(loops_a, loops_b):
+    '''Whether two loop nests iterate alike: same iterators, constant
+       bounds and directives at every level.'''
+    if len(loops_a) != len(loops_b):
+        return False
+    for a, b in zip(loops_a, loops_b):
+        dom_a, dom_b = a.iter_dom, b.iter_dom
+        if a.target.name != b.target.name or dom_a.op != dom_b.op or \
+           dom_a.attr != dom_b.attr or dom_a.attr_args or dom_b.attr_args:
+            return False
+        for f in ('start', 'end', 'step'):
+            va, vb = getattr(dom_a, f), getattr(dom_b, f)
+            if not isinstance(va, PLConst) or not isinstance(vb, PLConst) \
+               or va.value != vb.value:
+                return False
+    return True
+
+
+class PLMapFusion:
+    '''Fuses the loop nests of consecutive plmaps (see PLOptimizer).
+
+       Two loop nests in the same statement list, with only array
+       declarations between them, are fused when they have the same
+       iteration domain (after the schedules of their plmaps) and every
+       array one of them writes and the other accesses is accessed at the
+       same element, different in each iteration, by all accesses of both:
+       then an iteration of the fused nest only uses what the first nest
+       computed in the same iteration. Arrays declared in the statement
+       list whose every use ends up in the body of one fused nest, written
+       before they are read, become scalars declared in that body.
+    '''
+
+    def __init__(self, debug=False):
+        self.debug = debug
+
+    def fuse(self, node):
+        '''Fuse the plmap nests in node; returns the names of the arrays
+           that became scalars.'''
+        self.arrays = set()
+        for n in plnode_walk(node):
+            if isinstance(n, PLArrayDecl):
+                self.arrays.add(n.name.name)
+            elif isinstance(n, PLFunctionDef):
+                self.arrays.update(arg.name for arg in n.args \
+                                   if getattr(arg, 'pl_shape', ()) \
+                                      not in {(), (1,)})
+        self.fused = []
+        self.scalars = []
+        for n in list(plnode_walk(node)):
+            for field in ('body', 'orelse'):
+                stmts = getattr(n, field, None) if isinstance(n, PLNode) \
+                        else None
+                if isinstance(stmts, list):
+                    self.fuse_stmts(n, field, stmts)
+
+        functions = [ n for n in plnode_walk(node) \
+                      if isinstance(n, PLFunctionDef) ]
+        for owner, field, loops in self.fused:
+            self.scalarize(owner, field, loops, functions)
+        if self.debug:
+            print('PLMapFusion', self.scalars)
+        return self.scalars
+
+    def fuse_stmts(self, owner, field, stmts):
+        i = 0
+        while i < len(stmts):
+            loops = map_nest(stmts[i])
+            if loops is None or not self.fusible_body(loops[-1].body):
+                i += 1
+                continue
+            fused = False
+            j = i + 1
+            while j < len(stmts) and \
+                  (stmts[j] is None or isinstance(stmts[j], PLArrayDecl)):
+                j += 1
+            while j < len(stmts):
+                other = map_nest(stmts[j])
+                # declarations in between go before the fused nest
+                decls = [ s for s in stmts[i + 1:j] if s is not None ]
+                if other is None or not same_domain(loops, other) or \
+                   not self.fusible_body(other[-1].body) or \
+                   not self.legal(loops, loops[-1].body, other[-1].body) or \
+                   not all(self.movable(d, loops[0]) for d in decls):
+                    break
+                loops[-1].body.extend(other[-1].body)
+                link_field(loops[-1], 'body')
+                del stmts[i + 1:j + 1]
+                stmts[i:i] = decls
+                i += len(decls)
+                fused = True
+                j = i + 1
+                while j < len(stmts) and (stmts[j] is None or \
+                                          isinstance(stmts[j], PLArrayDecl)):
+                    j += 1
+            if fused:
+                link_field(owner, field)
+                self.fused.append((owner, field, loops))
+            i += 1
+
+    def movable(self, decl, nest):
+        '''Whether declaration decl, after nest, can go before it: it uses
+           nothing nest assigns.'''
+        assigned = { a[0] for a in array_accesses(nest) if a[2] }
+        for n in plnode_walk(nest):
+            if isinstance(n, PLAssign) and isinstance(n.target, PLVariable):
+                assigned.add(n.target.name)
+            elif isinstance(n, (PLVariableDecl, PLFor)):
+                assigned.add((n.name if isinstance(n, PLVariableDecl) \
+                              else n.target).name)
+        for field, value in iter_fields(decl):
+            if field == 'name':
+                continue
+            if not isinstance(value, (PLNode, list)):
+                continue
+            for n in plnode_walk(value):
+                if isinstance(n, PLVariable) and n.name in assigned:
+                    return False
+        return True
+
+    def fusible_body(self, body):
+        '''No whole array is used other than through subscripts (e.g.
+           passed to a call).'''
+        todo = list(body)
+        while todo:
+            n = todo.pop()
+            if isinstance(n, PLSubscript):
+                todo.extend(array_access(n)[1])
+            elif isinstance(n, PLVariable):
+                if n.name in self.arrays:
+                    return False
+            elif isinstance(n, list):
+                todo.extend(n)
+            elif isinstance(n, PLNode):
+                todo.extend(v for _, v in iter_fields(n) \
+                            if isinstance(v, (PLNode, list)))
+        return True
+
+    def legal(self, loops, first, second):
+        '''Whether the nest body second can run in the iterations of first:
+           arrays written by one and accessed by the other are accessed at
+           the same element, one per iteration.'''
+        acc_first = array_accesses(first)
+        acc_second = array_accesses(second)
+        written = { a[0] for a in acc_first + acc_second if a[2] }
+        shared = { a[0] for a in acc_first } & { a[0] for a in acc_second }
+        for name in shared & written:
+            indices = [ tuple(affine(i) for i in idx) \
+                        for n, idx, _ in acc_first + acc_second \
+                        if n == name ]
+            index = indices[0]
+            if any(i is None for i in index) or \
+               any(other != index for other in indices) or \
+               not self.one_to_one(index, loops):
+                return False
+        return True
+
+    def one_to_one(self, index, loops):
+        '''Whether index gives a different element in every iteration of
+           loops: every iterator indexes a dimension, and the iterators of a
+           dimension have coefficients that keep their values apart (as the
+           outer and inner iterators of a tiled loop do).'''
+        spans = {}
+        for l in loops:
+            trip = const_trip_count(l)
+            if trip is None:
+                return False
+            spans[l.target.name] = (trip - 1) * abs(l.iter_dom.step.value)
+        seen = set()
+        for dim in index:
+            span = 0
+            for c, v in sorted((abs(c), v) for v, c in dim.items() \
+                               if v in spans):
+                if c <= span:
+                    return False
+                span += c * spans[v]
+                seen.add(v)
+        return seen == set(spans)
+
+    def scalarize(self, owner, field, loops, functions):
+        stmts = getattr(owner, field)
+        body = loops[-1].body
+        decls = { s.name.name: s for s in stmts \
+                  if isinstance(s, PLArrayDecl) }
+        for name, decl in decls.items():
+            accesses = [ a for a in array_accesses(body) if a[0] == name ]
+            if not accesses or not accesses[0][2]:
+                continue
+            indices = [ [ affine(i) for i in idx ] \
+                        for _, idx, _ in accesses ]
+            # the declaration is the only use outside the body
+            if None in indices[0] or \
+               any(index != indices[0] for index in indices) or \
+               self.uses(functions, name) != self.uses(body, name) + 1:
+                continue
+            self.replace(body, name)
+            pos = 0
+            while isinstance(body[pos], PLVariableDecl):
+                pos += 1
+            body.insert(pos, PLVariableDecl(ty=decl.ele_type,
+                                            name=PLVariable(name), init=None))
+            link_children(body[pos])
+            stmts.remove(decl)
+            link_field(owner, field)
+            link_field(loops[-1], 'body')
+            self.scalars.append(name)
+
+    def uses(self, node, name):
+        '''Variables and pragmas in node that refer to name.'''
+        count = 0
+        for n in plnode_walk(node):
+            if isinstance(n, PLVariable) and n.name == name:
+                count += 1
+            elif isinstance(n, PLPragma) and \
+                 re.search(rf'\b{re.escape(name)}\b', str(n.pragma.value \
+                           if isinstance(n.pragma, PLConst) else n.pragma)):
+                count += 1
+        return count
+
+    def replace(self, node, name):
+        '''node with the elements of array name replaced by the scalar.'''
+        if isinstance(node, list):
+            node[:] = [ self.replace(item, name) for item in node ]
+        elif isinstance(node, PLSubscript) and \
+             array_access(node)[0] == name:
+            scalar = PLVariable(name)
+            scalar.pl_type = node.pl_type
+            scalar.pl_shape = node.pl_shape
+            return scalar
+        elif isinstance(node, PLNode):
+            for field, value in iter_fields(node):
+                new_value = self.replace(value, name)
+                if new_value is not value:
+                    setattr(node, field, new_value)
+            link_children(node)
+        return node
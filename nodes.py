@@ -1,7 +1,19 @@
 import ast
+import collections
 # from typer import PLType
 
 
+class PLScope(collections.ChainMap):
+    '''Symbol table of nested scopes (typer contexts, codegen configs).
+       push() opens a child scope in O(1), without copying the entries of
+       the enclosing ones: lookups go through the enclosing scopes, and
+       assignments go to the innermost scope only, so the enclosing scopes
+       are unchanged when the child is dropped.'''
+
+    def push(self, frame=None):
+        return self.new_child(frame)
+
+
 class PLType:
     '''Scalars, arrays, and functions'''
 
@@ -53,15 +65,18 @@ def iter_child_nodes(node):
         for item in node:
             if isinstance(item, PLNode):
                 yield item
+        return
 
-    for name, field in iter_fields(node):
-        if isinstance(field, PLNode):
-            yield field
-        elif isinstance(field, list):
-            for item in field:
+    for field in node._fields:
+        value = getattr(node, field, None)
+        if isinstance(value, PLNode):
+            yield value
+        elif isinstance(value, list):
+            for item in value:
                 if isinstance(item, PLNode):
                     yield item
 
+
 def replace_child_generic(parent, condition, new_child):
     if isinstance(parent, list):
         for idx in range(len(parent)):
@@ -74,15 +89,33 @@ def replace_child_generic(parent, condition, new_child):
             for idx, child in enumerate(field):
                 if condition(child):
                     getattr(parent, name)[idx] = new_child
-                    new_child.parent = parent
+                    link_child(parent, new_child, name, idx)
                     return
         elif isinstance(field, PLNode):
             if condition(field):
                 setattr(parent, name, new_child)
-                new_child.parent = parent
+                link_child(parent, new_child, name)
                 return
 
 def replace_child(parent, old_child, new_child):
+    # the slot of old_child, if its parent link is still accurate
+    if not isinstance(parent, list) and \
+       getattr(old_child, 'parent', None) is parent and \
+       hasattr(old_child, 'parent_field'):
+        field = old_child.parent_field
+        index = old_child.parent_index
+        value = getattr(parent, field, None)
+        if index is None:
+            if value is old_child:
+                setattr(parent, field, new_child)
+                link_child(parent, new_child, field)
+                return
+        elif isinstance(value, list) and index < len(value) and \
+             value[index] is old_child:
+            value[index] = new_child
+            link_child(parent, new_child, field, index)
+            return
+
     replace_child_generic(
         parent,
         lambda node: True if node is old_child else False,
@@ -112,7 +145,7 @@ def replace_child(parent, old_child, new_child):
 def plnode_walk(node):
     from collections import deque
     if isinstance(node, list):
-        todo = deque(node)
+        todo = deque(item for item in node if isinstance(item, PLNode))
     else:
         todo = deque([node])
     while todo:
@@ -123,8 +156,137 @@ def plnode_walk(node):
 
 def plnode_link_parent(root):
     for node in plnode_walk(root):
-        for child in iter_child_nodes(node):
-            child.parent = node
+        if isinstance(node, PLNode):
+            link_children(node)
+
+
+def link_child(parent, child, field, index=None):
+    '''Record that child is in field of parent (at index, if the field is
+       a list), for replace_child.'''
+    if isinstance(child, PLNode):
+        if getattr(child, 'parent', None) is not parent:
+            forget_chaining_top(child)
+        child.parent = parent
+        child.parent_field = field
+        child.parent_index = index
+
+
+def link_field(parent, field):
+    '''Link the children in field of parent, see link_child.'''
+    value = getattr(parent, field, None)
+    if isinstance(value, PLNode):
+        link_child(parent, value, field)
+    elif isinstance(value, list):
+        for index, item in enumerate(value):
+            if isinstance(item, PLNode):
+                link_child(parent, item, field, index)
+
+
+def link_children(parent):
+    '''Link the direct children of parent, see link_child.'''
+    for field in parent._fields:
+        link_field(parent, field)
+
+
+def chaining_top(node):
+    '''Nearest PLChainingTop at or above node, or None. Results are cached
+       on the nodes along the parent chain; link_child drops the cached
+       results below a node that moves.'''
+    path = []
+    top = None
+    while True:
+        cached = getattr(node, 'chaining_top', None)
+        if cached is not None:
+            top = cached[0]
+            break
+        path.append(node)
+        if isinstance(node, PLChainingTop):
+            top = node
+            break
+        if not hasattr(node, 'parent'):
+            break
+        node = node.parent
+    for n in path:
+        if isinstance(n, PLNode):
+            n.chaining_top = (top,)
+    return top
+
+
+def forget_chaining_top(node):
+    '''Drop the chaining_top results cached in the subtree of node. A node
+       with a cached result has one on its parent too (unless it is a
+       PLChainingTop), so the walk stops at nodes without one.'''
+    todo = [node]
+    while todo:
+        n = todo.pop()
+        if isinstance(n, PLChainingTop) or \
+           getattr(n, 'chaining_top', None) is None:
+            continue
+        del n.chaining_top
+        todo.extend(iter_child_nodes(n))
+
+
+# all slots of each node class, including inherited ones
+node_slots = {}
+
+
+def slots_of(cls):
+    slots = node_slots.get(cls)
+    if slots is None:
+        slots = node_slots[cls] = tuple(
+            name for klass in reversed(cls.__mro__) \
+                 for name in klass.__dict__.get('__slots__', ()))
+    return slots
+
+
+def plnode_copy(node, memo=None):
+    '''Copy of a PyLog IR (a node or a list of nodes). Nodes in fields are
+       copied, and so are PLTypes, which passes modify in place; other
+       attributes are shared with the original (ast_node, config, ...),
+       except that attributes referring to a copied node refer to its copy.
+       parent links inside the copy point into the copy. Much cheaper than
+       copy.deepcopy, which also copies the Python AST behind every node.'''
+    top = memo is None
+    if top:
+        memo = {}
+
+    if isinstance(node, list):
+        new = [ plnode_copy(item, memo) for item in node ]
+    elif isinstance(node, PLNode):
+        if id(node) in memo:
+            return memo[id(node)]
+        cls = node.__class__
+        new = cls.__new__(cls)
+        memo[id(node)] = new
+        fields = node._fields
+        for name in slots_of(cls):
+            if name == 'chaining_top':
+                continue
+            try:
+                value = getattr(node, name)
+            except AttributeError:
+                continue
+            if name in fields:
+                value = plnode_copy(value, memo)
+            elif isinstance(value, PLType):
+                value = PLType(value.ty, value.dim)
+            setattr(new, name, value)
+        link_children(new)
+    elif isinstance(node, PLType):
+        return PLType(node.ty, node.dim)
+    else:
+        return node
+
+    if top:
+        # references to copied nodes outside the fields
+        for old_id, copied in memo.items():
+            for name in slots_of(copied.__class__):
+                if name in copied._fields or name == 'parent':
+                    continue
+                value = getattr(copied, name, None)
+                if isinstance(value, PLNode) and id(value) in memo:
+                    setattr(copied, name, memo[id(value)])
+    return new
 
 
 def token(obj):
@@ -171,8 +333,42 @@ class Context:
 
 
 class PLNode:
+    '''Base of the PyLog IR nodes.
+
+       Each node class declares its child fields in the class-level tuple
+       _fields and all its attributes in __slots__. Besides the fields, any
+       node may carry these attributes, which passes set along the way
+       (unset ones raise AttributeError, so hasattr works as before):
+
+        ast_node:       ast.AST the node was built from
+        config:         Context of the analyzer
+        codegened:      bool, set by codegen
+        type:           PLType, Python type (PLConst) or string (PLIterDom)
+        parent:         PLNode, see plnode_link_parent
+        parent_field:   string, field of parent holding the node
+        parent_index:   int, index in that field if it is a list
+        chaining_top:   cache of chaining_top(node)
+        pl_type:        PLType, set by the typer
+        pl_shape:       tuple of ints, set by the typer
+        is_decl:        bool, assignment declares its target (PLAssign)
+        dim:            int
+        dim_length:     int, length of the array dimension of an index
+        is_offset:      bool, subscript of a lambda argument is an offset
+        assign_target:  PLNode, target of the assignment of a plmap/pldot
+        assign_op:      string, operator of that assignment
+        return_type:    PLType (PLFunctionDef, PLLambda, PLDot)
+        return_shape:   tuple of ints
+        lambda_node:    PLLambda whose argument the node is
+    '''
+
+    _fields = ()
+    __slots__ = ('ast_node', 'config', 'codegened', 'type', 'parent',
+                 'pl_type', 'pl_shape', 'is_decl', 'dim', 'dim_length',
+                 'is_offset', 'assign_target', 'assign_op', 'return_type',
+                 'return_shape', 'lambda_node', 'parent_field',
+                 'parent_index', 'chaining_top')
+
     def __init__(self, ast_node=None, config=None):
-        self._fields = []
         self.ast_node = ast_node
         self.config = config
         self.codegened = False
@@ -206,6 +402,18 @@ class PLNode:
         self.codegened = True
         return tmp
 
+    def copy(self):
+        '''Structural copy of the subtree rooted at this node, see
+           plnode_copy.'''
+        return plnode_copy(self)
+
+    def __getstate__(self):
+        '''Slots for pickle, without the chaining_top cache, which is only
+           valid in the process that computed it.'''
+        return None, { name: getattr(self, name) \
+                       for name in slots_of(self.__class__) \
+                       if name != 'chaining_top' and hasattr(self, name) }
+
 
 # class TypeNode(PLNode):
 #     def __init__(self, type_val, ast_node=None, config=None):
@@ -231,9 +439,11 @@ class PLNode:
 class PLConst(PLNode):
     '''Constant, Num, Str, NameConstant'''
 
+    _fields = ('value',)
+    __slots__ = _fields
+
     def __init__(self, value, ast_node=None, config=None):
         PLNode.__init__(self, ast_node, config)
-        self._fields = ['value']
         self.value = value
         self.type = type(self.value)
 
@@ -261,9 +471,11 @@ class PLConst(PLNode):
 class PLArray(PLNode):
     '''Array in declaration, List, Tuple. '''
 
+    _fields = ('elts',)
+    __slots__ = _fields
+
     def __init__(self, elts, ast_node=None, config=None):
         PLNode.__init__(self, ast_node, config)
-        self._fields = ['elts']
         self.elts = elts
 
 
@@ -273,9 +485,11 @@ class PLArrayDecl(PLNode):
        dims: PLArray
     '''
 
+    _fields = ('ele_type', 'name', 'dims')
+    __slots__ = _fields
+
     def __init__(self, ele_type, name, dims, ast_node=None, config=None):
         PLNode.__init__(self, ast_node, config)
-        self._fields = ['ele_type', 'name', 'dims']
         self.ele_type = ele_type
         self.name = name
         self.dims = dims
@@ -287,9 +501,11 @@ class PLArrayDecl(PLNode):
 class PLVariableDecl(PLNode):
     '''Declare a variable with optional initial value'''
 
+    _fields = ('ty', 'name', 'init', 'quals')
+    __slots__ = _fields
+
     def __init__(self, ty, name, init, quals=[], ast_node=None, config=None):
         PLNode.__init__(self, ast_node, config)
-        self._fields = ['ty', 'name', 'init', 'quals']
         self.ty = ty
         self.name = name
         self.init = init
@@ -301,18 +517,22 @@ class PLVariable(PLNode):
         name: string
     '''
 
+    _fields = ('name',)
+    __slots__ = _fields
+
     def __init__(self, name, ast_node=None, config=None):
         PLNode.__init__(self, ast_node, config)
-        self._fields = ['name']
         self.name = name
 
 
 class PLUnaryOp(PLNode):
     '''UnaryOp'''
 
+    _fields = ('op', 'operand')
+    __slots__ = _fields
+
     def __init__(self, op, operand, ast_node=None, config=None):
         PLNode.__init__(self, ast_node, config)
-        self._fields = ['op', 'operand']
         self.op = op
         self.operand = operand
 
@@ -320,9 +540,11 @@ class PLUnaryOp(PLNode):
 class PLBinOp(PLNode):
     '''BinOp, BoolOp'''
 
+    _fields = ('op', 'left', 'right')
+    __slots__ = _fields
+
     def __init__(self, op, left, right, ast_node=None, config=None):
         PLNode.__init__(self, ast_node, config)
-        self._fields = ['op', 'left', 'right']
         self.op = op
         self.left = left
         self.right = right
@@ -338,10 +560,12 @@ class PLCall(PLNode):
         obj: object when it is a class method
     '''
 
+    _fields = ('func', 'args', 'attr', 'attr_args')
+    __slots__ = _fields + ('is_method', 'obj', 'func_def_node')
+
     def __init__(self, func, args, attr=None, attr_args=None, is_method=False,\
                  obj=None, ast_node=None, config=None):
         PLNode.__init__(self, ast_node, config)
-        self._fields = ['func', 'args', 'attr', 'attr_args']
         self.func = func
         self.args = args
         self.attr = attr  # string
@@ -353,10 +577,13 @@ class PLCall(PLNode):
 #@@ modified by cy
 class PLIPcore(PLNode):
     '''IP cores'''
+
+    _fields = ('args', 'name', 'func_configs', 'optm_configs')
+    __slots__ = _fields + ('types', 'shapes', 'dims')
+
     def __init__(self, args, name=None, func_configs=None, optm_configs=None, \
                  ast_node=None, config=None):
         PLNode.__init__(self, ast_node, config)
-        self._fields = ['args','name','func_configs','optm_configs']
         self.args = args
         self.name = name
         self.func_configs = func_configs
@@ -365,23 +592,29 @@ class PLIPcore(PLNode):
 class PLPragma(PLNode):
     '''Call'''
 
+    _fields = ('pragma',)
+    __slots__ = _fields
+
     def __init__(self, pragma, ast_node=None, config=None):
         PLNode.__init__(self, ast_node, config)
-        self._fields = ['pragma']
         self.pragma = pragma
+        link_child(self, pragma, 'pragma')
 
 
 class PLKeyword(PLNode):
     '''keyword'''
-    pass
+
+    __slots__ = ()
 
 
 class PLIfExp(PLNode):
     '''if (exp)? a:b'''
 
+    _fields = ('test', 'body', 'orelse')
+    __slots__ = _fields
+
     def __init__(self, test, body, orelse, ast_node=None, config=None):
         PLNode.__init__(self, ast_node, config)
-        self._fields = ['test', 'body', 'orelse']
         self.test = test
         self.body = body
         self.orelse = orelse
@@ -390,9 +623,11 @@ class PLIfExp(PLNode):
 class PLAttribute(PLNode):
     '''Attribute'''
 
+    _fields = ('value', 'attr')
+    __slots__ = _fields
+
     def __init__(self, value, attr, ast_node=None, config=None):
         PLNode.__init__(self, ast_node, config)
-        self._fields = ['value', 'attr']
         self.value = value
         self.attr = attr
 
@@ -400,9 +635,11 @@ class PLAttribute(PLNode):
 class PLChainingTop(PLNode):
     '''ChainingTop'''
 
+    _fields = ('stmt',)
+    __slots__ = _fields
+
     def __init__(self, stmt, pl_type, pl_shape, ast_node=None, config=None):
         PLNode.__init__(self, ast_node, config)
-        self._fields = ['stmt']
         self.stmt = stmt
         self.pl_type = pl_type
         self.pl_shape = pl_shape
@@ -414,13 +651,15 @@ class PLChainingTop(PLNode):
 class PLSubscript(PLNode):
     '''Subscript'''
 
+    _fields = ('var', 'indices')
+    __slots__ = _fields
+
     def __init__(self, var, indices, ast_node=None, config=None):
         '''
             var: expr for the array name
             indices: Python list of PLSlice/Expr
         '''
         PLNode.__init__(self, ast_node, config)
-        self._fields = ['var', 'indices']
         self.var = var
         self.indices = indices
 
@@ -430,9 +669,11 @@ class PLSubscript(PLNode):
 
 
 class PLSlice(PLNode):
+    _fields = ('lower', 'upper', 'step')
+    __slots__ = _fields + ('updated_slice',)
+
     def __init__(self, lower, upper, step, ast_node=None, config=None):
         PLNode.__init__(self, ast_node, config)
-        self._fields = ['lower', 'upper', 'step']
         self.lower = lower
         self.upper = upper
         self.step = step
@@ -450,20 +691,24 @@ class PLSlice(PLNode):
 class PLAssign(PLNode):
     '''Assign, AugAssign'''
 
+    _fields = ('op', 'target', 'value')
+    __slots__ = _fields
+
     def __init__(self, op, target, value, ast_node=None, config=None):
         PLNode.__init__(self, ast_node, config)
-        self._fields = ['op', 'target', 'value']
         self.op = op
         self.target = target
         self.value = value
-        self.target.parent = self
-        self.value.parent = self
+        link_child(self, target, 'target')
+        link_child(self, value, 'value')
 
 
 class PLIf(PLNode):
+    _fields = ('test', 'body', 'orelse')
+    __slots__ = _fields
+
     def __init__(self, test, body, orelse, ast_node=None, config=None):
         PLNode.__init__(self, ast_node, config)
-        self._fields = ['test', 'body', 'orelse']
         self.test = test
         self.body = body
         self.orelse = orelse
@@ -472,10 +717,12 @@ class PLIf(PLNode):
 class PLIterDom(PLNode):
     '''Represents iteration domain in 'for obj in domain' '''
 
+    _fields = ('start', 'op', 'end', 'step')
+    __slots__ = _fields + ('expr', 'attr', 'attr_args')
+
     def __init__(self, expr=None, start=PLConst(0), op='<', end=PLConst(128),
                  step=PLConst(1), ast_node=None, config=None):
         PLNode.__init__(self, ast_node, config)
-        self._fields = ['start', 'op', 'end', 'step']
         self.expr = expr
         self.start = start
         self.op = op
@@ -523,10 +770,12 @@ class PLIterDom(PLNode):
 
 
 class PLFor(PLNode):
+    _fields = ('target', 'iter_dom', 'body', 'orelse')
+    __slots__ = _fields + ('source',)
+
     def __init__(self, target, iter_dom, body, orelse, source=None, \
                  ast_node=None, config=None):
         PLNode.__init__(self, ast_node, config)
-        self._fields = ['target', 'iter_dom', 'body', 'orelse']
         self.target = target
         self.iter_dom = iter_dom
         self.body = body
@@ -535,9 +784,11 @@ class PLFor(PLNode):
 
 
 class PLWhile(PLNode):
+    _fields = ('test', 'body', 'orelse')
+    __slots__ = _fields
+
     def __init__(self, test, body, orelse, ast_node=None, config=None):
         PLNode.__init__(self, ast_node, config)
-        self._fields = ['test', 'body', 'orelse']
         self.test = test
         self.body = body
         self.orelse = orelse
@@ -551,10 +802,13 @@ class PLFunctionDef(PLNode):
         decorator_list: list of PLNodes
     '''
 
+    _fields = ('name', 'args', 'body', 'decorator_list', 'annotations')
+    __slots__ = _fields + \
+        ('iter_vars', 'pl_top', 'type_infer_done', 'chaining_rewriter_done')
+
     def __init__(self, name, args, body, decorator_list, pl_top=False,
                  ast_node=None, config=None, annotations={}):
         PLNode.__init__(self, ast_node, config)
-        self._fields = ['name', 'args', 'body', 'decorator_list','annotations']
         self.name = name
         self.args = args
         self.body = body
@@ -570,17 +824,21 @@ class PLLambda(PLNode):
         body: a single expression
     '''
 
+    _fields = ('args', 'body')
+    __slots__ = _fields + ('arg_map', 'target')
+
     def __init__(self, args, body, ast_node=None, config=None):
         PLNode.__init__(self, ast_node, config)
-        self._fields = ['args', 'body']
         self.args = args
         self.body = body
 
 
 class PLReturn(PLNode):
+    _fields = ('value',)
+    __slots__ = _fields
+
     def __init__(self, value, ast_node=None, config=None):
         PLNode.__init__(self, ast_node, config)
-        self._fields = ['value']
         self.value = value
 
 
@@ -613,9 +871,11 @@ class PLMap(PLNode):
         arrays: list of arrays (PLVariable or PLSubscript)
     '''
 
+    _fields = ('target', 'func', 'arrays')
+    __slots__ = _fields + ('schedules',)
+
     def __init__(self, target, func, arrays, ast_node=None, config=None):
         PLNode.__init__(self, ast_node, config)
-        self._fields = ['target', 'func', 'arrays']
         self.target = target
         self.func = func
         self.arrays = arrays
@@ -634,9 +894,11 @@ class PLDot(PLNode):
     ''' pldot
     '''
 
+    _fields = ('target', 'op1', 'op2')
+    __slots__ = _fields + ('op_type', 'op_shape')
+
     def __init__(self, target, op1, op2, ast_node=None, config=None):
         PLNode.__init__(self, ast_node, config)
-        self._fields = ['target', 'op1', 'op2']
         self.target = target
         self.op1 = op1
         self.op2 = op2
@@ -0,0 +1,594 @@
+import operator
+import numpy as np
+
+from nodes import *
+from swemu import c_np_type
+
+# upper bound of map iteration points evaluated at once; keeps the gathered
+# stencil windows of large maps within memory
+MAP_CHUNK_POINTS = 1 << 14
+
+
+def pl_np_type(ty):
+    '''NumPy dtype holding values of a PyLog element type.'''
+    try:
+        return c_np_type(ty)
+    except NotImplementedError:
+        pass
+    if ty.startswith(('ap_fixed', 'ap_ufixed')):
+        # fixed-point values are simulated in double precision
+        return np.dtype(np.float64)
+    return np.dtype(ty)
+
+
+def actual_shape(shape):
+    return tuple(i for i in shape if i != 1)
+
+
+def cast(value, dtype):
+    if isinstance(value, np.ndarray) and value.ndim > 0:
+        return value.astype(dtype, copy=False)
+    return np.asarray(value).astype(dtype)[()]
+
+
+def is_integer(a, b):
+    return np.issubdtype(np.result_type(a, b), np.integer)
+
+
+def c_div(a, b):
+    '''Division with C semantics: integer division truncates towards 0.'''
+    if not is_integer(a, b):
+        return np.true_divide(a, b)
+    q = np.floor_divide(a, b)
+    return q + ((q * b != a) & ((a < 0) != (b < 0)))
+
+
+def c_mod(a, b):
+    '''Remainder with C semantics: the sign follows the dividend.'''
+    return np.fmod(a, b)
+
+
+binop_map = {
+    '+':  operator.add,
+    '-':  operator.sub,
+    '*':  operator.mul,
+    '/':  c_div,
+    '%':  c_mod,
+    '//': np.floor_divide,
+    '**': np.power,
+    '<<': operator.lshift,
+    '>>': operator.rshift,
+    '|':  operator.or_,
+    '^':  operator.xor,
+    '&':  operator.and_,
+    '&&': np.logical_and,
+    '||': np.logical_or,
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<':  operator.lt,
+    '<=': operator.le,
+    '>':  operator.gt,
+    '>=': operator.ge
+}
+
+unaryop_map = {
+    '-':   operator.neg,
+    '+':   operator.pos,
+    '~':   operator.invert,
+    '!':   np.logical_not,
+    'not': np.logical_not
+}
+
+# math functions callable from kernels
+func_map = {
+    'sqrt':  np.sqrt,
+    'exp':   np.exp,
+    'log':   np.log,
+    'log2':  np.log2,
+    'log10': np.log10,
+    'pow':   np.power,
+    'abs':   np.abs,
+    'fabs':  np.abs,
+    'sin':   np.sin,
+    'cos':   np.cos,
+    'tan':   np.tan,
+    'tanh':  np.tanh,
+    'floor': np.floor,
+    'ceil':  np.ceil,
+    'min':   np.minimum,
+    'max':   np.maximum
+}
+
+
+class PLNpSimReturn(Exception):
+    def __init__(self, value):
+        self.value = value
+
+
+class PLMapContext:
+    '''Evaluation state of a plmap lambda.
+
+       rank:     number of leading axes holding map iteration points (0 when
+                 the lambda is evaluated one point at a time)
+       bindings: lambda argument name -> PLMapBinding
+    '''
+
+    def __init__(self, rank, bindings):
+        self.rank = rank
+        self.bindings = bindings
+
+
+class PLMapBinding:
+    '''A lambda argument of plmap: the array it iterates over, the index
+       into that array at each iteration point, and the element itself.'''
+
+    def __init__(self, base, indices, value):
+        self.base = base        # underlying NumPy array
+        self.indices = indices  # per dimension of base: int or index array
+        self.value = value
+
+
+class PLNpSim:
+    '''Executes the typed PyLog IR (after PLTyper) on NumPy arrays.
+
+       Statements are interpreted one at a time, but array expressions are
+       evaluated as whole-array NumPy operations: slices become views, plmap
+       evaluates its lambda once over all iteration points with broadcasted
+       ufuncs (stencil offsets such as x[-1:2] are gathered with index
+       arrays), and dot becomes a tensordot or einsum reduction. Lambdas
+       that cannot be vectorized, e.g. ones calling kernel functions, fall
+       back to evaluating one iteration point at a time.
+
+       Values follow the generated C code: arguments are used in place, new
+       variables take the dtype of their PyLog type, and integer division
+       and remainder truncate towards zero.
+    '''
+
+    def __init__(self, pylog_ir, debug=False):
+        self.pylog_ir = pylog_ir
+        self.debug = debug
+        self.map_ctx = None
+        self.vectorizable_cache = {}
+        self.eval_methods = {}
+        self.run_methods = {}
+
+        stmts = pylog_ir if isinstance(pylog_ir, list) else [pylog_ir]
+        self.top = None
+        for stmt in stmts:
+            if isinstance(stmt, PLFunctionDef) and stmt.pl_top:
+                self.top = stmt
+        assert (self.top is not None), 'no @pylog function found'
+
+    def call(self, args):
+        frame = {}
+        for arg_node, arg in zip(self.top.args, args):
+            if arg.dtype.fields is not None:
+                raise NotImplementedError(
+                    'npsim: fixed-point arguments are not supported')
+            frame[arg_node.name] = arg[()] if arg.shape == () else arg
+
+        try:
+            self.run(self.top.body, frame)
+        except PLNpSimReturn as ret:
+            return ret.value
+
+    ######## Statements ########
+
+    def run(self, node, frame):
+        if node is None:
+            return
+        if isinstance(node, list):
+            for stmt in node:
+                self.run(stmt, frame)
+            return
+
+        cls = node.__class__
+        method = self.run_methods.get(cls)
+        if method is None:
+            method = getattr(self, 'run_' + cls.__name__, self.run_expr)
+            self.run_methods[cls] = method
+        if self.debug:
+            print(f'NPSIM running {cls.__name__}: {node}')
+        method(node, frame)
+
+    def run_expr(self, node, frame):
+        self.eval(node, frame)
+
+    def run_PLFunctionDef(self, node, frame):
+        # nested kernel functions are called through PLCall.func_def_node
+        pass
+
+    def run_PLPragma(self, node, frame):
+        pass
+
+    def run_PLArrayDecl(self, node, frame):
+        shape = tuple(int(self.eval(e, frame)) for e in node.dims.elts)
+        frame[node.name.name] = np.zeros(shape, dtype=pl_np_type(node.ele_type))
+
+    def run_PLVariableDecl(self, node, frame):
+        dtype = pl_np_type(node.ty)
+        init = self.eval(node.init, frame) if node.init is not None else 0
+        frame[node.name.name] = cast(init, dtype)
+
+    def run_PLAssign(self, node, frame):
+        value = self.eval(node.value, frame)
+        target = node.target
+        op = node.op[:-1] if node.op != '=' else None
+
+        if isinstance(target, PLVariable):
+            name = target.name
+            if node.is_decl:
+                dtype = pl_np_type(target.pl_type.ty)
+                if target.pl_type.dim == 0:
+                    frame[name] = cast(value, dtype)
+                else:
+                    shape = tuple(target.pl_shape)
+                    frame[name] = np.array(np.broadcast_to(
+                                      np.reshape(value, shape) \
+                                          if np.ndim(value) else value,
+                                      shape), dtype=dtype)
+                return
+
+            if name not in frame:
+                raise NameError(f'npsim: {name} used before definition')
+            old = frame[name]
+            if op is not None:
+                value = self.binop(op, old, value)
+
+            if isinstance(old, np.ndarray) and old.ndim > 0:
+                self.store(old, Ellipsis, value)
+            elif isinstance(old, np.generic):
+                frame[name] = cast(value, old.dtype)
+            else:
+                frame[name] = value
+
+        elif isinstance(target, PLSubscript):
+            array = frame[target.var.name]
+            index = tuple(self.index(idx, frame) for idx in target.indices)
+            if op is not None:
+                value = self.binop(op, array[index], value)
+            self.store(array, index, value)
+
+        else:
+            raise NotImplementedError(
+                f'npsim: unsupported assignment target {target}')
+
+    def store(self, array, index, value):
+        if isinstance(index, tuple) and \
+           all(isinstance(i, (int, np.integer)) for i in index) and \
+           len(index) == array.ndim:
+            array[index] = value
+            return
+        view = array[index]
+        if np.ndim(value) > 0 and np.shape(value) != view.shape and \
+           np.size(value) == view.size:
+            # shapes that only differ in dimensions of length 1
+            value = np.reshape(value, view.shape)
+        np.copyto(view, value, casting='unsafe')
+
+    def run_PLFor(self, node, frame):
+        iter_dom = node.iter_dom
+        if iter_dom.type == 'expr':
+            raise NotImplementedError('npsim: for loops over arrays')
+
+        start = int(self.eval(iter_dom.start, frame))
+        end = int(self.eval(iter_dom.end, frame))
+        step = int(self.eval(iter_dom.step, frame))
+        name = node.target.name
+        body = node.body
+
+        for i in range(start, end, step):
+            frame[name] = i
+            self.run(body, frame)
+
+    def run_PLWhile(self, node, frame):
+        while self.eval(node.test, frame):
+            self.run(node.body, frame)
+
+    def run_PLIf(self, node, frame):
+        if self.eval(node.test, frame):
+            self.run(node.body, frame)
+        else:
+            self.run(node.orelse, frame)
+
+    def run_PLReturn(self, node, frame):
+        value = self.eval(node.value, frame) if node.value else None
+        raise PLNpSimReturn(value)
+
+    ######## Expressions ########
+
+    def eval(self, node, frame):
+        cls = node.__class__
+        method = self.eval_methods.get(cls)
+        if method is None:
+            method = getattr(self, 'eval_' + cls.__name__, None)
+            if method is None:
+                raise NotImplementedError(
+                    f'npsim: unsupported node {cls.__name__}')
+            self.eval_methods[cls] = method
+        return method(node, frame)
+
+    def eval_PLConst(self, node, frame):
+        return node.value
+
+    def eval_PLArray(self, node, frame):
+        values = [ self.eval(e, frame) for e in node.elts ]
+        return np.array(values, dtype=pl_np_type(node.pl_type.ty))
+
+    def eval_PLVariable(self, node, frame):
+        if self.map_ctx is not None and node.name in self.map_ctx.bindings:
+            return self.map_ctx.bindings[node.name].value
+        try:
+            value = frame[node.name]
+        except KeyError:
+            raise NameError(f'npsim: {node.name} used before definition')
+        return self.constant(value)
+
+    def constant(self, value):
+        '''Inside a vectorized map, values that do not depend on the
+           iteration point get leading axes of length 1 for the points.'''
+        if self.map_ctx is not None and self.map_ctx.rank > 0 and \
+           isinstance(value, np.ndarray) and value.ndim > 0:
+            return value.reshape((1,) * self.map_ctx.rank + value.shape)
+        return value
+
+    def index(self, node, frame):
+        if isinstance(node, PLSlice):
+            lower = self.eval(node.lower, frame) if node.lower else None
+            upper = self.eval(node.upper, frame) if node.upper else None
+            step = self.eval(node.step, frame) if node.step else None
+            return slice(None if lower is None else int(lower),
+                         None if upper is None else int(upper),
+                         None if step is None else int(step))
+        value = self.eval(node, frame)
+        if isinstance(value, np.ndarray) and value.ndim > 0:
+            return value.astype(np.intp, copy=False)
+        return int(value)
+
+    def eval_PLSubscript(self, node, frame):
+        var = node.var
+        if self.map_ctx is not None and var.name in self.map_ctx.bindings:
+            return self.gather(self.map_ctx.bindings[var.name],
+                               node.indices, frame)
+
+        array = frame[var.name]
+        index = tuple(self.index(idx, frame) for idx in node.indices)
+        value = array[index]
+        if not isinstance(value, np.ndarray):
+            return value
+        if any(isinstance(i, np.ndarray) for i in index):
+            # indexed by values of the iteration points
+            return value
+        return self.constant(value.reshape(actual_shape(value.shape)))
+
+    def gather(self, binding, offsets, frame):
+        '''Elements of a plmap argument at offsets from the iteration point,
+           e.g. x[-1:2, 0] in a 2D stencil.'''
+        rank = self.map_ctx.rank
+        base = binding.base
+
+        offs = []
+        window = []
+        for off in offsets:
+            if isinstance(off, PLSlice):
+                lower = int(self.eval(off.lower, frame)) if off.lower else 0
+                upper = int(self.eval(off.upper, frame))
+                step = int(self.eval(off.step, frame)) if off.step else 1
+                rng = np.arange(lower, upper, step)
+                if len(rng) == 1:
+                    offs.append(int(rng[0]))
+                else:
+                    offs.append(rng)
+                    window.append(len(rng))
+            else:
+                offs.append(int(self.eval(off, frame)))
+
+        num_window = len(window)
+        indices = []
+        w = 0
+        for d in range(base.ndim):
+            idx = binding.indices[d]
+            if isinstance(idx, np.ndarray):
+                idx = idx.reshape(idx.shape + (1,) * num_window)
+            if d < len(offs):
+                off = offs[d]
+                if isinstance(off, np.ndarray):
+                    off = off.reshape((1,) * (rank + w) + (len(off),) + \
+                                      (1,) * (num_window - w - 1))
+                    w += 1
+                idx = idx + off
+            if np.min(idx) < 0 or np.max(idx) >= base.shape[d]:
+                raise IndexError('npsim: plmap reads outside of an array')
+            indices.append(idx)
+
+        return base[tuple(indices)]
+
+    def align(self, left, right):
+        '''Line up per-point values of different ranks in a vectorized map:
+           a scalar per point broadcasts over an array per point.'''
+        rank = self.map_ctx.rank
+        left_dim, right_dim = np.ndim(left), np.ndim(right)
+        if left_dim >= rank and right_dim >= rank and left_dim != right_dim:
+            if left_dim < right_dim:
+                left = np.reshape(left, np.shape(left) + \
+                                        (1,) * (right_dim - left_dim))
+            else:
+                right = np.reshape(right, np.shape(right) + \
+                                          (1,) * (left_dim - right_dim))
+        return left, right
+
+    def binop(self, op, left, right):
+        if op not in binop_map:
+            raise NotImplementedError(f'npsim: unsupported operator {op}')
+        if self.map_ctx is not None and self.map_ctx.rank > 0:
+            left, right = self.align(left, right)
+        return binop_map[op](left, right)
+
+    def eval_PLBinOp(self, node, frame):
+        return self.binop(node.op, self.eval(node.left, frame),
+                          self.eval(node.right, frame))
+
+    def eval_PLUnaryOp(self, node, frame):
+        if node.op not in unaryop_map:
+            raise NotImplementedError(f'npsim: unsupported operator {node.op}')
+        return unaryop_map[node.op](self.eval(node.operand, frame))
+
+    def eval_PLIfExp(self, node, frame):
+        test = self.eval(node.test, frame)
+        if isinstance(test, np.ndarray) and test.ndim > 0:
+            body, orelse = self.eval(node.body, frame), \
+                           self.eval(node.orelse, frame)
+            if self.map_ctx is not None and self.map_ctx.rank > 0:
+                body, orelse = self.align(body, orelse)
+            return np.where(test, body, orelse)
+        if test:
+            return self.eval(node.body, frame)
+        return self.eval(node.orelse, frame)
+
+    def eval_PLCall(self, node, frame):
+        name = node.func.name
+
+        if node.is_method and name == 'range':
+            # bit range of an integer, x[hi:lo]
+            value = self.eval(node.obj, frame)
+            if not np.issubdtype(np.asarray(value).dtype, np.integer):
+                raise NotImplementedError(
+                    'npsim: bit ranges of non-integer values')
+            hi = int(self.eval(node.args[0], frame))
+            lo = int(self.eval(node.args[1], frame))
+            return (value >> lo) & ((1 << (hi - lo + 1)) - 1)
+
+        args = [ self.eval(arg, frame) for arg in node.args ]
+
+        if hasattr(node, 'func_def_node'):
+            return self.call_function(node.func_def_node, args)
+        if name in func_map:
+            return func_map[name](*args)
+        raise NotImplementedError(f'npsim: unsupported function {name}')
+
+    def call_function(self, func_def, args):
+        frame = {}
+        for arg_node, arg in zip(func_def.args, args):
+            if isinstance(arg, np.ndarray) and arg.ndim > 0:
+                frame[arg_node.name] = arg  # arrays are passed by reference
+            else:
+                frame[arg_node.name] = cast(arg,
+                                            pl_np_type(arg_node.pl_type.ty))
+
+        saved_ctx, self.map_ctx = self.map_ctx, None
+        try:
+            self.run(func_def.body, frame)
+        except PLNpSimReturn as ret:
+            return ret.value
+        finally:
+            self.map_ctx = saved_ctx
+
+    def eval_PLDot(self, node, frame):
+        op1 = np.asarray(self.eval(node.op1, frame))
+        op2 = np.asarray(self.eval(node.op2, frame))
+        dtype = pl_np_type(node.pl_type.ty)
+        rank = self.map_ctx.rank if self.map_ctx is not None else 0
+
+        if rank == 0:
+            result = np.dot(op1.reshape(-1), op2.reshape(-1))
+        elif all(s == 1 for s in op2.shape[:rank]):
+            # same second operand at every point: one tensordot for all
+            result = np.tensordot(op1, op2.reshape(op2.shape[rank:]),
+                                  axes=op2.ndim - rank)
+        elif all(s == 1 for s in op1.shape[:rank]):
+            result = np.tensordot(op2, op1.reshape(op1.shape[rank:]),
+                                  axes=op1.ndim - rank)
+        else:
+            op1, op2 = np.broadcast_arrays(op1, op2)
+            result = np.einsum('...i,...i->...',
+                               op1.reshape(op1.shape[:rank] + (-1,)),
+                               op2.reshape(op2.shape[:rank] + (-1,)))
+        return cast(result, dtype)
+
+    def eval_PLMap(self, node, frame):
+        func = node.func
+        if func.return_shape != ():
+            raise NotImplementedError('npsim: plmap lambdas returning arrays')
+
+        shape = actual_shape(node.arrays[0].pl_shape)
+        dtype = pl_np_type(node.pl_type.ty)
+        out = np.empty(shape, dtype=dtype)
+
+        saved_ctx = self.map_ctx
+        try:
+            if self.vectorizable(func) and shape != ():
+                # evaluate chunks of whole rows of the iteration domain
+                row_points = int(np.prod(shape[1:]))
+                chunk = max(MAP_CHUNK_POINTS // max(row_points, 1), 1)
+                for lo in range(0, shape[0], chunk):
+                    hi = min(lo + chunk, shape[0])
+                    grid = [ np.arange(n).reshape(
+                                 (1,) * k + (n,) + (1,) * (len(shape)-k-1)) \
+                             for k, n in enumerate(shape) ]
+                    grid[0] = grid[0][lo:hi]
+                    self.map_ctx = self.map_context(node, frame, grid,
+                                                    (lo, hi))
+                    value = self.eval(func.body, frame)
+                    out[lo:hi] = np.broadcast_to(value, out[lo:hi].shape)
+            else:
+                for point in np.ndindex(*shape):
+                    self.map_ctx = self.map_context(node, frame, point)
+                    out[point] = self.eval(func.body, frame)
+        finally:
+            self.map_ctx = saved_ctx
+
+        return self.constant(out)
+
+    def map_context(self, node, frame, grid, rows=None):
+        '''Bind the lambda arguments of a plmap at the points of grid: index
+           arrays per iteration axis (rows of axis 0 from rows), or the
+           coordinates of a single point.'''
+        vectorized = rows is not None
+        outer_ctx, self.map_ctx = self.map_ctx, None
+        bindings = {}
+        for arg, array in zip(node.func.args, node.arrays):
+            if isinstance(array, PLSubscript):
+                base = frame[array.var.name]
+                dims = [ self.index(idx, frame) for idx in array.indices ]
+            else:
+                base = frame[array.name]
+                dims = []
+            dims += [slice(None)] * (base.ndim - len(dims))
+
+            indices = []
+            k = 0
+            for d, s in enumerate(dims):
+                if isinstance(s, slice):
+                    start, stop, step = s.indices(base.shape[d])
+                    if len(range(start, stop, step)) != 1:
+                        indices.append(start + step * grid[k])
+                        k += 1
+                        continue
+                    indices.append(start)
+                else:
+                    indices.append(s)
+
+            if vectorized:
+                view = base[tuple(dims)]
+                shape = actual_shape(view.shape)
+                value = view.reshape(shape)[rows[0]:rows[1]]
+            else:
+                value = base[tuple(indices)]
+            bindings[arg.name] = PLMapBinding(base, indices, value)
+
+        self.map_ctx = outer_ctx
+        return PLMapContext(len(grid) if vectorized else 0, bindings)
+
+    def vectorizable(self, func):
+        '''Whether a lambda can be evaluated for all points at once.'''
+        result = self.vectorizable_cache.get(id(func))
+        if result is None:
+            result = True
+            for node in plnode_walk(func.body):
+                if isinstance(node, (PLIPcore, PLMap)) or \
+                   (isinstance(node, PLCall) and \
+                    hasattr(node, 'func_def_node')):
+                    result = False
+                    break
+            self.vectorizable_cache[id(func)] = result
+        return result
@@ -1,8 +1,12 @@
 import copy
+import math
 
 from nodes import *
 from typer import PLType
 from iter_schedule import *
+from visitors import PLVisitor
+from estimator import op_latency
+from config import AUTO_UNROLL_TRIP, AUTO_UNROLL_OPS, FUSE_MAPS
 
 class PLOptLoop:
     def __init__(self, plfor, subloops):
@@ -25,6 +29,49 @@ class PLOptLoop:
         self.plnode.iter_dom.attr_args = None
 
 
+def const_trip_count(plfor):
+    '''Trip count of a loop whose bounds are constants, or None.'''
+    dom = plfor.iter_dom
+    if not all(isinstance(getattr(dom, f, None), PLConst) and \
+               isinstance(getattr(dom, f).value, int) \
+               for f in ('start', 'end', 'step')):
+        return None
+    start, end, step = dom.start.value, dom.end.value, dom.step.value
+    if dom.op == '<' and step > 0:
+        return max(0, -(-(end - start) // step))
+    if dom.op == '>' and step < 0:
+        return max(0, -(-(start - end) // -step))
+    return None
+
+
+def is_loop_pragma(stmt):
+    '''Whether stmt is a user pragma that pipelines or unrolls.'''
+    if not isinstance(stmt, PLPragma) or \
+       not isinstance(stmt.pragma, PLConst):
+        return False
+    pragma = str(stmt.pragma.value).lower()
+    return 'pipeline' in pragma or 'unroll' in pragma
+
+
+def loop_ops(stmts):
+    '''Operations on data in stmts, not counting those in nested loops
+       and in array indices.'''
+    ops = 0
+    todo = list(stmts)
+    while todo:
+        node = todo.pop()
+        if isinstance(node, list):
+            todo.extend(node)
+        elif isinstance(node, PLSubscript):
+            todo.append(node.var)
+        elif isinstance(node, PLNode) and not isinstance(node, PLFor):
+            if isinstance(node, (PLBinOp, PLCall)) or \
+               (isinstance(node, PLAssign) and node.op != '='):
+                ops += 1
+            todo.extend(value for _, value in iter_fields(node))
+    return ops
+
+
 def get_loop_structure(node):
     loops_found = []
     if isinstance(node, PLNode):
@@ -47,12 +94,44 @@ def get_loop_structure(node):
         return loops_found
 
 
-class PLOptMapTransformer:
+def link_rewritten(node, field, old_ids):
+    '''Link the children in field of node after a rewrite of the field:
+       the subtrees that were not there before (their ids not in old_ids)
+       throughout, the others only to node.'''
+    value = getattr(node, field)
+    for item in value if isinstance(value, list) else [value]:
+        if isinstance(item, PLNode) and id(item) not in old_ids:
+            plnode_link_parent(item)
+    link_field(node, field)
+
+
+def dot_accumulators(ty, shape, freq=100.0):
+    '''Number of partial sums dot() of arrays of shape accumulates into, so
+       that consecutive products go to different partial sums and the
+       accumulation can be pipelined with II=1: the latency of an adder of
+       ty at freq MHz, rounded up to a power of two (for the adder tree),
+       and at most the number of products.'''
+    latency = op_latency('+', ty, freq)
+    k = 1
+    while k < latency:
+        k *= 2
+    while k > 1 and k > math.prod(shape):
+        k //= 2
+    return k
 
-    def __init__(self, backend='vhls', debug=False):
+
+class PLOptMapTransformer(PLVisitor):
+
+    def __init__(self, backend='vhls', debug=False, freq=100.0):
         self.backend = backend
         self.debug = debug
+        self.freq = freq
         self.count = 0
+        self.dot_count = 0
+        # loops of the dot lowering that get directives once the directives
+        # of the loops around them are known, see PLOptimizer.dot_directives
+        self.dot_chunks = []
+        self.dot_dependences = []
 
     def visit(self, node, config=None):
         """Visit a node."""
@@ -60,15 +139,15 @@ class PLOptMapTransformer:
         if self.debug:
             print(f'OPT visiting {node.__class__.__name__}, {node}')
 
-        method = 'visit_' + node.__class__.__name__
-        visitor = getattr(self, method, self.generic_visit)
-        visit_return = visitor(node, config)
+        visitor = self.dispatch(node)
+        visit_return = visitor(self, node, config)
 
         return visit_return
 
     def generic_visit(self, node, config=None):
         for field, old_value in iter_fields(node):
             if isinstance(old_value, list):
+                old_ids = { id(value) for value in old_value }
                 new_values = []
                 for value in old_value:
                     if isinstance(value, PLNode):
@@ -83,12 +162,14 @@ class PLOptMapTransformer:
                     else:
                         new_values.append(value)
                 old_value[:] = new_values
+                link_rewritten(node, field, old_ids)
             elif isinstance(old_value, PLNode):
                 new_node = self.visit(old_value, config)
                 if new_node is None:
                     delattr(node, field)
                 else:
                     setattr(node, field, new_node)
+                    link_rewritten(node, field, { id(old_value) })
         return node
 
     def get_subscript(self, op_node, iter_prefix='i',
@@ -183,6 +264,7 @@ class PLOptMapTransformer:
     def visit_PLSubscript(self, node, config=None):
         node.var = self.visit(node.var, config)
         node.indices = [self.visit(idx, config) for idx in node.indices]
+        link_children(node)
         return node
 
     def visit_PLLambda(self, node, config=None):
@@ -288,18 +370,6 @@ class PLOptMapTransformer:
         op_type = node.op_type
         op_shape = node.op_shape
 
-        tmp_var = PLVariable('tmp_dot')
-
-        tmp_var.pl_type = PLType(ty=op_type.ty, dim=0)
-        tmp_var.pl_shape = ()
-
-        var_decl = PLVariableDecl(ty=op_type.ty,
-                                  name=tmp_var,
-                                  init=PLConst(0))
-
-        var_decl.pl_type = PLType(ty=op_type.ty, dim=0)
-        var_decl.pl_shape = ()
-
         op1_subs = self.get_subscript(node.op1, 'i_dot_', config)
         op2_subs = self.get_subscript(node.op2, 'i_dot_', config)
 
@@ -318,14 +388,51 @@ class PLOptMapTransformer:
         mult.pl_type = PLType(ty=op_type.ty, dim=0)
         mult.pl_shape = ()
 
-        stmt = [PLAssign(op='+=',
-                         target=tmp_var,
-                         value=mult)]
+        # write back to target
 
-        stmt[0].pl_type = PLType(ty=op_type.ty, dim=0)
-        stmt[0].pl_shape = ()
-        stmt[0].is_decl = False
+        if node.target:
+            target = node.target
+        elif hasattr(node, 'parent'):
+            target = node.parent.target
+        else:
+            raise NotImplementedError
 
+        k = dot_accumulators(op_type.ty, op_shape, self.freq)
+        if k > 1:
+            return self.dot_partial_sums(node, mult, target, k)
+
+        tmp_var = PLVariable('tmp_dot')
+
+        tmp_var.pl_type = PLType(ty=op_type.ty, dim=0)
+        tmp_var.pl_shape = ()
+
+        var_decl = PLVariableDecl(ty=op_type.ty,
+                                  name=tmp_var,
+                                  init=PLConst(0))
+
+        var_decl.pl_type = PLType(ty=op_type.ty, dim=0)
+        var_decl.pl_shape = ()
+
+        stmt = [self.scalar_assign('+=', tmp_var, mult, op_type.ty)]
+        stmt = self.dot_loops(op_shape, stmt)
+
+        write_back = self.scalar_assign('=', target, tmp_var,
+                                        node.pl_type.ty)
+
+        return [var_decl, stmt, write_back]
+        # return stmt[0]
+
+    def scalar_assign(self, op, target, value, ty):
+        assign = PLAssign(op=op,
+                          target=target,
+                          value=value)
+        assign.pl_type = PLType(ty=ty, dim=0)
+        assign.pl_shape = ()
+        assign.is_decl = False
+        return assign
+
+    def dot_loops(self, op_shape, body):
+        stmt = body
         for i in range(len(op_shape) - 1, -1, -1):
             target = PLVariable(f'i_dot_{i}')
             target.pl_type = PLType('int', 0)
@@ -336,30 +443,149 @@ class PLOptMapTransformer:
                            body=stmt,
                            orelse=[],
                            source='dot') ]
-
-        # write back to target
-
-        if node.target:
-            target = node.target
-        elif hasattr(node, 'parent'):
-            target = node.parent.target
+        return stmt[0]
+
+    def dot_partial_sums(self, node, mult, target, k):
+        '''Lower dot() to k partial sums in a completely partitioned
+           buffer, added up by a balanced tree of unrolled loops at the end.
+
+           The innermost dimensions whose products are a multiple of k are
+           strip-mined: a pipelined loop over chunks of k products runs an
+           unrolled loop that adds product i_acc of the chunk to partial sum
+           i_acc, a constant index in every copy. Otherwise product n of the
+           loop nest (in iteration order) is added to partial sum n % k, the
+           same partial sum being updated every k iterations. Directives on
+           these loops are left to dot_directives.'''
+        ty = node.op_type.ty
+        op_shape = node.op_shape
+        name = f'tmp_dot_acc_{self.dot_count}'
+        self.dot_count += 1
+
+        def acc(index):
+            var = PLVariable(name)
+            var.pl_type = PLType(ty=ty, dim=1)
+            var.pl_shape = (k,)
+            sub = PLSubscript(var=var, indices=[index])
+            sub.pl_type = PLType(ty=ty, dim=0)
+            sub.pl_shape = ()
+            return sub
+
+        def unrolled_loop(end, body):
+            loop = gen_loop_nest([end], [body], 'acc', ['i_acc'])
+            loop.iter_dom.attr = 'unroll'
+            return loop
+
+        decl = PLArrayDecl(ele_type=ty,
+                           name=PLVariable(name),
+                           dims=PLArray(elts=[PLConst(k)]))
+        partition = PLPragma(PLConst(
+            f'HLS array_partition variable={name} complete dim=1'))
+        init = unrolled_loop(k, self.scalar_assign('=',
+                                                   acc(PLVariable('i_acc')),
+                                                   PLConst(0), ty))
+
+        # first dimension of the shortest suffix of the shape whose
+        # products are a multiple of k
+        first = None
+        for i in range(len(op_shape) - 1, -1, -1):
+            if math.prod(op_shape[i:]) % k == 0:
+                first = i
+                break
+
+        if first is not None:
+            # product i_acc of chunk i_dot_chunk of the suffix; the indices
+            # of its dimensions follow from its position
+            chunk = PLVariable('i_dot_chunk')
+            chunk.pl_type = PLType('int', 0)
+            chunk.pl_shape = ()
+            indices = {}
+            for i in range(first, len(op_shape)):
+                index = PLBinOp(op='+', left=PLVariable('i_dot_chunk'),
+                                right=PLVariable('i_acc'))
+                stride = math.prod(op_shape[i + 1:])
+                if stride != 1:
+                    index = PLBinOp(op='/', left=index,
+                                    right=PLConst(stride))
+                if i > first:
+                    index = PLBinOp(op='%', left=index,
+                                    right=PLConst(op_shape[i]))
+                indices[f'i_dot_{i}'] = index
+            self.substitute(mult, indices)
+
+            add = unrolled_loop(k, self.scalar_assign('+=',
+                                                      acc(PLVariable('i_acc')),
+                                                      mult, ty))
+            dom = PLIterDom(start=PLConst(0),
+                            end=PLConst(math.prod(op_shape[first:])),
+                            step=PLConst(k))
+            chunks = PLFor(target=chunk, iter_dom=dom, body=[add], orelse=[],
+                           source='dot')
+            self.dot_chunks.append(chunks)
+            loops = self.dot_loops(op_shape[:first], [chunks])
         else:
-            raise NotImplementedError
-
-        write_back = PLAssign(op='=',
-                              target=target,
-                              value=tmp_var)
-        write_back.pl_type = PLType(ty=node.pl_type.ty, dim=0)
-        write_back.pl_shape = ()
-        write_back.is_decl = False
-
-        return [var_decl, stmt[0], write_back]
-        # return stmt[0]
+            # position of the product in iteration order, modulo k;
+            # dimensions whose stride is a multiple of k do not contribute
+            index = None
+            for i in range(len(op_shape)):
+                stride = math.prod(op_shape[i + 1:]) % k
+                if stride == 0:
+                    continue
+                term = PLVariable(f'i_dot_{i}')
+                if stride != 1:
+                    term = PLBinOp(op='*', left=term, right=PLConst(stride))
+                index = term if index is None else \
+                        PLBinOp(op='+', left=index, right=term)
+            index = PLBinOp(op='%', left=index, right=PLConst(k))
+            loops = self.dot_loops(op_shape,
+                                   [self.scalar_assign('+=', acc(index), mult,
+                                                       ty)])
+            innermost = loops
+            while isinstance(innermost.body[0], PLFor):
+                innermost = innermost.body[0]
+            self.dot_dependences.append((innermost,
+                f'HLS DEPENDENCE variable={name} inter distance={k} true'))
+
+        # adder tree: halve the number of partial sums at every level
+        tree = []
+        width = k // 2
+        while width >= 1:
+            add = PLBinOp(op='+',
+                          left=acc(PLVariable('i_acc')),
+                          right=acc(PLBinOp(op='+', left=PLVariable('i_acc'),
+                                            right=PLConst(width))))
+            add.pl_type = PLType(ty=ty, dim=0)
+            add.pl_shape = ()
+            tree.append(unrolled_loop(width,
+                                      self.scalar_assign('=',
+                                          acc(PLVariable('i_acc')), add,
+                                          ty)))
+            width //= 2
+
+        write_back = self.scalar_assign('=', target, acc(PLConst(0)),
+                                        node.pl_type.ty)
+
+        return [decl, partition, init, loops] + tree + [write_back]
+
+    def substitute(self, node, exprs):
+        '''Replace the variables named in exprs (name -> expression) in
+           node.'''
+        for field, value in iter_fields(node):
+            items = value if isinstance(value, list) else [value]
+            for i, item in enumerate(items):
+                if isinstance(item, PLVariable) and item.name in exprs:
+                    new = plnode_copy(exprs[item.name])
+                    if isinstance(value, list):
+                        value[i] = new
+                    else:
+                        setattr(node, field, new)
+                elif isinstance(item, PLNode):
+                    self.substitute(item, exprs)
 
     def visit_PLFunctionDef(self, node, config=None):
         # breakpoint()
         for field, old_value in iter_fields(node):
             if isinstance(old_value, list):
+                old_ids = { id(value) for value in old_value }
                 new_values = []
                 for value in old_value:
                     if isinstance(value, PLNode):
@@ -371,23 +597,53 @@ class PLOptMapTransformer:
                             continue
                     new_values.append(value)
                 old_value[:] = new_values
+                link_rewritten(node, field, old_ids)
             elif isinstance(old_value, PLNode):
                 new_node = self.visit(old_value, config)
                 if new_node is None:
                     delattr(node, field)
                 else:
                     setattr(node, field, new_node)
+                    link_rewritten(node, field, { id(old_value) })
         return node
 
 
 class PLOptimizer:
-    def __init__(self, backend='vhls', debug=False):
+    '''Lowers maps and dots to loops and applies loop optimizations.
+
+       design optionally overrides the default choices, e.g. one picked by
+       design-space exploration (see dse.py):
+
+       {
+         'schedules':  [ [['tile', 0, 4]], [] ],  # per PLMap, in IR order
+         'loops':      { '0.1': ['pipeline'],      # per loop, by its path
+                         '1':   ['unroll', 4] },   # in get_loop_structure
+         'partitions': { 'buf': ['cyclic', 4, 1] }, # type, factor, dim
+         'auto':       True    # see auto_optimize
+       }
+    '''
+
+    def __init__(self, backend='vhls', debug=False, design=None,
+                 freq=100.0):
         self.backend = backend
         self.debug = debug
-        self.map_transformer = PLOptMapTransformer(backend, debug)
+        self.design = design
+        self.map_transformer = PLOptMapTransformer(backend, debug, freq)
 
     def opt(self, node):
+        if self.design:
+            self.set_map_schedules(node)
+
+        # loops the user pipelined or unrolled, before the transformer adds
+        # loops of its own
+        user_loops = self.user_directed_loops(node) \
+                     if self.design and self.design.get('auto') else None
+
         self.map_transformer.visit(node)
+        # map fusion is part of the automatic optimization
+        if FUSE_MAPS and self.design and self.design.get('auto'):
+            from fusion import PLMapFusion
+            PLMapFusion(self.debug).fuse(node)
         self.loops = get_loop_structure(node)
 
         if self.debug:
@@ -402,3 +658,184 @@ class PLOptimizer:
                     unroll_innermost(loop.subloops)
 
         # unroll_innermost(self.loops)
+
+        if user_loops is not None:
+            self.auto_optimize(user_loops)
+
+        if self.design:
+            self.apply_design(node)
+
+        self.dot_directives(node)
+
+        from dependence import PLDependenceAnalyzer
+        dependences = PLDependenceAnalyzer(self.debug)
+        dependences.analyze(self.loops)
+        dependences.check_pragmas(node)
+
+        if user_loops is not None:
+            from partition import PLPartitioner
+            PLPartitioner(self.debug).infer(node, self.loops)
+
+            inserted = dependences.insert_pragmas(self.auto_pipelined)
+            if inserted:
+                print('Dependence pragmas:')
+            for path, name, pragma in inserted:
+                print(f'  loop {path} ({name}): {pragma}')
+
+    def dot_directives(self, node):
+        '''Pipeline the chunk loops of dot partial sums, and tell HLS the
+           distance of the partial sums updated with a modulo index, where
+           no loop around them is pipelined or unrolled: the chunks of an
+           unrolled or pipelined loop run in parallel, and the distance
+           holds for consecutive iterations of the innermost loop only.'''
+        chunks = { id(l) for l in self.map_transformer.dot_chunks }
+        dependences = { id(l): pragma for l, pragma \
+                        in self.map_transformer.dot_dependences }
+
+        def directed(plfor):
+            return plfor.iter_dom.attr is not None or \
+                   any(is_loop_pragma(stmt) for stmt in plfor.body)
+
+        def visit(node, inside):
+            if isinstance(node, list):
+                for item in node:
+                    visit(item, inside)
+                return
+            if not isinstance(node, PLNode):
+                return
+            if isinstance(node, PLFunctionDef):
+                inside = inside or \
+                         any(is_loop_pragma(stmt) for stmt in node.body)
+            elif isinstance(node, PLFor):
+                if not inside and id(node) in chunks and not directed(node):
+                    node.iter_dom.attr = 'pipeline'
+                if not inside and id(node) in dependences and \
+                   node.iter_dom.attr != 'unroll':
+                    node.body.insert(0, PLPragma(PLConst(
+                        dependences[id(node)])))
+                    link_field(node, 'body')
+                inside = inside or directed(node)
+            for _, field in iter_fields(node):
+                if isinstance(field, (PLNode, list)):
+                    visit(field, inside)
+
+        visit(node, False)
+
+    def user_directed_loops(self, node):
+        '''Loops with a pipeline or unroll directive of the user (on the
+           loop, in its body, or in the body of its function).'''
+        loops = set()
+        for n in plnode_walk(node):
+            if isinstance(n, PLFunctionDef) and \
+               any(is_loop_pragma(stmt) for stmt in n.body):
+                loops.update(id(l) for l in plnode_walk(n.body) \
+                             if isinstance(l, PLFor))
+            elif isinstance(n, PLFor) and \
+                 (n.iter_dom.attr is not None or \
+                  any(is_loop_pragma(stmt) for stmt in n.body)):
+                loops.add(id(n))
+        return loops
+
+    def auto_optimize(self, user_loops):
+        '''Pipeline the innermost non-trivial loop of every loop nest, and
+           fully unroll the inner loops below it that have at most
+           AUTO_UNROLL_TRIP iterations, as long as the unrolled body has at
+           most AUTO_UNROLL_OPS operations. Nests with a loop the user
+           pipelined or unrolled are left unchanged, and so are loops the
+           optimizer itself annotated (dot adder trees). Prints what it
+           did.'''
+        self.auto_actions = []
+        self.auto_pipelined = set()
+
+        def nest_loops(loop):
+            yield loop
+            for sub in loop.subloops:
+                yield from nest_loops(sub)
+
+        for i, loop in enumerate(self.loops):
+            if any(id(l.plnode) in user_loops for l in nest_loops(loop)):
+                self.auto_actions.append((str(i), loop.plnode.target.name,
+                                          'unchanged (user directives)'))
+                continue
+            self.auto_loop(loop, str(i), True)
+
+        print('Automatic loop optimization:')
+        for path, name, action in self.auto_actions:
+            print(f'  loop {path} ({name}): {action}')
+
+    def auto_loop(self, loop, path, outermost):
+        '''Returns whether loop ends up fully unrolled, and the operations
+           of its unrolled body.'''
+        plfor = loop.plnode
+        if plfor.iter_dom.attr is not None:
+            return plfor.iter_dom.attr == 'unroll' and \
+                   not plfor.iter_dom.attr_args, 0
+
+        inner = [ self.auto_loop(sub, f'{path}.{i}', False) \
+                  for i, sub in enumerate(loop.subloops) ]
+        if not all(unrolled for unrolled, _ in inner):
+            return False, 0
+
+        trip = const_trip_count(plfor)
+        ops = max(1, loop_ops(plfor.body) + sum(o for _, o in inner))
+        if trip == 1:
+            return True, ops
+        if not outermost and trip is not None and \
+           trip <= AUTO_UNROLL_TRIP and trip * ops <= AUTO_UNROLL_OPS:
+            loop.unroll()
+            self.auto_actions.append((path, plfor.target.name, 'unroll'))
+            return True, trip * ops
+
+        loop.pipeline()
+        self.auto_pipelined.add(id(plfor))
+        self.auto_actions.append((path, plfor.target.name, 'pipeline'))
+        return False, 0
+
+    def set_map_schedules(self, node):
+        schedules = self.design.get('schedules', [])
+        maps = [ n for n in plnode_walk(node) if isinstance(n, PLMap) ]
+        for plmap, schedule in zip(maps, schedules):
+            plmap.schedules = [ [ tuple(s) for s in schedule ] ]
+
+    def loop_at(self, path):
+        loops = self.loops
+        loop = None
+        for idx in path.split('.'):
+            loop = loops[int(idx)]
+            loops = loop.subloops
+        return loop
+
+    def apply_design(self, node):
+        for path, directive in self.design.get('loops', {}).items():
+            loop = self.loop_at(path)
+            if directive[0] == 'pipeline':
+                loop.pipeline()
+            elif directive[0] == 'unroll':
+                loop.unroll(directive[1] if len(directive) > 1 else None)
+
+        for name, (kind, factor, dim) in \
+                self.design.get('partitions', {}).items():
+            pragma = f'HLS array_partition variable={name} {kind}' + \
+                     (f' factor={factor}' if factor else '') + f' dim={dim}'
+            if not insert_after_decl(node, name, PLPragma(PLConst(pragma))):
+                print(f'WARNING: no array {name} to partition.')
+
+
+def insert_after_decl(node, name, stmt):
+    '''Insert stmt right after the declaration of array name.'''
+    if isinstance(node, list):
+        for idx, item in enumerate(node):
+            if isinstance(item, PLArrayDecl) and item.name.name == name:
+                node.insert(idx + 1, stmt)
+                return True
+            if insert_after_decl(item, name, stmt):
+                return True
+    elif isinstance(node, PLNode):
+        for field, value in iter_fields(node):
+            if isinstance(value, (list, PLNode)) and \
+               insert_after_decl(value, name, stmt):
+                if isinstance(value, list) and \
+                   any(item is stmt for item in value):
+                    link_field(node, field)
+                return True
+    return False
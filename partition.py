@@ -0,0 +1,397 @@
+import re
+import math
+import itertools
+
+from nodes import *
+from estimator import PLEstimator, BRAM_PORTS, MAXI_PORTS, MAXI_BUNDLES
+from optimizer import const_trip_count, insert_after_decl
+
+# most copies of a loop body whose accesses are enumerated to check ports
+MAX_PORT_CHECK_COPIES = 4096
+
+
+def affine(expr):
+    '''expr as {variable: coefficient, None: constant} if it is an affine
+       function of integer variables, or None.'''
+    if isinstance(expr, PLConst):
+        value = expr.value
+        if isinstance(value, int) and not isinstance(value, bool):
+            return {None: value}
+        return None
+    if isinstance(expr, PLVariable):
+        return {expr.name: 1}
+    if isinstance(expr, PLUnaryOp) and expr.op in ('-', '+'):
+        operand = affine(expr.operand)
+        return affine_scale(operand, -1 if expr.op == '-' else 1)
+    if isinstance(expr, PLBinOp):
+        left, right = affine(expr.left), affine(expr.right)
+        if left is None or right is None:
+            return None
+        if expr.op == '+':
+            return affine_add(left, right)
+        if expr.op == '-':
+            return affine_add(left, affine_scale(right, -1))
+        if expr.op == '*':
+            if set(left) <= {None}:
+                return affine_scale(right, left.get(None, 0))
+            if set(right) <= {None}:
+                return affine_scale(left, right.get(None, 0))
+    return None
+
+
+def affine_add(a, b):
+    result = dict(a)
+    for var, coef in b.items():
+        result[var] = result.get(var, 0) + coef
+    return { var: coef for var, coef in result.items() \
+             if coef != 0 or var is None }
+
+
+def affine_scale(a, factor):
+    if a is None:
+        return None
+    return affine_add({}, { var: coef * factor for var, coef in a.items() })
+
+
+def array_access(node):
+    '''Array name and indices (over all dimensions) of a subscript.'''
+    indices = []
+    while isinstance(node, PLSubscript):
+        indices = list(node.indices) + indices
+        node = node.var
+    return (node.name if isinstance(node, PLVariable) else None), indices
+
+
+def array_accesses(stmts):
+    '''(array, indices, is_write) of the array accesses in stmts, in the
+       order they are made; a read-modify-write (+=, ...) counts as a read
+       and a write.'''
+    accesses = []
+
+    def walk(node, write=False):
+        if isinstance(node, list):
+            for item in node:
+                walk(item)
+        elif isinstance(node, PLSubscript):
+            name, indices = array_access(node)
+            if name is not None:
+                accesses.append((name, indices, write))
+            for index in indices:
+                walk(index)
+        elif isinstance(node, PLAssign):
+            walk(node.value)
+            if isinstance(node.target, PLSubscript):
+                if node.op != '=':
+                    walk(node.target)
+                walk(node.target, write=True)
+            else:
+                walk(node.target)
+        elif isinstance(node, PLNode):
+            for _, value in iter_fields(node):
+                if isinstance(value, (PLNode, list)):
+                    walk(value)
+
+    walk(stmts)
+    return accesses
+
+
+def partition_pragmas(node):
+    '''array -> {dim: (kind, factor)} of the array_partition pragmas in
+       node; dim 0 partitions every dimension.'''
+    partitions = {}
+    for stmt in plnode_walk(node):
+        if not isinstance(stmt, PLPragma) or \
+           not isinstance(stmt.pragma, PLConst):
+            continue
+        pragma = str(stmt.pragma.value)
+        if 'array_partition' not in pragma.lower():
+            continue
+        args = dict(re.findall(r'(\w+)\s*=\s*(\w+)', pragma))
+        kind = 'complete'
+        for k in ('cyclic', 'block'):
+            if re.search(rf'\b{k}\b', pragma.lower()):
+                kind = k
+        partitions.setdefault(args.get('variable'), {})[ \
+            int(args.get('dim', 1))] = (kind, int(args.get('factor', 0)))
+    return partitions
+
+
+class PLPartitioner:
+    '''Infers array_partition pragmas for local arrays from the accesses of
+       pipelined and unrolled loops (run by PLOptimizer in autoopt mode).
+
+       The copies of a loop body that run in the same cycle are those of
+       the loops unrolled inside a pipelined loop (HLS fully unrolls them)
+       or of unrolled loops. A dimension of an array indexed by an affine
+       function of the unrolled iterators is partitioned so that the copies
+       access different banks: cyclic with one bank per copy, block if the
+       copies access elements at least a block apart, and complete if
+       there are as many copies as elements. Dimensions the user (or the
+       design) partitioned are kept.
+
+       The accesses of each loop are then counted per bank, with the two
+       ports of a BRAM and the single port of an AXI master bundle; a warning
+       is printed where the ports limit the II (or serialize the copies of
+       an unrolled loop).
+    '''
+
+    def __init__(self, debug=False):
+        self.debug = debug
+        self.directives = PLEstimator().loop_directives
+
+    def infer(self, node, loops):
+        self.shapes = {}
+        for n in plnode_walk(node):
+            if isinstance(n, PLArrayDecl):
+                self.shapes[n.name.name] = \
+                    tuple(e.value for e in n.dims.elts)
+
+        self.bundles = {}
+        top = [ n for n in plnode_walk(node) \
+                if isinstance(n, PLFunctionDef) and n.pl_top ]
+        if top:
+            bundle = -1
+            for arg in top[0].args:
+                shape = getattr(arg, 'pl_shape', None)
+                if shape not in {None, (1,), ()}:
+                    bundle = (bundle + 1) % MAXI_BUNDLES
+                    self.bundles[arg.name] = bundle
+
+        self.regions = []
+        self.find_regions(loops, '', {})
+
+        existing = partition_pragmas(node)
+        inferred = {}
+        for path, plfor, par, ii in self.regions:
+            for name, dims in self.region_partitions(plfor, par).items():
+                done = existing.get(name, {})
+                for dim, part in dims.items():
+                    if 0 in done or dim + 1 in done:
+                        continue
+                    old = inferred.setdefault(name, {}).get(dim)
+                    if old is not None:
+                        part = self.merge(old[0], part)
+                        if part == old[0]:
+                            continue
+                    inferred[name][dim] = (part, path)
+
+        inferred = { name: dims for name, dims in inferred.items() if dims }
+        if inferred:
+            print('Array partitioning:')
+        for name, dims in inferred.items():
+            for dim, ((kind, factor), path) in sorted(dims.items()):
+                spec = kind + (f' factor={factor}' if kind != 'complete' \
+                                                 else '') + f' dim={dim + 1}'
+                insert_after_decl(node, name, PLPragma(PLConst(
+                    f'HLS array_partition variable={name} {spec}')))
+                existing.setdefault(name, {})[dim + 1] = (kind, factor)
+                print(f'  {name}: {spec} (loop {path})')
+
+        for path, plfor, par, ii in self.regions:
+            self.check_ports(path, plfor, par, ii, existing)
+        return inferred
+
+    ######## Loops running copies of their body in parallel ########
+
+    def find_regions(self, loops, prefix, outer):
+        '''Collects (path, loop, {iterator: (copies, step)}, II target) of
+           the outermost pipelined loops, and of the outermost unrolled
+           loops without a pipelined loop inside.'''
+        for i, loop in enumerate(loops):
+            path = f'{prefix}{i}'
+            plfor = loop.plnode
+            ii, unroll = self.directives(plfor)
+            if ii:
+                par = dict(outer)
+                for sub in self.nest(loop.subloops):
+                    par[sub.plnode.target.name] = \
+                        self.copies(sub.plnode, 0)
+                self.regions.append((path, plfor, par, ii))
+            elif unroll is not None:
+                par = dict(outer)
+                par[plfor.target.name] = self.copies(plfor, unroll)
+                if any(self.directives(sub.plnode)[0] \
+                       for sub in self.nest(loop.subloops)):
+                    self.find_regions(loop.subloops, f'{path}.', par)
+                    continue
+                for sub in self.nest(loop.subloops):
+                    sub_unroll = self.directives(sub.plnode)[1]
+                    if sub_unroll is not None:
+                        par[sub.plnode.target.name] = \
+                            self.copies(sub.plnode, sub_unroll)
+                self.regions.append((path, plfor, par, 0))
+            else:
+                self.find_regions(loop.subloops, f'{path}.', outer)
+
+    def nest(self, loops):
+        for loop in loops:
+            yield loop
+            yield from self.nest(loop.subloops)
+
+    def copies(self, plfor, unroll):
+        '''(copies, step) of a loop unrolled by unroll (0: completely);
+           copies is None if the trip count is not known.'''
+        step = plfor.iter_dom.step
+        step = step.value if isinstance(step, PLConst) and \
+                             isinstance(step.value, int) else 1
+        trip = const_trip_count(plfor)
+        if unroll:
+            return (min(unroll, trip) if trip else unroll), step
+        return trip, step
+
+    ######## Partitions ########
+
+    def region_partitions(self, plfor, par):
+        '''array -> {dim: (kind, factor)} needed by the accesses of a loop
+           to local arrays.'''
+        partitions = {}
+        for name, indices, _ in array_accesses(plfor.body):
+            shape = self.shapes.get(name)
+            if shape is None or len(indices) != len(shape):
+                continue
+            for dim, index in enumerate(indices):
+                part = self.dim_partition(affine(index), par, shape[dim])
+                if part is None:
+                    continue
+                old = partitions.setdefault(name, {}).get(dim)
+                partitions[name][dim] = part if old is None else \
+                                        self.merge(old, part)
+        return partitions
+
+    def dim_partition(self, index, par, size):
+        '''Partition of a dimension of size elements for an index accessed
+           by the parallel copies of par.'''
+        if index is None:
+            return None
+        copies, stride = 1, None
+        for var, coef in index.items():
+            if var is None or var not in par:
+                continue
+            n, step = par[var]
+            if n is None:
+                return None
+            copies *= n
+            s = abs(coef * step)
+            stride = s if stride is None else min(stride, s)
+        if copies <= 1:
+            return None
+
+        if copies >= size:
+            return ('complete', 0)
+        if stride > 1 and stride >= -(-size // copies):
+            return ('block', copies)
+        factor = copies if math.gcd(stride, copies) == 1 \
+                        else copies * stride
+        if factor >= size:
+            return ('complete', 0)
+        return ('cyclic', factor)
+
+    def merge(self, a, b):
+        '''One partition of a dimension for two access patterns.'''
+        if 'complete' in (a[0], b[0]):
+            return ('complete', 0)
+        if a[0] == b[0]:
+            return max(a, b)
+        # block and cyclic: the cyclic partition, ports are checked later
+        return a if a[0] == 'cyclic' else b
+
+    ######## Ports ########
+
+    def check_ports(self, path, plfor, par, ii, partitions):
+        accesses = [ a for a in array_accesses(plfor.body) \
+                     if a[0] in self.shapes or a[0] in self.bundles ]
+        known = { var: copies for var, copies in par.items() \
+                  if copies[0] is not None }
+        if not accesses or \
+           math.prod(n for n, _ in known.values()) > MAX_PORT_CHECK_COPIES:
+            return
+
+        # nodes inside each unrolled loop of the body; the other loops of
+        # par enclose the whole body
+        inside = {}
+        assigned = set()
+        for n in plnode_walk(plfor.body):
+            if isinstance(n, PLFor) and n.target.name in known:
+                inside[n.target.name] = { id(m) for m in plnode_walk(n.body) }
+            elif isinstance(n, PLAssign) and \
+                 isinstance(n.target, PLVariable):
+                assigned.add(n.target.name)
+            elif isinstance(n, PLVariableDecl):
+                assigned.add(n.name.name)
+
+        per_bank = {}
+        # copies accessing the same element share the access
+        addresses = set()
+        for i, (name, indices, write) in enumerate(accesses):
+            enclosing = [ v for v in known \
+                          if v not in inside or id(indices[0]) in inside[v] ]
+            # variables assigned in the body may depend on any iterator
+            used = [ self.variables(index) for index in indices ]
+            used = [ set(enclosing) if names & assigned else names \
+                     for names in used ]
+            names = [ v for v in enclosing if any(v in u for u in used) ]
+            for copy in itertools.product(*(range(known[v][0]) \
+                                            for v in names)):
+                env = { v: k * known[v][1] for v, k in zip(names, copy) }
+                address = tuple(self.address(index, env, i, u) \
+                                for index, u in zip(indices, used))
+                if (name, address, write) in addresses:
+                    continue
+                addresses.add((name, address, write))
+                bank = self.bank(name, address, partitions)
+                if bank is not None:
+                    per_bank[bank] = per_bank.get(bank, 0) + 1
+
+        target = ii or 1
+        warned = set()
+        for (memory, bank), count in per_bank.items():
+            ports = MAXI_PORTS if memory.startswith('bundle ') \
+                               else BRAM_PORTS
+            needed = -(-count // ports)
+            if needed <= target or memory in warned:
+                continue
+            warned.add(memory)
+            limit = f'limit the II to {needed}' if ii else \
+                    f'serialize the unrolled copies over {needed} cycles'
+            print(f'WARNING: loop {path}: {count} accesses per cycle to ' + \
+                  (f'bank {bank} of ' if bank else '') + \
+                  f'{memory} ({ports} port(s)) {limit}.')
+
+    def address(self, index, env, i, used):
+        a = affine(index)
+        if a is None:
+            # unknown index, the same for the same access in the copies of
+            # the loops it does not depend on
+            return ('?', i, tuple(sorted((v, env[v]) for v in used \
+                                         if v in env)))
+        return sum(coef * (1 if var is None else env.get(var, 0)) \
+                   for var, coef in a.items())
+
+    def variables(self, index):
+        return { n.name for n in plnode_walk(index) \
+                 if isinstance(n, PLVariable) }
+
+    def bank(self, name, address, partitions):
+        '''(memory, bank) an access goes to, or None for registers.'''
+        if name in self.bundles:
+            return (f'bundle data{self.bundles[name]}', ())
+        shape = self.shapes[name]
+        parts = partitions.get(name, {})
+        kinds = [ parts.get(dim + 1, parts.get(0, (None, 0))) \
+                  for dim in range(len(shape)) ]
+        if all(kind == 'complete' for kind, _ in kinds):
+            return None
+        bank = []
+        for dim, ((kind, factor), idx) in enumerate(zip(kinds, address)):
+            if kind is None:
+                continue
+            if isinstance(idx, tuple):
+                # any bank: all accesses with unknown indices collide
+                bank.append('?')
+            elif kind == 'complete':
+                bank.append(idx)
+            elif kind == 'cyclic':
+                bank.append(idx % factor)
+            else:
+                bank.append(idx // -(-shape[dim] // factor))
+        return (name, tuple(bank))
@@ -0,0 +1,189 @@
+import os
+import ast
+import json
+import time
+import pstats
+import cProfile
+import tracemalloc
+import contextlib
+
+from nodes import PLNode, iter_fields
+
+
+def count_nodes(tree):
+    '''Number of nodes in a Python AST or a PyLog IR.'''
+    if tree is None:
+        return None
+    if isinstance(tree, ast.AST):
+        return sum(1 for _ in ast.walk(tree))
+
+    count = 0
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(node)
+        elif isinstance(node, PLNode):
+            count += 1
+            for name, field in iter_fields(node):
+                if isinstance(field, (PLNode, list)):
+                    stack.append(field)
+    return count
+
+
+class PLPassRecord:
+    '''Measurements of one compiler pass. Set output to the tree a pass
+       returns when it does not transform its input in place.'''
+
+    def __init__(self, name, tree):
+        self.name = name
+        self.input = tree
+        self.output = None
+        self.start = None
+        self.wall_time = None
+        self.nodes_before = None
+        self.nodes_after = None
+        self.peak_memory = None
+        self.stats = None
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'start': self.start,
+            'wall_time': self.wall_time,
+            'nodes_before': self.nodes_before,
+            'nodes_after': self.nodes_after,
+            'peak_memory': self.peak_memory
+        }
+
+
+class PLProfiler:
+    '''Instrumentation of the compiler passes.
+
+       pylog_frontend and pylog_compile run every pass in a step of the
+       profiler given to them, which records its wall time, the number of
+       nodes in the tree before and after, and, with memory, the peak of
+       memory allocated during the pass (tracemalloc; when the caller
+       traces memory already, its peak is left alone, and the peak of a
+       pass that stays below it is None). With cprofile, each pass also
+       runs under cProfile; its pstats.Stats are kept in the record.
+       Counting nodes and tracing memory slow compilation down, but are not
+       included in the wall times.
+
+       profiler = PLProfiler()
+       pylog_compile(src, arg_info, 'vhls', 'pynq-z2', path,
+                     profiler=profiler)
+       print(profiler.report())
+       profiler.chrome_trace('trace.json')   # chrome://tracing, Perfetto
+    '''
+
+    def __init__(self, memory=True, cprofile=False):
+        self.memory = memory
+        self.cprofile = cprofile
+        self.records = []
+        self.origin = time.perf_counter()
+
+    @contextlib.contextmanager
+    def step(self, name, tree=None):
+        record = PLPassRecord(name, tree)
+        record.nodes_before = count_nodes(tree)
+
+        tracing = self.memory and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+        if self.memory:
+            # the peak of a caller that traces memory itself is kept
+            if tracing:
+                tracemalloc.reset_peak()
+            base_memory, base_peak = tracemalloc.get_traced_memory()
+        profile = cProfile.Profile() if self.cprofile else None
+
+        try:
+            if profile is not None:
+                profile.enable()
+            start = time.perf_counter()
+            yield record
+        finally:
+            end = time.perf_counter()
+            if profile is not None:
+                profile.disable()
+                record.stats = pstats.Stats(profile)
+            if self.memory:
+                peak = tracemalloc.get_traced_memory()[1]
+                # below an earlier peak of the caller, the peak of the pass
+                # is unknown
+                record.peak_memory = peak - base_memory \
+                                     if tracing or peak > base_peak else None
+            if tracing:
+                tracemalloc.stop()
+
+            record.start = start - self.origin
+            record.wall_time = end - start
+            record.nodes_after = count_nodes(record.output \
+                                             if record.output is not None \
+                                             else tree)
+            # do not keep the trees alive
+            record.input = record.output = None
+            self.records.append(record)
+
+    def results(self):
+        return [ r.as_dict() for r in self.records ]
+
+    def total_time(self):
+        return sum(r.wall_time for r in self.records)
+
+    def report(self):
+        lines = [f"{'pass':<24} {'time (ms)':>10} {'nodes in':>9} " + \
+                 f"{'nodes out':>9} {'peak mem (KB)':>14}"]
+        for r in self.records:
+            peak = f'{r.peak_memory / 1024:.1f}' \
+                   if r.peak_memory is not None else '-'
+            lines.append(f'{r.name:<24} {r.wall_time * 1e3:>10.2f} ' + \
+                         f'{str(r.nodes_before):>9} ' + \
+                         f'{str(r.nodes_after):>9} {peak:>14}')
+        lines.append(f"{'total':<24} {self.total_time() * 1e3:>10.2f}")
+        return '\n'.join(lines)
+
+    def chrome_trace(self, trace_file):
+        '''Write the passes as complete events of the Chrome trace event
+           format.'''
+        events = []
+        for r in self.records:
+            events.append({
+                'name': r.name,
+                'cat': 'pass',
+                'ph': 'X',
+                'pid': os.getpid(),
+                'tid': 0,
+                'ts': r.start * 1e6,
+                'dur': r.wall_time * 1e6,
+                'args': {
+                    'nodes_before': r.nodes_before,
+                    'nodes_after': r.nodes_after,
+                    'peak_memory': r.peak_memory
+                }
+            })
+        with open(trace_file, 'w') as fout:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'},
+                      fout, indent=1)
+
+    def dump_stats(self, prefix):
+        '''With cprofile, write each pass's profile to {prefix}_{pass}.prof
+           (for pstats, snakeviz, ...).'''
+        files = []
+        for i, r in enumerate(self.records):
+            if r.stats is not None:
+                stats_file = f'{prefix}_{i:02d}_{r.name}.prof'
+                r.stats.dump_stats(stats_file)
+                files.append(stats_file)
+        return files
+
+
+@contextlib.contextmanager
+def profile_step(profiler, name, tree=None):
+    '''profiler.step, or nothing if profiler is None.'''
+    if profiler is None:
+        yield PLPassRecord(name, None)
+    else:
+        with profiler.step(name, tree) as record:
+            yield record
@@ -8,27 +8,45 @@ import re
 import inspect
 import textwrap
 import functools
+import json
+import io
+import time
+import traceback
+import contextlib
 import subprocess
+import concurrent.futures
 import numpy as np
 
-from config import TARGET_BASE, WORKSPACE
+from config import TARGET_BASE, WORKSPACE, DSE_HLS_JOBS
 from nodes import plnode_link_parent
 from analyzer import PLAnalyzer, PLTester, ast_link_parent
 from typer import PLTyper
 from optimizer import PLOptimizer
 from codegen import PLCodeGenerator
 from sysgen import PLSysGen
-from runtime import PLRuntime
+from runtime import PLRuntime, PLSession
+from swemu import PLSwEmu
+from npsim import PLNpSim
+from estimator import PLEstimator
+from dse import PLDSE, dse_report
+from buffer_pool import pl_allocate, pl_free
 import IPinforms
 from chaining_rewriter import PLChainingRewriter
+from compile_cache import PYLOG_COMPILE_CACHE, PYLOG_IR_CACHE, cache_key, \
+                          ir_key
+from profiler import PLProfiler, profile_step
+from visitors import recursion_budget
 
 PYLOG_KERNELS = dict()
+# @pylog wrapper of each kernel in PYLOG_KERNELS
+PYLOG_WRAPPERS = dict()
 
 def pylog(func=None, *, mode='cgen', path=WORKSPACE, backend='vhls', \
-          board='pynq-z2', freq=None):
+          board='pynq-z2', freq=None, cache=True, design=None):
     if func is None:
         return functools.partial(pylog, mode=mode, path=path, \
-                                 backend=backend, board=board, freq=freq)
+                                 backend=backend, board=board, freq=freq, \
+                                 cache=cache, design=design)
 
     hwgen = 'hwgen' in mode # hwgen = cgen, hls, syn
 
@@ -36,12 +54,20 @@ def pylog(func=None, *, mode='cgen', path=WORKSPACE, backend='vhls', \
     gen_hlsc = hwgen or ('cgen' in mode) or ('codegen' in mode) # HLS C gen
     run_hls  = hwgen or ('hls' in mode) # run HLS
     run_syn  = hwgen or ('syn' in mode) # run FPGA synthesis
+    rebuild  = 'rebuild' in mode # rerun HLS/synthesis even if up to date
 
     pysim_only = 'pysim' in mode
-    deploy = ('deploy' in mode) or ('run' in mode) or ('acc' in mode)
+    swemu = 'swemu' in mode # software emulation, compiled with g++
+    npsim = 'npsim' in mode # simulation of the PyLog IR with NumPy
+    estimate = 'estimate' in mode # latency and resource estimation only
+    explore = 'dse' in mode # design-space exploration
+    async_call = 'async' in mode
+    deploy = ('deploy' in mode) or ('run' in mode) or ('acc' in mode) or \
+             async_call
     debug = 'debug' in mode
     timing = 'timing' in mode
     viz = 'viz' in mode
+    profile = 'profile' in mode # time the compiler passes
 
     if freq is None:
         if (board == 'aws_f1' or board.startswith('alveo')):
@@ -52,46 +78,88 @@ def pylog(func=None, *, mode='cgen', path=WORKSPACE, backend='vhls', \
     if pysim_only:
         return func
 
-    PYLOG_KERNELS[func.__name__] = func
-
-    @functools.wraps(func)
-    def wrapper(*args, **kwargs):
+    if isinstance(design, str):
+        # a design recorded by mode='dse'
+        with open(design) as fin:
+            design = json.load(fin)
+        design = design.get('design', design)
 
-        # builtins = open('builtin.py').read()
-        source_func = textwrap.dedent(inspect.getsource(func))
-        if debug: print(source_func)
-        arg_names = inspect.getfullargspec(func).args
+    if 'autoopt' in mode:
+        # pipeline and unroll loops automatically, see PLOptimizer
+        design = dict(design or {}, auto=True)
 
-        for arg in args:
-            assert (isinstance(arg, (np.ndarray, np.generic)))
+    if swemu:
+        # the generated code is compiled for the host instead of the FPGA
+        backend = 'swemu'
+        gen_hlsc = True
 
-        arg_info = {}
+    # debug, viz and profile want to see every pass, so never serve them
+    # from cache
+    use_cache = cache and not (debug or viz or profile)
 
-        for i in range(len(args)):
-            if args[i].dtype.fields is not None:
-                key_fields = ''.join(args[i].dtype.fields.keys())
-                m1 = re.search('total([0-9]*)bits', key_fields)
-                m2 = re.search('dec([0-9]*)bits', key_fields)
-                type_name = f'ap_fixed<{m1.group(1)}, {m2.group(1)}>'
-            else:
-                type_name = args[i].dtype.name
-
-            arg_info[arg_names[i]] = (type_name, args[i].shape)
+    PYLOG_KERNELS[func.__name__] = func
 
-        # arg_info = { arg_names[i]:(args[i].dtype.name, args[i].shape) \
-        #                                           for i in range(len(args)) }
+    # kernel source and argument names do not change between calls
+    kernel_info = {}
 
-        # num_array_inputs = sum(len(val[1]) != 1 for val in arg_info.values())
+    def get_arg_info(args):
+        '''Kernel source and the types and shapes of its arguments.'''
 
-        project_path, top_func, max_idx, return_void = pylog_compile(
-            src=source_func,
-            arg_info=arg_info,
-            backend=backend,
-            board=board,
-            path=path,
-            gen_hlsc=gen_hlsc,
-            debug=debug,
-            viz=viz)
+        # builtins = open('builtin.py').read()
+        if not kernel_info:
+            kernel_info['source'] = textwrap.dedent(inspect.getsource(func))
+            kernel_info['arg_names'] = inspect.getfullargspec(func).args
+        source_func = kernel_info['source']
+        if debug: print(source_func)
+        arg_names = kernel_info['arg_names']
+
+        arg_info = pylog_arg_info(args, arg_names)
+
+        return source_func, arg_info
+
+    def prepare(args):
+        '''Compile (or fetch from cache) and build the kernel for args.'''
+
+        source_func, arg_info = get_arg_info(args)
+
+        key = cache_key(source_func, arg_info, backend, board, freq, path,
+                        design)
+        entry = PYLOG_COMPILE_CACHE.lookup(key, path, restore=gen_hlsc) \
+                    if use_cache else None
+
+        if entry is None:
+            profiler = PLProfiler(cprofile='cprofile' in mode) \
+                       if profile else None
+            entry = compile_entry(key, src=source_func, arg_info=arg_info,
+                                  backend=backend, board=board, freq=freq,
+                                  path=path,
+                                  gen_hlsc=gen_hlsc, debug=debug, viz=viz,
+                                  design=design, profiler=profiler,
+                                  ir_cache=PYLOG_IR_CACHE if use_cache \
+                                                          else None)
+
+            if profile:
+                prefix = f"{entry['project_path']}/{entry['top_func']}"
+                print(profiler.report())
+                trace_file = f'{prefix}_compile_trace.json'
+                profiler.chrome_trace(trace_file)
+                print(f"Compiler pass trace written to {trace_file}")
+                profiler.dump_stats(f'{prefix}_compile')
+                wrapper.profiles.append(profiler)
+
+            if use_cache:
+                # IP core sources are generated next to the top function
+                # and are not part of the entry, so keep those in memory only
+                has_ip = 'configured_IPcores.h' in entry['hls_c']
+                PYLOG_COMPILE_CACHE.insert(key, path, entry,
+                                           persist=not has_ip,
+                                           written=gen_hlsc)
+
+        project_path = entry['project_path']
+        top_func     = entry['top_func']
+        max_idx      = entry['max_idx']
+        return_type  = entry['return_type']
+        return_void  = entry['return_void']
 
         config = {
             'workspace_base': WORKSPACE,
@@ -102,77 +170,349 @@ def pylog(func=None, *, mode='cgen', path=WORKSPACE, backend='vhls', \
             'num_bundles': max_idx,
             'timing': timing,
             'board': board,
-            'return_void': return_void
+            'return_type': return_type,
+            'return_void': return_void,
+            'cache_key': key
         }
 
         if run_hls or run_syn or hwgen:
             print("generating hardware ...")
 
             plsysgen = PLSysGen(backend=backend, board=board)
-            plsysgen.generate_system(config, run_hls, run_syn)
+            plsysgen.generate_system(config, run_hls, run_syn,
+                                     force=rebuild)
 
-        if deploy:
-            subprocess.call(f"mkdir -p {TARGET_BASE}/{top_func}/", \
-                                      shell=True)
+        return config
+
+    def runtime(config):
+        top_func = config['top_name']
+        subprocess.call(f"mkdir -p {TARGET_BASE}/{top_func}/", \
+                                  shell=True)
 
-            if board == 'aws_f1' or board.startswith('alveo'):
+        if board == 'aws_f1' or board.startswith('alveo'):
 
-                ext = 'awsxclbin' if (board == 'aws_f1') else 'xclbin'
+            ext = 'awsxclbin' if (board == 'aws_f1') else 'xclbin'
+
+            xclbin = f'{top_func}/{top_func}_{board}.{ext}'
+
+            # if not os.path.exists(f'{TARGET_BASE}/{xclbin}'):
+            #     subprocess.call(
+            #         f"scp -r {HOST_ADDR}:{HOST_BASE}/{xclbin} " + \
+            #         f"{TARGET_BASE}/{top_func}/", shell=True)
+
+        else:
 
-                xclbin = f'{top_func}/{top_func}_{board}.{ext}'
+            bit_file = f'{top_func}/{top_func}_{board}.bit'
+            hwh_file = f'{top_func}/{top_func}_{board}.hwh'
+
+            # if not os.path.exists(f'{TARGET_BASE}/{bit_file}'):
+            #     subprocess.call(
+            #         f"scp -r {HOST_ADDR}:{HOST_BASE}/{bit_file} " + \
+            #         f"{TARGET_BASE}/{top_func}/", shell=True)
+
+            # if not os.path.exists(f'{TARGET_BASE}/{hwh_file}'):
+            #     subprocess.call(
+            #         f"scp -r {HOST_ADDR}:{HOST_BASE}/{hwh_file} " + \
+            #         f"{TARGET_BASE}/{top_func}/", shell=True)
+
+        return PLRuntime(config)
+
+    def simulate(args):
+        '''Run the typed PyLog IR on NumPy arrays, without generating code.'''
+        source_func, arg_info = get_arg_info(args)
+        key = cache_key(source_func, arg_info, 'npsim', board, freq, path)
+        if key not in kernel_info:
+            kernel_info[key] = pylog_frontend(source_func, arg_info,
+                                              debug=debug)[1]
+        return PLNpSim(kernel_info[key], debug=debug).call(args)
+
+    def estimate_kernel(args):
+        '''Estimate latency and resources without running HLS.'''
+        source_func, arg_info = get_arg_info(args)
+        key = cache_key(source_func, arg_info, 'estimate', board, freq, path,
+                        design)
+        if key not in kernel_info:
+            kernel_info[key] = pylog_estimate(source_func, arg_info, backend,
+                                              board, freq, debug=debug,
+                                              design=design)
+        return kernel_info[key]
+
+    def explore_kernel(args):
+        '''Search pragmas and schedules, see PLDSE.'''
+        source_func, arg_info = get_arg_info(args)
+        hls_jobs = DSE_HLS_JOBS if 'hls' in mode else 0
+        return pylog_dse(source_func, arg_info, backend, board, freq, path,
+                         hls_jobs=hls_jobs, debug=debug)
 
-                # if not os.path.exists(f'{TARGET_BASE}/{xclbin}'):
-                #     subprocess.call(
-                #         f"scp -r {HOST_ADDR}:{HOST_BASE}/{xclbin} " + \
-                #         f"{TARGET_BASE}/{top_func}/", shell=True)
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if npsim:
+            return simulate(args)
 
-            else:
+        if estimate:
+            return estimate_kernel(args)
 
-                bit_file = f'{top_func}/{top_func}_{board}.bit'
-                hwh_file = f'{top_func}/{top_func}_{board}.hwh'
+        if explore:
+            return explore_kernel(args)
 
-                # if not os.path.exists(f'{TARGET_BASE}/{bit_file}'):
-                #     subprocess.call(
-                #         f"scp -r {HOST_ADDR}:{HOST_BASE}/{bit_file} " + \
-                #         f"{TARGET_BASE}/{top_func}/", shell=True)
+        config = prepare(args)
 
-                # if not os.path.exists(f'{TARGET_BASE}/{hwh_file}'):
-                #     subprocess.call(
-                #         f"scp -r {HOST_ADDR}:{HOST_BASE}/{hwh_file} " + \
-                #         f"{TARGET_BASE}/{top_func}/", shell=True)
+        if swemu:
+            return PLSwEmu(config).call(args)
 
-            plrt = PLRuntime(config)
+        if deploy:
+            plrt = runtime(config)
+            if async_call:
+                return plrt.call_async(args)
             return plrt.call(args)
 
+    def stream(*args, tile, stream_args=None, combine=None, outputs=None,
+               pad=None):
+        '''Call the kernel on arrays longer than one invocation.
+
+           The arguments in stream_args (by default, the arrays with the
+           longest leading dimension) are cut along axis 0 into tiles of
+           length tile, and the kernel is compiled for the tile shape. See
+           PLRuntime.call_stream for combine, outputs and pad.
+        '''
+        if stream_args is None:
+            length = max(arg.shape[0] for arg in args if arg.shape != ())
+            stream_args = [ i for i in range(len(args)) \
+                            if args[i].shape != () and \
+                               args[i].shape[0] == length ]
+
+        # only the types and shapes matter for compiling: a tile of each
+        # streamed array, whatever its length
+        tile_args = [ np.empty((tile,) + args[i].shape[1:],
+                               dtype=args[i].dtype) \
+                      if i in stream_args else args[i] \
+                      for i in range(len(args)) ]
+        config = prepare(tile_args)
+
+        if deploy:
+            plrt = runtime(config)
+            return plrt.call_stream(list(args), stream_args, tile,
+                                    combine=combine, outputs=outputs,
+                                    pad=pad)
+
+    def call_batch(arg_list, outputs=None):
+        '''Call the kernel on each argument tuple in arg_list. All tuples
+           must have the same types and shapes. Returns (results, timing),
+           see PLRuntime.call_batch.'''
+        for args in arg_list:
+            assert (len(args) == len(arg_list[0]) and \
+                    all(a.shape == b.shape and a.dtype == b.dtype \
+                        for a, b in zip(args, arg_list[0]))), \
+                'all calls of a batch must have the same argument types ' + \
+                'and shapes'
+        config = prepare(arg_list[0])
+
+        if deploy:
+            plrt = runtime(config)
+            return plrt.call_batch(arg_list, outputs=outputs)
+
+    def compile_job(args):
+        '''The compilation of the kernel for args, for precompile.'''
+        source_func, arg_info = get_arg_info(args)
+        skip = None
+        if npsim or estimate or explore:
+            skip = f"mode '{mode}' does not compile the kernel"
+        elif not use_cache:
+            skip = 'the compile cache is disabled'
+        return {
+            'kernel':   func.__name__,
+            'key':      cache_key(source_func, arg_info, backend, board,
+                                  freq, path, design),
+            'src':      source_func,
+            'arg_info': arg_info,
+            'backend':  backend,
+            'board':    board,
+            'freq':     freq,
+            'path':     path,
+            'gen_hlsc': gen_hlsc,
+            'design':   design,
+            'skip':     skip
+        }
+
+    wrapper.stream = stream
+    wrapper.call_batch = call_batch
+    wrapper.compile_job = compile_job
+    # PLProfiler of each compilation in profile mode
+    wrapper.profiles = []
+
+    PYLOG_WRAPPERS[func.__name__] = wrapper
     return wrapper
 
 
-def pylog_compile(src, arg_info, backend, board, path,
-                  gen_hlsc=True, debug=False, viz=False):
-    print("Compiling PyLog code ...")
-    ast_py = ast.parse(src)
+def compile_entry(key, src, arg_info, backend, board, path, gen_hlsc=True,
+                  debug=False, viz=False, design=None, profiler=None,
+                  ir_cache=None, freq=100.0):
+    '''pylog_compile, returning the result as the entry of key in
+       PYLOG_COMPILE_CACHE.'''
+    project_path, top_func, max_idx, return_type, return_void, hls_c = \
+        pylog_compile(src=src, arg_info=arg_info, backend=backend,
+                      board=board, path=path, gen_hlsc=gen_hlsc, debug=debug,
+                      viz=viz, design=design, profiler=profiler,
+                      ir_cache=ir_cache, freq=freq)
+    return {
+        'key':          key,
+        'project_path': project_path,
+        'top_func':     top_func,
+        'max_idx':      max_idx,
+        'return_type':  return_type,
+        'return_void':  return_void,
+        'hls_c':        hls_c
+    }
+
+
+def precompile_job(job):
+    '''Compile one kernel variant for precompile, in a worker process.
+       Returns its diagnostics.'''
+    result = {
+        'kernel':   job['kernel'],
+        'arg_info': job['arg_info'],
+        'key':      job['key'],
+        'status':   'skipped',
+        'error':    job['skip'],
+        'entry':    None,
+        'elapsed':  0.0,
+        'log':      ''
+    }
+    if job['skip'] is not None:
+        return result
+
+    start = time.time()
+    log = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(log):
+            entry = PYLOG_COMPILE_CACHE.lookup(job['key'], job['path'],
+                                               restore=False)
+            result['status'] = 'cached'
+            if entry is None:
+                entry = compile_entry(job['key'], src=job['src'],
+                                      arg_info=job['arg_info'],
+                                      backend=job['backend'],
+                                      board=job['board'], path=job['path'],
+                                      freq=job['freq'],
+                                      gen_hlsc=job['gen_hlsc'],
+                                      design=job['design'],
+                                      ir_cache=PYLOG_IR_CACHE)
+                has_ip = 'configured_IPcores.h' in entry['hls_c']
+                PYLOG_COMPILE_CACHE.insert(job['key'], job['path'], entry,
+                                           persist=not has_ip,
+                                           written=job['gen_hlsc'])
+                result['status'] = 'compiled'
+        result['entry'] = entry
+        result['error'] = None
+    except (Exception, SystemExit) as e:
+        # also SystemExit from the exit() calls of the passes
+        result['status'] = 'failed'
+        result['error'] = f'{type(e).__name__}: {e}'
+        log.write(traceback.format_exc())
+    result['elapsed'] = time.time() - start
+    result['log'] = log.getvalue()
+    return result
+
+
+def precompile(kernels, arg_specs, workers=None):
+    '''Compile kernels ahead of their first call, in up to workers
+       processes.
+
+       kernels are @pylog functions or names of kernels in PYLOG_KERNELS,
+       arg_specs[i] the arguments to compile kernels[i] for: a tuple of
+       arguments, or a list of such tuples for several shape variants. An
+       argument is an array, or a (shape, dtype) pair. The results go to
+       the compile cache of each kernel, so that calls with arguments of
+       the same types and shapes do not compile again; HLS and synthesis
+       are not run. Returns a dict per variant with the kernel name,
+       arg_info, status ('compiled', 'cached', 'skipped' or 'failed'),
+       error, elapsed time and the output of the compiler (log).
+    '''
+    jobs = []
+    for kernel, specs in zip(kernels, arg_specs):
+        wrapper = PYLOG_WRAPPERS[kernel] if isinstance(kernel, str) \
+                                         else kernel
+        assert hasattr(wrapper, 'compile_job'), \
+            f'{kernel} is not a @pylog kernel'
+        if isinstance(specs, tuple):
+            specs = [specs]
+        for spec in specs:
+            args = [ np.empty(arg[0], arg[1]) if isinstance(arg, tuple) \
+                     else arg for arg in spec ]
+            jobs.append(wrapper.compile_job(args))
+
+    workers = min(workers or os.cpu_count() or 1, max(len(jobs), 1))
+    if workers <= 1:
+        results = [ precompile_job(job) for job in jobs ]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+            results = list(pool.map(precompile_job, jobs))
+
+    for job, result in zip(jobs, results):
+        entry = result.pop('entry')
+        if entry is not None:
+            # which variant sits in the project directory depends on the
+            # order the workers finished in, see PLCompileCache.restore
+            PYLOG_COMPILE_CACHE.insert(job['key'], job['path'], entry,
+                                       persist=False, written=False)
+        print(f"{result['kernel']:<24} {result['status']:<9} " + \
+              f"{result['elapsed']:6.2f} s" + \
+              (f"  {result['error']}" if result['error'] else ''))
+    return results
+
+
+def pylog_arg_info(args, arg_names):
+    '''Type name and shape of each kernel argument, by argument name.'''
+    for arg in args:
+        assert (isinstance(arg, (np.ndarray, np.generic)))
+
+    arg_info = {}
+
+    for i in range(len(args)):
+        if args[i].dtype.fields is not None:
+            key_fields = ''.join(args[i].dtype.fields.keys())
+            m1 = re.search('total([0-9]*)bits', key_fields)
+            m2 = re.search('dec([0-9]*)bits', key_fields)
+            type_name = f'ap_fixed<{m1.group(1)}, {m2.group(1)}>'
+        else:
+            type_name = args[i].dtype.name
+
+        arg_info[arg_names[i]] = (type_name, args[i].shape)
+
+    # arg_info = { arg_names[i]:(args[i].dtype.name, args[i].shape) \
+    #                                           for i in range(len(args)) }
+
+    # num_array_inputs = sum(len(val[1]) != 1 for val in arg_info.values())
+
+    return arg_info
+
+
+def pylog_frontend(src, arg_info, debug=False, profiler=None):
+    '''Parse and type a PyLog kernel. Returns the top function name and
+       the typed PyLog IR. Passes are timed by profiler, see PLProfiler.'''
+    with profile_step(profiler, 'parse') as step:
+        ast_py = ast.parse(src)
+        step.output = ast_py
     if debug: astpretty.pprint(ast_py)
 
     # add an extra attribute pointing to parent for each node
-    ast_link_parent(ast_py)  # need to be called before analyzer
+    with profile_step(profiler, 'ast_link_parent', ast_py):
+        ast_link_parent(ast_py)  # need to be called before analyzer
 
     # instantiate passes
     tester = PLTester()
     analyzer = PLAnalyzer(debug=debug)
     typer = PLTyper(arg_info, debug=debug)
-    chaining_rewriter = PLChainingRewriter(debug=debug)
-    optimizer = PLOptimizer(backend=backend, debug=debug)
-    codegen = PLCodeGenerator(arg_info,
-                              backend=backend,
-                              board=board,
-                              debug=debug)
 
     # execute passes
     if debug:
         tester.visit(ast_py)
 
-    pylog_ir = analyzer.visit(ast_py)
-    plnode_link_parent(pylog_ir)
+    with profile_step(profiler, 'analyzer', ast_py) as step:
+        pylog_ir = analyzer.visit(ast_py)
+        step.output = pylog_ir
+    with profile_step(profiler, 'plnode_link_parent', pylog_ir):
+        plnode_link_parent(pylog_ir)
 
     if debug:
         print('\n')
@@ -180,7 +520,9 @@ def pylog_compile(src, arg_info, backend, board, path,
         print(pylog_ir)
         print('\n')
 
-    typer.visit(pylog_ir)
+    with profile_step(profiler, 'typer', pylog_ir), \
+         recursion_budget(pylog_ir):
+        typer.visit(pylog_ir)
 
     if debug:
         print('\n')
@@ -188,13 +530,106 @@ def pylog_compile(src, arg_info, backend, board, path,
         print(pylog_ir)
         print('\n')
 
-    # transform loop transformation and insert pragmas
+    return analyzer.top_func, pylog_ir
+
+
+def pylog_estimate(src, arg_info, backend, board, freq, debug=False,
+                   design=None):
+    '''Estimate latency and resources of a PyLog kernel, see PLEstimator.'''
+    print("Estimating PyLog code ...")
+    top_func, pylog_ir = pylog_frontend(src, arg_info, debug=debug)
+
+    optimizer = PLOptimizer(backend=backend, debug=debug, design=design,
+                            freq=freq)
     optimizer.opt(pylog_ir)
 
-    # need to be called since optimizer may insert new nodes when visiting
-    # PLDot or PLMap
-    plnode_link_parent(pylog_ir)
-    chaining_rewriter.visit(pylog_ir)
+    estimator = PLEstimator(board=board, freq=freq, debug=debug)
+    estimate = estimator.estimate(pylog_ir)
+    print(estimator.report(estimate))
+
+    return estimate
+
+
+def pylog_dse(src, arg_info, backend, board, freq, path, hls_jobs=0,
+              debug=False):
+    '''Explore designs of a PyLog kernel. The Pareto front and the chosen
+       (lowest latency) design are written to {path}/{top}/{top}_design.json,
+       which @pylog(design=...) accepts.'''
+    print("Exploring PyLog design space ...")
+    top_func, pylog_ir = pylog_frontend(src, arg_info, debug=debug)
+
+    dse = PLDSE(pylog_ir, arg_info, backend=backend, board=board, freq=freq,
+                src=src, debug=debug)
+    front = dse.explore(path=path, top_func=top_func, hls_jobs=hls_jobs)
+    print(dse_report(front))
+
+    result = {
+        'design': front[0]['design'] if front else None,
+        'pareto': front
+    }
+
+    project_path = f'{path}/{top_func}'
+    if not os.path.exists(project_path):
+        os.makedirs(project_path)
+    output_file = f'{project_path}/{top_func}_design.json'
+    with open(output_file, 'w') as fout:
+        json.dump(result, fout, indent=2)
+        print(f"Design written to {output_file}")
+
+    return result
+
+
+def pylog_typed_ir(src, arg_info, debug=False, profiler=None, ir_cache=None):
+    '''pylog_frontend, served from ir_cache (a PLIRCache) if given.
+       Returns the top function name and the typed PyLog IR.'''
+    key = ir_key(src, arg_info, 'typed')
+    cached = ir_cache.lookup(key, WORKSPACE) if ir_cache is not None \
+                                             else None
+    if cached is not None:
+        top_func, pylog_ir = cached
+    else:
+        top_func, pylog_ir = pylog_frontend(src, arg_info, debug=debug,
+                                            profiler=profiler)
+        if ir_cache is not None:
+            ir_cache.insert(key, WORKSPACE, top_func, pylog_ir)
+    return top_func, pylog_ir
+
+
+def pylog_compile(src, arg_info, backend, board, path,
+                  gen_hlsc=True, debug=False, viz=False, design=None,
+                  profiler=None, ir_cache=None, freq=100.0):
+    '''Compile a PyLog kernel to HLS C for a clock of freq MHz. With
+       ir_cache (a PLIRCache), the IR after the front end and after the
+       optimizer and chaining rewriter is cached, so that compiling the same
+       kernel for another board or backend reruns only the passes that
+       depend on them.'''
+    print("Compiling PyLog code ...")
+    opt_key = ir_key(src, arg_info, 'optimized', backend, design, freq)
+    cached = ir_cache.lookup(opt_key, WORKSPACE) if ir_cache is not None \
+                                                 else None
+
+    if cached is not None:
+        top_func, pylog_ir = cached
+    else:
+        top_func, pylog_ir = pylog_typed_ir(src, arg_info, debug=debug,
+                                            profiler=profiler,
+                                            ir_cache=ir_cache)
+
+        chaining_rewriter = PLChainingRewriter(debug=debug)
+        optimizer = PLOptimizer(backend=backend, debug=debug, design=design,
+                                freq=freq)
+
+        # transform loop transformation and insert pragmas
+        with profile_step(profiler, 'optimizer', pylog_ir), \
+             recursion_budget(pylog_ir):
+            optimizer.opt(pylog_ir)
+
+        with profile_step(profiler, 'chaining_rewriter', pylog_ir), \
+             recursion_budget(pylog_ir):
+            chaining_rewriter.visit(pylog_ir)
+
+        if ir_cache is not None:
+            ir_cache.insert(opt_key, WORKSPACE, top_func, pylog_ir)
 
     if debug:
         print('\n')
@@ -202,21 +637,28 @@ def pylog_compile(src, arg_info, backend, board, path,
         print(pylog_ir)
         print('\n')
 
-    project_path = f'{path}/{analyzer.top_func}'
+    codegen = PLCodeGenerator(arg_info,
+                              backend=backend,
+                              board=board,
+                              debug=debug)
+
+    project_path = f'{path}/{top_func}'
 
     if not os.path.exists(project_path):
         os.makedirs(project_path)
     # else:
     #     print(f"Directory {project_path} exists! Overwriting... ")
 
-    hls_c = codegen.codegen(pylog_ir, project_path)
+    with profile_step(profiler, 'codegen', pylog_ir), \
+         recursion_budget(pylog_ir):
+        hls_c = codegen.codegen(pylog_ir, project_path)
 
     if debug:
         print("Generated C Code:")
         print(hls_c)
 
     if gen_hlsc:
-        output_file = f'{project_path}/{analyzer.top_func}.cpp'
+        output_file = f'{project_path}/{top_func}.cpp'
         with open(output_file, 'w') as fout:
             fout.write(hls_c)
             print(f"HLS C code written to {output_file}")
@@ -225,8 +667,33 @@ def pylog_compile(src, arg_info, backend, board, path,
         import pylogviz
         pylogviz.show(src, pylog_ir)
 
-    return project_path, analyzer.top_func, \
-           codegen.max_idx, codegen.return_void
+    return project_path, top_func, \
+           codegen.max_idx, codegen.return_type, codegen.return_void, hls_c
+
+
+def compile_target(kwargs):
+    '''pylog_compile in a worker process of pylog_compile_targets.'''
+    return pylog_compile(ir_cache=PYLOG_IR_CACHE, **kwargs)
+
+
+def pylog_compile_targets(src, arg_info, targets, path=WORKSPACE,
+                          workers=None, design=None, freq=100.0):
+    '''Compile a PyLog kernel for several (backend, board) targets. The
+       front end runs once, and the back ends run in parallel in up to
+       workers processes, restarting from the typed IR in PYLOG_IR_CACHE.
+       The project of each target goes to {path}/{backend}_{board}.
+       Returns the results of pylog_compile, in the order of targets.'''
+    pylog_typed_ir(src, arg_info, ir_cache=PYLOG_IR_CACHE)
+
+    jobs = [ {'src': src, 'arg_info': arg_info, 'backend': backend,
+              'board': board, 'path': f'{path}/{backend}_{board}',
+              'design': design, 'freq': freq} \
+             for backend, board in targets ]
+    workers = min(workers or os.cpu_count() or 1, len(jobs))
+    if workers <= 1:
+        return [ compile_target(job) for job in jobs ]
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        return list(pool.map(compile_target, jobs))
 
 
 if __name__ == "__main__":
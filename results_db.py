@@ -0,0 +1,201 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+import subprocess
+
+from config import PYLOG_ROOT_DIR, RESULTS_DB
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    cache_key   TEXT,
+    top         TEXT,
+    board       TEXT,
+    freq        REAL,
+    commit_id   TEXT,
+    created     REAL,
+    latency     INTEGER,
+    interval    INTEGER,
+    slack       REAL,
+    bram        INTEGER,
+    dsp         INTEGER,
+    ff          INTEGER,
+    lut         INTEGER,
+    uram        INTEGER,
+    record      TEXT
+);
+CREATE TABLE IF NOT EXISTS loops (
+    run_id            INTEGER REFERENCES runs(id) ON DELETE CASCADE,
+    path              TEXT,
+    trip_count        INTEGER,
+    latency           INTEGER,
+    iteration_latency INTEGER,
+    ii                INTEGER,
+    pipelined         INTEGER
+);
+CREATE INDEX IF NOT EXISTS runs_key ON runs(cache_key);
+CREATE INDEX IF NOT EXISTS runs_top ON runs(top, board, freq);
+'''
+
+# git commit of the PyLog tree, looked up once per process
+commit_ids = {}
+
+
+def pylog_commit():
+    '''Commit of the PyLog checkout, so that runs can be compared across
+       compiler changes; '' outside a git checkout.'''
+    if PYLOG_ROOT_DIR not in commit_ids:
+        try:
+            out = subprocess.run(['git', '-C', PYLOG_ROOT_DIR, 'rev-parse',
+                                  '--short', 'HEAD'],
+                                 stdout=subprocess.PIPE,
+                                 stderr=subprocess.DEVNULL,
+                                 universal_newlines=True, timeout=10)
+            commit_ids[PYLOG_ROOT_DIR] = out.stdout.strip() \
+                                         if out.returncode == 0 else ''
+        except (OSError, subprocess.TimeoutExpired):
+            commit_ids[PYLOG_ROOT_DIR] = ''
+    return commit_ids[PYLOG_ROOT_DIR]
+
+
+class PLResultsDB:
+    '''HLS results in a local SQLite database.
+
+       sysgen records every HLS run of a kernel compiled through @pylog
+       (see utils.parse_hls_report for the record), keyed by the compile
+       cache key of the kernel, together with the board, clock frequency
+       and the commit of the PyLog tree. Rows returned by the queries are
+       dicts with the columns of the runs table and the full record.
+
+       db = PLResultsDB()
+       db.history('matmul', board='pynq-z2')
+       db.regressions()
+    '''
+
+    def __init__(self, db_file=None):
+        self.db_file = db_file or RESULTS_DB
+        db_dir = os.path.dirname(self.db_file)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir, exist_ok=True)
+        self.lock = threading.Lock()
+        with self.connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def connect(self):
+        conn = sqlite3.connect(self.db_file, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def record(self, cache_key, record, board=None, freq=None,
+               commit_id=None):
+        '''Store an HLS record; returns the id of the run.'''
+        resources = record['resources']
+        row = (cache_key, record['top'], board, freq,
+               pylog_commit() if commit_id is None else commit_id,
+               time.time(), record['latency'], record['interval'],
+               record['timing']['slack'], resources['BRAM'],
+               resources['DSP'], resources['FF'], resources['LUT'],
+               resources['URAM'], json.dumps(record))
+
+        with self.lock, self.connect() as conn:
+            cursor = conn.execute(
+                'INSERT INTO runs (cache_key, top, board, freq, commit_id, ' +
+                'created, latency, interval, slack, bram, dsp, ff, lut, ' +
+                'uram, record) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)', row)
+            run_id = cursor.lastrowid
+            conn.executemany(
+                'INSERT INTO loops VALUES (?,?,?,?,?,?,?)',
+                [ (run_id, l['path'], l['trip_count'], l['latency'],
+                   l['iteration_latency'], l['ii'], int(l['pipelined'])) \
+                  for l in record['loops'] ])
+        return run_id
+
+    def run(self, row):
+        run = dict(row)
+        run['record'] = json.loads(run['record'])
+        return run
+
+    def query(self, cache_key=None, top=None, board=None, freq=None,
+              commit_id=None, since=None, limit=None):
+        '''Runs matching all given fields (since: earliest creation time),
+           newest first.'''
+        conditions = []
+        params = []
+        for column, value in (('cache_key', cache_key), ('top', top),
+                              ('board', board), ('freq', freq),
+                              ('commit_id', commit_id)):
+            if value is not None:
+                conditions.append(f'{column} = ?')
+                params.append(value)
+        if since is not None:
+            conditions.append('created >= ?')
+            params.append(since)
+
+        sql = 'SELECT * FROM runs'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY created DESC, id DESC'
+        if limit is not None:
+            sql += f' LIMIT {int(limit)}'
+
+        with self.connect() as conn:
+            return [ self.run(row) for row in conn.execute(sql, params) ]
+
+    def latest(self, cache_key):
+        '''The most recent run of a compilation, or None.'''
+        runs = self.query(cache_key=cache_key, limit=1)
+        return runs[0] if runs else None
+
+    def loops(self, run_id):
+        with self.connect() as conn:
+            return [ dict(row) for row in conn.execute(
+                'SELECT path, trip_count, latency, iteration_latency, ii, ' +
+                'pipelined FROM loops WHERE run_id = ? ORDER BY rowid',
+                (run_id,)) ]
+
+    def history(self, top, board=None, freq=None):
+        '''Runs of kernel top, oldest first.'''
+        return self.query(top=top, board=board, freq=freq)[::-1]
+
+    def regressions(self, threshold=0.05, metrics=('latency', 'lut', 'dsp',
+                                                   'bram', 'ff')):
+        '''Kernels whose latest run is worse than the run before it by more
+           than threshold (relative) in any of metrics, or whose slack
+           became negative. Returns (previous, latest, [metric, ...])
+           tuples.'''
+        with self.connect() as conn:
+            targets = conn.execute('SELECT DISTINCT top, board, freq ' +
+                                   'FROM runs').fetchall()
+
+        regressions = []
+        for top, board, freq in targets:
+            runs = self.query(top=top, board=board, freq=freq, limit=2)
+            if len(runs) < 2:
+                continue
+            latest, previous = runs
+            worse = [ m for m in metrics \
+                      if None not in (latest[m], previous[m]) and \
+                         latest[m] > previous[m] * (1 + threshold) ]
+            if latest['slack'] is not None and latest['slack'] < 0 and \
+               (previous['slack'] is None or previous['slack'] >= 0):
+                worse.append('slack')
+            if worse:
+                regressions.append((previous, latest, worse))
+        return regressions
+
+
+def results_report(runs):
+    lines = [f"{'created':<20} {'commit':<9} {'top':<16} {'board':<12} " + \
+             f"{'latency':>10} {'II':>8} {'slack':>7} {'DSP':>6} " + \
+             f"{'BRAM':>6} {'LUT':>8}"]
+    for r in runs:
+        created = time.strftime('%Y-%m-%d %H:%M:%S',
+                                time.localtime(r['created']))
+        lines.append(f"{created:<20} {r['commit_id'] or '-':<9} " + \
+                     f"{r['top'] or '-':<16} {r['board'] or '-':<12} " + \
+                     f"{str(r['latency']):>10} {str(r['interval']):>8} " + \
+                     f"{str(r['slack']):>7} {str(r['dsp']):>6} " + \
+                     f"{str(r['bram']):>6} {str(r['lut']):>8}")
+    return '\n'.join(lines)
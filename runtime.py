@@ -6,6 +6,15 @@ import numpy as np
 import hashlib
 import inspect
 
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import using_xrt
+from buffer_pool import PLBufferPool
+
+# polling intervals (s) for the control register in asynchronous calls
+POLL_MIN_DELAY = 1e-5
+POLL_MAX_DELAY = 1e-3
+
 # DESIGN_LIB = "/home/ubuntu/vivado_projects/pylog_projects/"
 
 # class LogicInstance:
@@ -35,6 +44,107 @@ import inspect
 
 #     return wrap_func
 
+class PLSession:
+    '''A programmed accelerator, kept alive across kernel calls.
+
+       Sessions are keyed by workspace, project and board. The bitstream is
+       loaded once when the session is opened and the accelerator handle is
+       reused by every PLRuntime of the same kernel until close() is called.
+       If several sessions share one device, the bitstream is downloaded
+       again only when switching to another session.
+    '''
+
+    sessions = {}
+    active = None  # session whose bitstream is currently on the device
+
+    @classmethod
+    def get(cls, config):
+        key = (config['workspace_base'], config['project_name'],
+               config['board'])
+        session = cls.sessions.get(key)
+        if session is None:
+            session = cls(config)
+            cls.sessions[key] = session
+        return session
+
+    @classmethod
+    def close_all(cls):
+        for session in list(cls.sessions.values()):
+            session.close()
+
+    def __init__(self, config):
+        self.board = config['board']
+        self.workspace_base = config['workspace_base']
+        self.project_name = config['project_name']
+        self.key = (self.workspace_base, self.project_name, self.board)
+        self.xrt = using_xrt(self.board)
+        self.xlnk = None
+        self.executor = None
+        # last value written to each control register
+        self.regs = {}
+        self.open()
+
+    def open(self):
+        from pynq import Overlay
+
+        base = f'{self.workspace_base}/{self.project_name}/' + \
+               f'{self.project_name}_{self.board}'
+
+        if self.xrt:
+            ext = 'awsxclbin' if (self.board == 'aws_f1') else 'xclbin'
+            self.overlay = Overlay(f'{base}.{ext}')
+            self.accelerator = getattr(self.overlay, f'{self.project_name}_1')
+        else:
+            from pynq import Xlnk
+            self.xlnk = Xlnk()
+            if PLSession.active is None and \
+               PLBufferPool.total_allocated() == 0:
+                # first bitstream in this process: start from a clean CMA
+                self.xlnk.xlnk_reset()
+            self.overlay = Overlay(f'{base}.bit')
+            self.accelerator = getattr(self.overlay, f'{self.project_name}_0')
+
+        self.regs = {}
+        PLSession.active = self
+
+    def ensure_loaded(self):
+        if PLSession.active is not self:
+            self.overlay.download()
+            # reprogramming resets the control registers
+            self.regs = {}
+            PLSession.active = self
+
+    def write_regs(self, regs):
+        '''Write (address, value) pairs to the control registers, skipping
+           the registers that already hold the value.'''
+        for addr, value in regs:
+            if addr in self.regs and np.array_equal(self.regs[addr], value):
+                continue
+            self.accelerator.write(addr, value)
+            self.regs[addr] = np.copy(value)
+
+    def submit(self, fn, *args):
+        '''Run fn on the session worker thread, one call at a time. Every
+           kernel call goes through here, blocking ones included, so that
+           calls never touch the control registers concurrently.'''
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=1)
+        return self.executor.submit(fn, *args)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+        if self.xrt:
+            self.overlay.free()
+        if PLSession.active is self:
+            PLSession.active = None
+        PLSession.sessions.pop(self.key, None)
+        self.regs = {}
+        self.overlay = None
+        self.accelerator = None
+
+
 class PLRuntime:
     def __init__(self, config):
         self.board = config['board']
@@ -45,107 +155,301 @@ class PLRuntime:
         self.return_void = config['return_void']
         self.config = config
 
-    def call(self, args):
-        if self.board == 'aws_f1' or self.board.startswith('alveo'):
-            return self.call_xrt(args)
-        else:
-            return self.call_soc(args)
-
-    def call_soc(self, args):
-        from pynq import Xlnk
-        from pynq import Overlay
-        # from pynq import allocate  # requires PYNQ v2.5 or newer
+    def open_session(self):
+        self.session = PLSession.get(self.config)
+        self.session.ensure_loaded()
+        self.overlay = self.session.overlay
+        self.accelerator = self.session.accelerator
+        self.xlnk = self.session.xlnk
+        self.pool = PLBufferPool.get(self.board)
+
+    def close(self):
+        '''Release the accelerator. The next call loads the bitstream again.'''
+        session = PLSession.sessions.get((self.workspace_base,
+                                          self.project_name, self.board))
+        if session is not None:
+            session.close()
 
-        self.xlnk = Xlnk()
-        self.xlnk.xlnk_reset()
-
-        self.overlay = Overlay(f'{self.workspace_base}/{self.project_name}/'+\
-                               f'{self.project_name}_{self.board}.bit')
-        self.accelerator = getattr(self.overlay, f'{self.project_name}_0')
+    def call(self, args):
+        self.open_session()
+        # wait for the calls queued by call_async, so that the register
+        # writes of the calls do not interleave
+        return self.session.submit(self.run_call, args).result()
 
-        self.plrt_arrays = []
-        curr_addr = 0x10 if self.return_void else 0x18
-        for i in range(len(args)):
-            if args[i].shape == ():
-                self.accelerator.write(curr_addr, args[i])
-            else:
-                # "allocate" requires PYNQ v2.5 or newer
-                # new_array = allocate(shape=arg.shape, dtype=arg.dtype)
-                new_array = self.xlnk.cma_array(args[i].shape, args[i].dtype)
-                np.copyto(new_array, args[i])
-                # new_array.sync_to_device() # requires PYNQ v2.5 or newer
-                new_array.flush()
-                self.accelerator.write(curr_addr, new_array.physical_address)
-                self.plrt_arrays.append((i, new_array))
-            curr_addr += 8
+    def run_call(self, args):
+        plrt_call = self.stage(args)
 
         print("FPGA starts. ")
 
-        start_time = time.time()
-
-        self.accelerator.write(0x00, 1)
-        isready = self.accelerator.read(0x00)
-        while( isready == 1 ):
-            isready = self.accelerator.read(0x00)
-
-        end_time = time.time()
-
-        fpga_time = end_time - start_time
+        self.start(plrt_call)
+        self.wait(plrt_call)
 
         print("FPGA finishes. ")
-        if self.timing:print(f'FPGA Execution Time: {fpga_time:.10f} s')
-
-        for i, array in self.plrt_arrays:
-            # "sync_from_device" only available starting PYNQ v2.5
-            # self.plrt_arrays[i].sync_from_device()
-            array.invalidate()
-            np.copyto(args[i], array)
-            array.close()
-
-        return self.accelerator.read(0x10)
-
-    def call_xrt(self, args):
-        from pynq import Overlay
-        from pynq import allocate  # requires PYNQ v2.5 or newer
-
-        ext = 'awsxclbin' if (self.board == 'aws_f1') else 'xclbin'
-
-        self.overlay = Overlay(f'{self.workspace_base}/{self.project_name}/'+\
-                               f'{self.project_name}_{self.board}.{ext}')
-        self.accelerator = getattr(self.overlay, f'{self.project_name}_1')
+        if self.timing:
+            print(f'FPGA Execution Time: {plrt_call.fpga_time:.10f} s')
+
+        return self.finish(plrt_call)
+
+    def call_async(self, args):
+        '''Invoke the kernel without blocking the calling thread.
+
+           Returns a concurrent.futures.Future holding the kernel return
+           value. Calls are queued on the session and run one at a time;
+           the arrays in args must not be modified before the future is
+           done, since results are copied back into them.
+        '''
+        self.open_session()
+        return self.session.submit(self.run_async, args)
+
+    def run_async(self, args):
+        plrt_call = self.stage(args)
+        self.start(plrt_call)
+        self.wait(plrt_call, backoff=True)
+        if self.timing:
+            print(f'FPGA Execution Time: {plrt_call.fpga_time:.10f} s')
+        return self.finish(plrt_call)
+
+    def call_batch(self, arg_list, outputs=None):
+        '''Invoke the kernel once per argument tuple in arg_list.
+
+           The arguments of every call are staged into device buffers
+           before the first call starts, and control registers that keep
+           the same value from one call to the next are not rewritten.
+           Returns (results, timing): the list of return values, and a dict
+           with the per-call FPGA times ('fpga'), their sum ('fpga_total')
+           and the wall time of the whole batch ('total').
+        '''
+        self.open_session()
+        return self.session.submit(self.run_batch, arg_list,
+                                   outputs).result()
+
+    def run_batch(self, arg_list, outputs):
+        batch_time = time.time()
+        calls = [ self.stage(list(args), outputs=outputs) \
+                  for args in arg_list ]
+
+        results = []
+        for plrt_call in calls:
+            self.start(plrt_call)
+            self.wait(plrt_call)
+            results.append(self.finish(plrt_call))
+
+        fpga_times = [ plrt_call.fpga_time for plrt_call in calls ]
+        timing = {
+            'fpga':       fpga_times,
+            'fpga_total': sum(fpga_times),
+            'total':      time.time() - batch_time
+        }
+
+        if self.timing:
+            print(f'FPGA Batch Time ({len(calls)} calls): ' + \
+                  f'{timing["total"]:.10f} s, ' + \
+                  f'FPGA Execution Time: {timing["fpga_total"]:.10f} s')
+
+        return results, timing
+
+    def call_stream(self, args, stream_args, tile, combine=None,
+                    outputs=None, pad=None):
+        '''Run a kernel compiled for tiles over arrays of any length.
+
+           args:        full-size arguments
+           stream_args: indices of the arguments split along axis 0 into
+                        tiles of length tile; the kernel must have been
+                        compiled for that tile shape
+           combine:     combine(acc, tile_outputs) -> acc, reducing the
+                        outputs of the other array arguments across tiles.
+                        Without it, those arguments keep the last tile's
+                        values.
+           outputs:     indices of arguments written by the kernel (all
+                        array arguments by default). Streamed outputs are
+                        stitched back into their slice of the full array.
+           pad:         fill value for a last, partial tile. Without it,
+                        the streamed length must be a multiple of tile.
+
+           Tiles are double-buffered: the copy into device memory of tile
+           N+1 overlaps the execution of tile N. Returns the list of
+           per-tile return values.
+        '''
+        self.open_session()
+        return self.session.submit(self.run_stream, args, stream_args, tile,
+                                   combine, outputs, pad).result()
+
+    def run_stream(self, args, stream_args, tile, combine, outputs, pad):
+        length = args[stream_args[0]].shape[0]
+        for i in stream_args:
+            assert (args[i].shape[0] == length), \
+                'streamed arguments must have the same length'
+        if pad is None:
+            assert (length % tile == 0), \
+                f'length {length} is not a multiple of tile {tile}; ' + \
+                f'pass pad= to pad the last tile'
+
+        if outputs is None:
+            outputs = [ i for i in range(len(args)) if args[i].shape != () ]
+        fixed_outputs = [ i for i in outputs if i not in stream_args ]
+
+        def tile_args(start):
+            tile_len = min(tile, length - start)
+            targs = []
+            for i in range(len(args)):
+                if i in stream_args:
+                    part = args[i][start:start+tile_len]
+                    if tile_len < tile:
+                        padded = np.full((tile,) + args[i].shape[1:], pad,
+                                         dtype=args[i].dtype)
+                        padded[:tile_len] = part
+                        part = padded
+                    targs.append(part)
+                elif i in fixed_outputs:
+                    # every tile starts from the caller's initial value
+                    targs.append(np.array(args[i]))
+                else:
+                    targs.append(args[i])
+            return targs, tile_len
+
+        acc = None
+        results = []
+        pending = None
+
+        def collect(plrt_call, start, tile_len):
+            nonlocal acc
+            results.append(self.finish(plrt_call))
+            if tile_len < tile:
+                # the padded copy of a partial tile is not a view of args
+                for i in stream_args:
+                    if i in outputs:
+                        args[i][start:start+tile_len] = \
+                            plrt_call.args[i][:tile_len]
+            tile_out = [ plrt_call.args[i] for i in fixed_outputs ]
+            if acc is None or combine is None:
+                acc = tile_out
+            else:
+                acc = combine(acc, tile_out)
+
+        stream_time = time.time()
+
+        for start in range(0, length, tile):
+            targs, tile_len = tile_args(start)
+            # copy-in of this tile overlaps the kernel of the previous one
+            plrt_call = self.stage(targs, outputs=outputs)
+            if pending is not None:
+                self.wait(pending[0])
+                collect(*pending)
+            self.start(plrt_call)
+            pending = (plrt_call, start, tile_len)
+
+        if pending is not None:
+            self.wait(pending[0])
+            collect(*pending)
+
+        if acc is not None:
+            for i, value in zip(fixed_outputs, acc):
+                np.copyto(args[i], value)
+
+        if self.timing:
+            print(f'FPGA Stream Time ({len(results)} tiles): ' + \
+                  f'{time.time() - stream_time:.10f} s')
+
+        return results
+
+    def stage(self, args, outputs=None):
+        '''Move arguments into device buffers. outputs lists the indices of
+           arguments to copy back in finish() (all arrays by default).'''
+        plrt_call = PLCall(args, outputs)
+        xrt = using_xrt(self.board)
+        curr_addr = 0x10 if self.return_void else 0x18
 
-        self.plrt_arrays = []
-        self.plrt_args = []
         for i in range(len(args)):
             if args[i].shape == ():
-                self.plrt_args.append(args[i])
+                plrt_call.regs.append((curr_addr, args[i]))
+                plrt_call.device_args.append(args[i])
+                curr_addr += 8
+                continue
+
+            if self.pool.owns(args[i]):
+                # already in device memory (pl_allocate): no copy needed
+                array = args[i]
             else:
                 # "allocate" requires PYNQ v2.5 or newer
-                new_array = allocate(shape=args[i].shape, dtype=args[i].dtype)
-                np.copyto(new_array, args[i])
-                new_array.sync_to_device() # requires PYNQ v2.5 or newer
-                self.plrt_arrays.append((i, new_array))
-                self.plrt_args.append(new_array)
-
-        print("FPGA starts. ")
-
-        start_time = time.time()
-
-        result = self.accelerator.call(*self.plrt_args)
-
-        end_time = time.time()
-
-        fpga_time = end_time - start_time
+                # new_array = allocate(shape=arg.shape, dtype=arg.dtype)
+                array = self.pool.acquire(args[i].shape, args[i].dtype)
+                np.copyto(array, args[i])
 
-        print("FPGA finishes. ")
-        if self.timing:  print(f'FPGA Execution Time: {fpga_time:.10f} s')
+            if xrt:
+                array.sync_to_device() # requires PYNQ v2.5 or newer
+            else:
+                # new_array.sync_to_device() # requires PYNQ v2.5 or newer
+                array.flush()
 
-        for i, array in self.plrt_arrays:
-            # "sync_from_device" only available starting PYNQ v2.5
-            array.sync_from_device()
-            np.copyto(args[i], array)
-            array.close()
+            plrt_call.arrays.append((i, array))
+            plrt_call.device_args.append(array)
+            plrt_call.regs.append((curr_addr,
+                                   self.pool.device_address(array)))
+            curr_addr += 8
 
-        self.overlay.free()
+        return plrt_call
 
-        return result
+    def start(self, plrt_call):
+        plrt_call.start_time = time.time()
+        if using_xrt(self.board):
+            plrt_call.handle = self.accelerator.start(*plrt_call.device_args)
+        else:
+            self.session.write_regs(plrt_call.regs)
+            self.accelerator.write(0x00, 1)
+
+    def wait(self, plrt_call, backoff=False):
+        '''Block until the kernel finishes. With backoff, the control
+           register is polled at growing intervals instead of spinning.'''
+        if using_xrt(self.board):
+            # XRT waits for the completion interrupt
+            plrt_call.result = plrt_call.handle.wait()
+        else:
+            delay = POLL_MIN_DELAY
+            isready = self.accelerator.read(0x00)
+            while( isready == 1 ):
+                if backoff:
+                    time.sleep(delay)
+                    delay = min(delay * 2, POLL_MAX_DELAY)
+                isready = self.accelerator.read(0x00)
+
+        plrt_call.fpga_time = time.time() - plrt_call.start_time
+
+    def finish(self, plrt_call):
+        '''Copy results back into the caller's arrays and return the
+           kernel return value.'''
+        args = plrt_call.args
+        xrt = using_xrt(self.board)
+
+        for i, array in plrt_call.arrays:
+            copy_back = plrt_call.outputs is None or i in plrt_call.outputs
+            if copy_back:
+                if xrt:
+                    # "sync_from_device" only available starting PYNQ v2.5
+                    array.sync_from_device()
+                else:
+                    array.invalidate()
+            if array is not args[i]:
+                if copy_back:
+                    np.copyto(args[i], array)
+                self.pool.release(array)
+
+        if xrt:
+            return plrt_call.result
+        else:
+            return self.accelerator.read(0x10)
+
+
+class PLCall:
+    '''One kernel invocation: arguments and the device buffers and control
+       register values staged for them.'''
+
+    def __init__(self, args, outputs=None):
+        self.args = args
+        self.outputs = outputs  # indices of arguments to copy back
+        self.arrays = []       # (argument index, device buffer)
+        self.device_args = []  # arguments as passed to XRT
+        self.regs = []         # (register address, value) on SoC boards
+        self.handle = None
+        self.result = None
+        self.start_time = None
+        self.fpga_time = None
@@ -0,0 +1,308 @@
+import os
+import time
+import signal
+import inspect
+import textwrap
+import threading
+import subprocess
+
+from config import WORKSPACE, BUILD_CORES, BUILD_MEMORY_GB, \
+                   HLS_JOB_CORES, HLS_JOB_MEMORY_GB, \
+                   SYN_JOB_CORES, SYN_JOB_MEMORY_GB
+from sysgen import PLSysGen, supported_boards
+
+
+class PLBuildCancelled(Exception):
+    pass
+
+
+class PLBuildJob:
+    '''One build run by PLBuildScheduler.
+
+       build is called with the job in a worker thread and runs its shell
+       commands through job.run, which streams their output into the log
+       file (and to on_output, if given) and stops them on cancel(). A
+       failed command raises RuntimeError, failing the job; failed jobs are
+       run again up to retries times.
+
+       status: 'pending', 'running', 'done', 'failed' or 'cancelled'
+    '''
+
+    def __init__(self, name, build, cores=1, memory=0, retries=0,
+                 log_file=None, on_output=None):
+        self.name = name
+        self.build = build
+        self.cores = cores
+        self.memory = memory
+        self.retries = retries
+        self.log_file = log_file
+        self.on_output = on_output
+
+        self.status = 'pending'
+        self.attempts = 0
+        self.error = None
+        self.result = None
+        self.elapsed = 0.0
+        self.cancelled = False
+        self.process = None
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+
+    def __repr__(self):
+        return f'PLBuildJob({self.name}, {self.status})'
+
+    def log(self, line):
+        with open(self.log_file, 'a') as fout:
+            fout.write(line)
+        if self.on_output is not None:
+            self.on_output(self, line)
+
+    def run(self, cmd):
+        '''Run a shell command of the build. Used as the PLSysGen runner.'''
+        with self.lock:
+            if self.cancelled:
+                raise PLBuildCancelled(self.name)
+            self.log(f'$ {cmd}\n')
+            # -e: stop at the first failing command, not at the final 'cd -'
+            self.process = subprocess.Popen(['/bin/sh', '-e', '-c', cmd],
+                                            stdout=subprocess.PIPE,
+                                            stderr=subprocess.STDOUT,
+                                            universal_newlines=True,
+                                            start_new_session=True)
+        for line in self.process.stdout:
+            self.log(line)
+        ret = self.process.wait()
+
+        with self.lock:
+            self.process = None
+            if self.cancelled:
+                raise PLBuildCancelled(self.name)
+        if ret != 0:
+            raise RuntimeError(f'command exited with {ret}: {cmd}')
+        return ret
+
+    def cancel(self):
+        '''Stop the job, killing its running command.'''
+        with self.lock:
+            self.cancelled = True
+            if self.process is not None:
+                try:
+                    os.killpg(self.process.pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+
+    def wait(self, timeout=None):
+        self.done.wait(timeout)
+        return self.status
+
+
+class PLBuildScheduler:
+    '''Runs builds concurrently within a budget of cores and memory.
+
+       A job starts when its cores and memory fit in what running jobs
+       leave of the budget (a job larger than the whole budget runs alone).
+       Jobs start in submission order, except that a smaller job may start
+       ahead of one that does not fit yet. Logs go to
+       {log_dir}/{job name}.log.
+
+       scheduler = PLBuildScheduler()
+       scheduler.add_sweep([(pl_matmul, (a, b, c))], boards=['pynq-z2',
+                                                            'ultra96'])
+       jobs = scheduler.wait()
+    '''
+
+    def __init__(self, cores=None, memory=None, retries=0, log_dir=None,
+                 verbose=False):
+        self.cores = cores or BUILD_CORES
+        self.memory = memory or BUILD_MEMORY_GB
+        self.retries = retries
+        self.log_dir = log_dir or f'{WORKSPACE}/build_logs'
+        self.verbose = verbose
+
+        self.jobs = []
+        self.queue = []
+        self.running = []
+        self.cond = threading.Condition()
+        self.dispatcher = None
+
+    ######## Jobs ########
+
+    def submit(self, name, build, cores=1, memory=0, retries=None,
+               on_output=None):
+        '''Queue build(job) as a job, see PLBuildJob.'''
+        if not os.path.exists(self.log_dir):
+            os.makedirs(self.log_dir)
+        if on_output is None and self.verbose:
+            on_output = lambda job, line: print(f'[{job.name}] {line}',
+                                                end='')
+
+        job = PLBuildJob(name, build, cores=cores, memory=memory,
+                         retries=self.retries if retries is None else retries,
+                         log_file=f'{self.log_dir}/{name}.log',
+                         on_output=on_output)
+        open(job.log_file, 'w').close()
+
+        with self.cond:
+            self.jobs.append(job)
+            self.queue.append(job)
+            self.cond.notify_all()
+        self.start()
+        return job
+
+    def add_kernel(self, kernel, args, board='pynq-z2', freq=None,
+                   path=None, backend='vhls', run_hls=True, run_syn=True,
+                   force=False, **kwargs):
+        '''Queue the compilation and hardware build of a PyLog kernel for
+           arguments like args. kernel is a @pylog function or the name of
+           one in PYLOG_KERNELS. Builds of the same kernel for different
+           boards or clock frequencies need different paths; by default
+           the project goes to {WORKSPACE}/{board}_{freq}MHz. Stages that
+           are up to date are skipped unless force is set.'''
+        from pylog import PYLOG_KERNELS, pylog_arg_info, pylog_compile
+        from compile_cache import cache_key
+
+        func = PYLOG_KERNELS[kernel] if isinstance(kernel, str) \
+                                     else inspect.unwrap(kernel)
+        if freq is None:
+            freq = 200.0 if (board == 'aws_f1' or \
+                             board.startswith('alveo')) else 100.0
+        if path is None:
+            path = f'{WORKSPACE}/{board}_{freq:g}MHz'
+
+        source = textwrap.dedent(inspect.getsource(func))
+        arg_info = pylog_arg_info(args, inspect.getfullargspec(func).args)
+
+        def build(job):
+            project_path, top_func, max_idx, return_type, return_void, \
+                hls_c = pylog_compile(src=source, arg_info=arg_info,
+                                      backend=backend, board=board,
+                                      path=path, freq=freq)
+            config = {
+                'workspace_base': path,
+                'project_name': top_func,
+                'project_path': project_path,
+                'freq': freq,
+                'top_name': top_func,
+                'num_bundles': max_idx,
+                'board': board,
+                'return_type': return_type,
+                'return_void': return_void,
+                'cache_key': cache_key(source, arg_info, backend, board,
+                                       freq, path)
+            }
+            plsysgen = PLSysGen(backend=backend, board=board, runner=job.run)
+            plsysgen.generate_system(config, run_hls, run_syn,
+                                     force=force)
+            return config
+
+        if run_syn:
+            budget = {'cores': SYN_JOB_CORES, 'memory': SYN_JOB_MEMORY_GB}
+        else:
+            budget = {'cores': HLS_JOB_CORES, 'memory': HLS_JOB_MEMORY_GB}
+        budget.update(kwargs)
+        return self.submit(f'{func.__name__}_{board}_{freq:g}MHz', build,
+                           **budget)
+
+    def add_sweep(self, kernels, boards=None, freqs=(None,), **kwargs):
+        '''Queue builds of every (kernel, args) pair in kernels for every
+           board (by default, all supported boards) and frequency.'''
+        boards = supported_boards if boards is None else boards
+        return [ self.add_kernel(kernel, args, board=board, freq=freq,
+                                 **kwargs) \
+                 for kernel, args in kernels \
+                 for board in boards \
+                 for freq in freqs ]
+
+    def cancel(self, job=None):
+        '''Cancel job, or every job that has not finished.'''
+        jobs = [job] if job is not None else list(self.jobs)
+        with self.cond:
+            for job in jobs:
+                if job in self.queue:
+                    self.queue.remove(job)
+                    self.finish(job, 'cancelled')
+                else:
+                    job.cancel()
+            self.cond.notify_all()
+
+    def wait(self, timeout=None):
+        '''Wait until all jobs have finished. Returns the jobs.'''
+        deadline = None if timeout is None else time.time() + timeout
+        for job in list(self.jobs):
+            remaining = None if deadline is None else \
+                        max(0, deadline - time.time())
+            job.wait(remaining)
+        return self.jobs
+
+    def summary(self):
+        lines = []
+        for job in self.jobs:
+            lines.append(f'{job.name:<40} {job.status:<10} ' + \
+                         f'attempts={job.attempts} {job.elapsed:.1f} s' + \
+                         (f'  {job.error}' if job.error else ''))
+        return '\n'.join(lines)
+
+    ######## Dispatching ########
+
+    def start(self):
+        with self.cond:
+            if self.dispatcher is None or not self.dispatcher.is_alive():
+                self.dispatcher = threading.Thread(target=self.dispatch,
+                                                   daemon=True)
+                self.dispatcher.start()
+
+    def fits(self, job):
+        used_cores = sum(j.cores for j in self.running)
+        used_memory = sum(j.memory for j in self.running)
+        if not self.running:
+            return True
+        return used_cores + job.cores <= self.cores and \
+               used_memory + job.memory <= self.memory
+
+    def dispatch(self):
+        with self.cond:
+            while self.queue or self.running:
+                for job in list(self.queue):
+                    if self.fits(job):
+                        self.queue.remove(job)
+                        self.running.append(job)
+                        job.status = 'running'
+                        threading.Thread(target=self.execute, args=(job,),
+                                         daemon=True).start()
+                self.cond.wait()
+            self.dispatcher = None
+
+    def execute(self, job):
+        start_time = time.time()
+        job.attempts += 1
+        status = 'done'
+        try:
+            job.result = job.build(job)
+            job.error = None
+            if job.cancelled:
+                status = 'cancelled'
+        except PLBuildCancelled:
+            status = 'cancelled'
+        except BaseException as e:
+            # also SystemExit from the exit() calls of generate_system
+            job.error = f'{type(e).__name__}: {e}'
+            job.log(f'{job.error}\n')
+            status = 'failed'
+        job.elapsed += time.time() - start_time
+
+        with self.cond:
+            self.running.remove(job)
+            if status == 'failed' and job.attempts <= job.retries and \
+               not job.cancelled:
+                print(f'Build {job.name} failed, retrying ...')
+                job.status = 'pending'
+                self.queue.append(job)
+            else:
+                self.finish(job, status)
+            self.cond.notify_all()
+
+    def finish(self, job, status):
+        job.status = status
+        if status == 'failed':
+            print(f'Build {job.name} failed, see {job.log_file}')
+        job.done.set()
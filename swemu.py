@@ -0,0 +1,161 @@
+import os
+import time
+import ctypes
+import hashlib
+import subprocess
+import numpy as np
+
+from config import SWEMU_CXX, SWEMU_CXXFLAGS, SWEMU_INCLUDE_DIR
+from utils import np_pl_type_map
+
+# C types of kernel arguments and their NumPy equivalents; ap_int/ap_uint
+# map to the smallest integer that holds them (see swemu_include/ap_int.h)
+c_np_type_map = {
+    'float':        np.float32,
+    'double':       np.float64,
+    'int':          np.int32,
+    'unsigned int': np.uint32,
+    'bool':         np.bool_
+}
+
+
+def c_np_type(c_type):
+    if c_type in c_np_type_map:
+        return np.dtype(c_np_type_map[c_type])
+
+    if c_type.startswith(('ap_int<', 'ap_uint<')):
+        width = int(c_type[c_type.index('<')+1:c_type.index('>')])
+        for bits in (8, 16, 32, 64):
+            if width <= bits:
+                prefix = 'uint' if c_type.startswith('ap_uint') else 'int'
+                return np.dtype(f'{prefix}{bits}')
+
+    raise NotImplementedError(f'swemu: unsupported argument type {c_type}')
+
+
+class PLSwEmu:
+    '''Software emulation of a PyLog kernel.
+
+       The generated HLS C code is compiled with g++ against the stand-in
+       headers in swemu_include, together with a small extern "C" shim
+       taking the argument pointers as an array, and called through ctypes.
+       Arrays whose dtype matches the C type of the argument are passed
+       without a copy; others are converted and copied back after the call.
+       Shared objects are named after a hash of their source and flags, so
+       an unchanged kernel is compiled only once.
+    '''
+
+    libs = {}
+
+    def __init__(self, config):
+        self.config = config
+        self.top_name = config['top_name']
+        self.project_path = config['project_path']
+        self.return_type = config['return_type']
+        self.timing = config['timing']
+
+    def c_type(self, arg):
+        return np_pl_type_map(arg.dtype.name)
+
+    def is_scalar(self, arg):
+        return arg.shape in {(1,), ()}
+
+    def shim_code(self, args):
+        '''extern "C" entry point forwarding a void* array to the kernel.'''
+        call_args = []
+        for i in range(len(args)):
+            c_type = self.c_type(args[i])
+            if self.is_scalar(args[i]):
+                call_args.append(f'*reinterpret_cast<{c_type} *>(args[{i}])')
+            elif len(args[i].shape) == 1:
+                call_args.append(f'reinterpret_cast<{c_type} *>(args[{i}])')
+            else:
+                dims = ''.join(f'[{d}]' for d in args[i].shape[1:])
+                call_args.append(
+                    f'reinterpret_cast<{c_type} (*){dims}>(args[{i}])')
+
+        call = f'{self.top_name}({", ".join(call_args)})'
+        if self.return_type != 'void':
+            call = f'*reinterpret_cast<{self.return_type} *>(ret) = {call}'
+
+        return '\nextern "C" ' + \
+               'void pylog_swemu_call(void **args, void *ret)\n' + \
+               '{\n' + f'  {call};\n' + '}\n'
+
+    def build(self, args):
+        '''Compile the kernel and return the loaded shared object.'''
+        with open(f'{self.project_path}/{self.top_name}.cpp') as fin:
+            source = fin.read() + self.shim_code(args)
+
+        flags = SWEMU_CXXFLAGS
+        if '#pragma omp' in source:
+            flags += ' -fopenmp'
+
+        digest = hashlib.sha256((source + flags).encode('UTF-8')).hexdigest()
+        build_dir = f'{self.project_path}/swemu'
+        lib_file = f'{build_dir}/{self.top_name}_{digest[:16]}.so'
+
+        if lib_file in PLSwEmu.libs:
+            return PLSwEmu.libs[lib_file]
+
+        if not os.path.exists(lib_file):
+            if not os.path.exists(build_dir):
+                os.makedirs(build_dir)
+            src_file = f'{build_dir}/{self.top_name}_swemu.cpp'
+            with open(src_file, 'w') as fout:
+                fout.write(source)
+
+            print("Compiling for software emulation ...")
+            tmp_file = f'{lib_file}.{os.getpid()}.tmp'
+            ret = subprocess.call(f'{SWEMU_CXX} {flags} ' + \
+                                  f'-I{SWEMU_INCLUDE_DIR} {src_file} ' + \
+                                  f'-o {tmp_file}', shell=True)
+            if ret != 0:
+                raise RuntimeError(f'swemu: failed to compile {src_file}')
+            os.replace(tmp_file, lib_file)
+
+        lib = ctypes.CDLL(lib_file)
+        lib.pylog_swemu_call.argtypes = [ctypes.POINTER(ctypes.c_void_p),
+                                         ctypes.c_void_p]
+        lib.pylog_swemu_call.restype = None
+        PLSwEmu.libs[lib_file] = lib
+        return lib
+
+    def call(self, args):
+        # NumPy and Python scalars have no buffer to pass
+        args = [ arg if isinstance(arg, np.ndarray) else np.asarray(arg) \
+                 for arg in args ]
+        lib = self.build(args)
+
+        buffers = []
+        copy_back = []
+        for arg in args:
+            dtype = c_np_type(self.c_type(arg))
+            if arg.dtype == dtype and arg.flags['C_CONTIGUOUS']:
+                buf = arg
+            else:
+                buf = np.ascontiguousarray(arg, dtype=dtype)
+                if not self.is_scalar(arg):
+                    copy_back.append((arg, buf))
+            buffers.append(buf)
+
+        ptrs = (ctypes.c_void_p * len(buffers))(
+                    *[ buf.ctypes.data for buf in buffers ])
+
+        if self.return_type != 'void':
+            ret = np.zeros((1,), dtype=c_np_type(self.return_type))
+            ret_ptr = ret.ctypes.data
+        else:
+            ret = None
+            ret_ptr = None
+
+        start_time = time.time()
+        lib.pylog_swemu_call(ptrs, ret_ptr)
+        if self.timing:
+            print(f'Software Emulation Time: ' + \
+                  f'{time.time() - start_time:.10f} s')
+
+        for arg, buf in copy_back:
+            np.copyto(arg, buf, casting='unsafe')
+
+        return ret[0] if ret is not None else None
@@ -0,0 +1,73 @@
+#ifndef PYLOG_SWEMU_AP_FIXED_H
+#define PYLOG_SWEMU_AP_FIXED_H
+
+// Lightweight stand-in for the Vivado HLS fixed-point types, used by PyLog
+// software emulation (mode='swemu'). A value is kept as a W-bit integer
+// scaled by 2^-(W-I), truncated towards minus infinity and wrapped on
+// overflow (the AP_TRN and AP_WRAP defaults). Arithmetic is carried out in
+// double precision, so results wider than 53 bits are approximate.
+
+#include <math.h>
+#include "ap_int.h"
+
+template <int W, int I, bool S>
+class ap_fixed_base {
+public:
+    typedef typename ap_storage<W, S>::type storage;
+    static const int F = W - I;
+
+    storage v;
+
+    ap_fixed_base() : v(0) {}
+
+    template <typename T>
+    ap_fixed_base(const T &x) { set_value((double)x); }
+
+    operator double() const { return ldexp((double)v, -F); }
+
+    void set_value(double x)
+    {
+        set_bits((uint64_t)(long long)floor(ldexp(x, F)));
+    }
+
+    uint64_t get_bits() const
+    {
+        return S ? (uint64_t)(int64_t)v : (uint64_t)v;
+    }
+    void set_bits(uint64_t bits) { v = (storage)ap_wrap<W, S>(bits); }
+
+    ap_range_ref<ap_fixed_base> range(int hi, int lo)
+    {
+        return ap_range_ref<ap_fixed_base>(*this, hi, lo);
+    }
+    ap_range_ref<ap_fixed_base> range() { return range(W - 1, 0); }
+    ap_range_ref<ap_fixed_base> operator[](int i) { return range(i, i); }
+
+    template <typename T>
+    ap_fixed_base &operator+=(const T &x) { set_value(*this + x); return *this; }
+    template <typename T>
+    ap_fixed_base &operator-=(const T &x) { set_value(*this - x); return *this; }
+    template <typename T>
+    ap_fixed_base &operator*=(const T &x) { set_value(*this * x); return *this; }
+    template <typename T>
+    ap_fixed_base &operator/=(const T &x) { set_value(*this / x); return *this; }
+
+    ap_fixed_base &operator++() { return *this += 1; }
+    ap_fixed_base &operator--() { return *this -= 1; }
+};
+
+template <int W, int I>
+class ap_fixed : public ap_fixed_base<W, I, true> {
+public:
+    using ap_fixed_base<W, I, true>::ap_fixed_base;
+    ap_fixed() {}
+};
+
+template <int W, int I>
+class ap_ufixed : public ap_fixed_base<W, I, false> {
+public:
+    using ap_fixed_base<W, I, false>::ap_fixed_base;
+    ap_ufixed() {}
+};
+
+#endif
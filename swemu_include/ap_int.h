@@ -0,0 +1,152 @@
+#ifndef PYLOG_SWEMU_AP_INT_H
+#define PYLOG_SWEMU_AP_INT_H
+
+// Lightweight stand-in for the Vivado HLS arbitrary precision integer
+// types, used by PyLog software emulation (mode='swemu'). Widths of 1 to
+// 64 bits are supported. Values are kept in the smallest native integer
+// that holds them, so arrays have the same layout as the matching NumPy
+// dtype, and wrap around on overflow like ap_int/ap_uint.
+
+#include <stdint.h>
+#include <type_traits>
+
+template <int W, bool S>
+struct ap_storage {
+    static_assert(W >= 1 && W <= 64,
+                  "swemu: ap_int and ap_fixed support 1 to 64 bits");
+
+    typedef typename std::conditional<(W <= 8), int8_t,
+            typename std::conditional<(W <= 16), int16_t,
+            typename std::conditional<(W <= 32), int32_t,
+                                      int64_t>::type>::type>::type stype;
+    typedef typename std::conditional<(W <= 8), uint8_t,
+            typename std::conditional<(W <= 16), uint16_t,
+            typename std::conditional<(W <= 32), uint32_t,
+                                      uint64_t>::type>::type>::type utype;
+    typedef typename std::conditional<S, stype, utype>::type type;
+};
+
+inline uint64_t ap_mask(int width)
+{
+    return (width >= 64) ? ~0ULL : ((1ULL << width) - 1);
+}
+
+// truncate bits to W bits, sign-extending signed values
+template <int W, bool S>
+inline uint64_t ap_wrap(uint64_t bits)
+{
+    bits &= ap_mask(W);
+    if (S && W < 64 && ((bits >> (W - 1)) & 1))
+        bits |= ~ap_mask(W);
+    return bits;
+}
+
+// reference to bits hi..lo of an ap_int or ap_fixed, as returned by
+// range() and operator[]
+template <typename T>
+class ap_range_ref {
+public:
+    ap_range_ref(T &owner, int hi, int lo) : owner(owner), hi(hi), lo(lo) {}
+
+    operator unsigned long long() const
+    {
+        return (owner.get_bits() >> lo) & ap_mask(hi - lo + 1);
+    }
+
+    ap_range_ref &operator=(unsigned long long value)
+    {
+        uint64_t mask = ap_mask(hi - lo + 1) << lo;
+        uint64_t bits = owner.get_bits() & ~mask;
+        owner.set_bits(bits | ((value << lo) & mask));
+        return *this;
+    }
+
+    ap_range_ref &operator=(const ap_range_ref &other)
+    {
+        return *this = (unsigned long long)other;
+    }
+
+    template <typename V>
+    ap_range_ref &operator=(const V &value)
+    {
+        return *this = (unsigned long long)value;
+    }
+
+private:
+    T &owner;
+    int hi;
+    int lo;
+};
+
+template <int W, bool S>
+class ap_int_base {
+public:
+    typedef typename ap_storage<W, S>::type storage;
+    typedef typename std::conditional<S, long long,
+                                      unsigned long long>::type value_type;
+
+    storage v;
+
+    ap_int_base() : v(0) {}
+
+    template <typename T>
+    ap_int_base(const T &x) { set_bits((uint64_t)(value_type)x); }
+
+    operator value_type() const { return v; }
+
+    uint64_t get_bits() const { return (uint64_t)(value_type)v; }
+    void set_bits(uint64_t bits) { v = (storage)ap_wrap<W, S>(bits); }
+
+    ap_range_ref<ap_int_base> range(int hi, int lo)
+    {
+        return ap_range_ref<ap_int_base>(*this, hi, lo);
+    }
+    ap_range_ref<ap_int_base> range() { return range(W - 1, 0); }
+    ap_range_ref<ap_int_base> operator[](int i) { return range(i, i); }
+    ap_range_ref<ap_int_base> operator()(int hi, int lo)
+    {
+        return range(hi, lo);
+    }
+
+    template <typename T>
+    ap_int_base &operator+=(const T &x) { return *this = (value_type)v + x; }
+    template <typename T>
+    ap_int_base &operator-=(const T &x) { return *this = (value_type)v - x; }
+    template <typename T>
+    ap_int_base &operator*=(const T &x) { return *this = (value_type)v * x; }
+    template <typename T>
+    ap_int_base &operator/=(const T &x) { return *this = (value_type)v / x; }
+    template <typename T>
+    ap_int_base &operator%=(const T &x) { return *this = (value_type)v % x; }
+    template <typename T>
+    ap_int_base &operator&=(const T &x) { return *this = (value_type)v & x; }
+    template <typename T>
+    ap_int_base &operator|=(const T &x) { return *this = (value_type)v | x; }
+    template <typename T>
+    ap_int_base &operator^=(const T &x) { return *this = (value_type)v ^ x; }
+    template <typename T>
+    ap_int_base &operator<<=(const T &x) { return *this = (value_type)v << x; }
+    template <typename T>
+    ap_int_base &operator>>=(const T &x) { return *this = (value_type)v >> x; }
+
+    ap_int_base &operator++() { return *this += 1; }
+    ap_int_base &operator--() { return *this -= 1; }
+    ap_int_base operator++(int) { ap_int_base old = *this; ++*this; return old; }
+    ap_int_base operator--(int) { ap_int_base old = *this; --*this; return old; }
+};
+
+template <int W>
+class ap_int : public ap_int_base<W, true> {
+public:
+    using ap_int_base<W, true>::ap_int_base;
+    ap_int() {}
+};
+
+template <int W>
+class ap_uint : public ap_int_base<W, false> {
+public:
+    using ap_int_base<W, false>::ap_int_base;
+    ap_uint() {}
+};
+
+#endif
@@ -0,0 +1,33 @@
+#ifndef PYLOG_SWEMU_HLS_MATH_H
+#define PYLOG_SWEMU_HLS_MATH_H
+
+// Stand-in for the Vivado HLS math library, used by PyLog software
+// emulation (mode='swemu'): the hls:: functions map to the C++ standard
+// library.
+
+#include <math.h>
+#include <cmath>
+#include <algorithm>
+
+namespace hls {
+    using std::abs;
+    using std::fabs;
+    using std::sqrt;
+    using std::exp;
+    using std::log;
+    using std::log2;
+    using std::log10;
+    using std::pow;
+    using std::sin;
+    using std::cos;
+    using std::tan;
+    using std::tanh;
+    using std::floor;
+    using std::ceil;
+    using std::round;
+    using std::fmod;
+    using std::min;
+    using std::max;
+}
+
+#endif
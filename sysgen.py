@@ -1,11 +1,15 @@
 import os
+import re
 import glob
 import json
 import time
+import hashlib
 import subprocess
 
 from jinja2 import FileSystemLoader, Environment
 from config import TEMPLATE_DIR, HLS_CMD
+from utils import parse_hls_report
+from results_db import PLResultsDB
 
 # list of supported boards
 supported_boards = [
@@ -19,6 +23,9 @@ supported_boards = [
     'alveo_u280'
 ]
 
+# version banners of the Xilinx tools, queried once per process
+tool_versions = {}
+
 # An example config:
 config = {
     'project_name': 'pl_matmul',
@@ -31,10 +38,13 @@ config = {
 
 
 class PLSysGen:
-    def __init__(self, backend='vhls', board='pynq-z2', config=None):
+    def __init__(self, backend='vhls', board='pynq-z2', config=None,
+                 runner=None):
         self.backend = backend
         self.target_board = board
         self.config = config
+        # runs the shell commands of the build, see PLBuildJob.run
+        self.runner = runner
         if board not in supported_boards:
             print(f'{board} is not supported. Using pynq-z2 as target. ')
             self.target_board = 'pynq-z2'
@@ -42,6 +52,90 @@ class PLSysGen:
         self.using_vitis = (board == 'aws_f1' or board.startswith('alveo'))
 
 
+    def run(self, cmd):
+        if self.runner is not None:
+            return self.runner(cmd)
+        return subprocess.call(cmd, shell=True)
+
+    def tool_version(self, tool):
+        '''Version banner of a Xilinx tool, or '' if it cannot be run.'''
+        if tool not in tool_versions:
+            try:
+                out = subprocess.run(f'{tool} -version', shell=True,
+                                     stdout=subprocess.PIPE,
+                                     stderr=subprocess.STDOUT,
+                                     universal_newlines=True, timeout=120)
+                lines = [ l for l in out.stdout.splitlines() \
+                          if re.search(r'v?20[0-9][0-9]\.[0-9]', l) ]
+                tool_versions[tool] = lines[0].strip() \
+                                      if out.returncode == 0 and lines else ''
+            except subprocess.TimeoutExpired:
+                tool_versions[tool] = ''
+        return tool_versions[tool]
+
+    def source_digest(self, project_path):
+        '''Names and contents of the HLS sources in project_path: the top
+           function and the IP core sources generated next to it.'''
+        digest = hashlib.sha256()
+        for pattern in ('*.cpp', '*.c', '*.h', '*.hpp'):
+            for src in sorted(glob.glob(f'{project_path}/{pattern}')):
+                digest.update(os.path.basename(src).encode('UTF-8'))
+                with open(src, 'rb') as fin:
+                    digest.update(fin.read())
+        return digest.hexdigest()
+
+    def fingerprint(self, *parts):
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(str(part).encode('UTF-8') + b'\0')
+        return digest.hexdigest()
+
+    def manifest_file(self, config):
+        return f"{config['project_path']}/" + \
+               f"{config['project_name']}_{self.target_board}.manifest.json"
+
+    def stage(self, name, digest, outputs, action, force=False):
+        '''Run action unless the manifest records digest for stage name and
+           all its outputs exist. The digest is recorded once the outputs
+           exist after the run. Returns whether action was run.'''
+        manifest_file = self.manifest_file(self.stage_config)
+        manifest = {}
+        if os.path.exists(manifest_file):
+            with open(manifest_file) as fin:
+                manifest = json.load(fin)
+
+        if not force and manifest.get(name) == digest and \
+           all(os.path.exists(f) for f in outputs):
+            print(f"Skipping {name}: inputs unchanged since the last build.")
+            return False
+
+        # outputs of an earlier build must not pass for this one
+        manifest.pop(name, None)
+        with open(manifest_file, 'w') as fout:
+            json.dump(manifest, fout, indent=2)
+
+        action()
+
+        if all(os.path.exists(f) for f in outputs):
+            manifest[name] = digest
+            with open(manifest_file, 'w') as fout:
+                json.dump(manifest, fout, indent=2)
+        return True
+
+    def record_hls(self, config, report_dir):
+        '''Parse the reports of an HLS run into the results database, keyed
+           by the compile cache key of the kernel (config['cache_key']).'''
+        record = parse_hls_report(report_dir, config['top_name'])
+        if record is None:
+            print(f"WARNING: no HLS report in {report_dir}.")
+            return None
+        PLResultsDB().record(config.get('cache_key'), record,
+                             board=self.target_board, freq=config['freq'])
+        print(f"HLS results: latency {record['latency']}, " + \
+              f"interval {record['interval']}, " + \
+              f"slack {record['timing']['slack']} ns.")
+        return record
+
     def gen_configs(self, config=None):
         '''generate configs for Vivado and Vivado HLS tcl templates'''
         if config is None:
@@ -89,7 +183,13 @@ class PLSysGen:
         status = data['FpgaImages'][0]['State']['Code']
         return status
 
-    def generate_system(self, config, run_hls=True, run_syn=True):
+    def generate_system(self, config, run_hls=True, run_syn=True,
+                        force=False):
+        '''Run HLS and synthesis for config. Each stage (HLS with IP export,
+           implementation or xclbin link, AFI creation) is skipped when its
+           inputs are unchanged since it last produced its outputs, unless
+           force is set; see stage. Returns the HLS results (see
+           utils.parse_hls_report) if HLS was run, else None.'''
 
         ### Initialize sysgen variables
 
@@ -100,6 +200,8 @@ class PLSysGen:
 
         project_path = config['project_path']
         project_name = config['project_name']
+        self.stage_config = config
+        hls_record = None
         if not os.path.exists(project_path):
             os.makedirs(project_path)
         # else:
@@ -148,136 +250,189 @@ class PLSysGen:
 
         if self.backend == 'merlin':
 
+            hls_digest = self.fingerprint(self.source_digest(project_path),
+                                          platform,
+                                          self.tool_version('merlincc'))
+
             if run_hls:
-                subprocess.call(
-                    f"cd {project_path}; " + \
-                    f"merlincc -c {project_name}.cpp -D XILINX " + \
-                            f"-o {project_name}_{self.target_board} " + \
-                            f"--attribute auto_dse=on " + \
-                            f"-funsafe-math-optimizations -I. " + \
-                            f"--platform={platform}; " + \
-                    f"cd -;",
-                    shell=True)
 
-                subprocess.call(
-                    f"cd {project_path}; " + \
-                    f"merlincc {project_name}_{self.target_board}.mco " + \
-                            f"--report=estimate " + \
+                def hls():
+                    self.run(
+                        f"cd {project_path}; " + \
+                        f"merlincc -c {project_name}.cpp -D XILINX " + \
+                                f"-o {project_name}_{self.target_board} " + \
+                                f"--attribute auto_dse=on " + \
+                                f"-funsafe-math-optimizations -I. " + \
+                                f"--platform={platform}; " + \
+                        f"cd -;")
+
+                    self.run(
+                        f"cd {project_path}; " + \
+                        f"merlincc {project_name}_{self.target_board}.mco " + \
+                                f"--report=estimate " + \
+                                f"--attribute auto_dse=on " + \
+                                f"--platform={platform}; " + \
+                        f"cd -;")
+
+                self.stage('hls', hls_digest,
+                           [f"{project_path}/{project_name}_" + \
+                            f"{self.target_board}.mco"], hls, force)
+
+            impl_digest = hls_digest
+            if run_syn:
+
+                def link():
+                    self.run(
+                        f"cd {project_path}; " + \
+                        f"merlincc {project_name}_{self.target_board}.mco " + \
+                            f"-o {project_name}_{self.target_board}.xclbin " + \
                             f"--attribute auto_dse=on " + \
                             f"--platform={platform}; " + \
-                    f"cd -;",
-                    shell=True)
+                        f"cd -;")
 
-            if run_syn:
-                subprocess.call(
-                    f"cd {project_path}; " + \
-                    f"merlincc {project_name}_{self.target_board}.mco " + \
-                        f"-o {project_name}_{self.target_board}.xclbin " + \
-                        f"--attribute auto_dse=on " + \
-                        f"--platform={platform}; " + \
-                    f"cd -;",
-                    shell=True)
+                self.stage('impl', impl_digest,
+                           [f"{project_path}/{project_name}_" + \
+                            f"{self.target_board}.xclbin"], link, force)
 
         elif self.backend == 'vhls':
 
             vivado_config, hls_config = self.gen_configs(config)
 
-            if run_hls:
+            template_loader = FileSystemLoader(searchpath=TEMPLATE_DIR)
+            template_env = Environment(loader=template_loader)
+            hls_project = f"{project_path}/{hls_config['hls_project_name']}"
+
+            # fingerprint of the HLS inputs, which later stages build on
+            hls_template = f"{self.target_board}_hls.tcl.jinja"
+            template = template_env.get_template(hls_template)
+            hls_tcl = template.render(hls_config)
+            hls_tcl_script = f"{project_path}/run_hls.tcl"
+            hls_digest = self.fingerprint(self.source_digest(project_path),
+                                          hls_tcl, self.tool_version(HLS_CMD))
 
-                template_loader = FileSystemLoader(searchpath=TEMPLATE_DIR)
-                template_env = Environment(loader=template_loader)
-                hls_template = f"{self.target_board}_hls.tcl.jinja"
-                template = template_env.get_template(hls_template)
-                output_text = template.render(hls_config)
+            if run_hls:
 
-                hls_tcl_script = f"{project_path}/run_hls.tcl"
+                def hls():
+                    print(hls_tcl, file=open(hls_tcl_script, "w"))
 
-                print(output_text, file=open(hls_tcl_script, "w"))
+                    self.run(
+                        f"cd {project_path}; " + \
+                        f"{HLS_CMD} -f {hls_tcl_script}; " + \
+                        f"cd -;")
 
-                subprocess.call(
-                    f"cd {project_path}; " + \
-                    f"{HLS_CMD} -f {hls_tcl_script}; " + \
-                    f"cd -;",
-                    shell=True)
+                if self.using_vitis:
+                    hls_outputs = [f"{project_path}/{config['top_name']}_" + \
+                                   f"{self.target_board}.xo"]
+                else:
+                    hls_outputs = [f"{hls_project}/solution1/impl/ip/" + \
+                                   f"component.xml"]
+                report_dir = f"{hls_project}/solution1/syn/report"
+                if self.stage('hls', hls_digest, hls_outputs, hls, force):
+                    hls_record = self.record_hls(config, report_dir)
+                else:
+                    hls_record = parse_hls_report(report_dir,
+                                                  config['top_name'])
 
             if run_syn:
 
                 if not self.using_vitis:
                     vivado_template = f"{self.target_board}_vivado.tcl.jinja"
                     template = template_env.get_template(vivado_template)
-                    output_text = template.render(vivado_config)
-
+                    vivado_tcl = template.render(vivado_config)
                     vivado_tcl_script = f"{project_path}/run_vivado.tcl"
 
-                    print(output_text, file=open(vivado_tcl_script, "w"))
-
-                    subprocess.call(
-                        f"cd {project_path}; " + \
-                        f"vivado -mode batch -source {vivado_tcl_script}; " + \
-                        f"cd -;",
-                        shell=True)
-
-                    print("project_path = ", project_path)
-
-                    subprocess.call(
-                        f"cd {project_path}; " + \
-                        f"cp ./{project_name}_{self.target_board}_vivado/" + \
-                        f"{project_name}_{self.target_board}_vivado.runs/"+\
-                        f"impl_1/design_1_wrapper.bit " + \
-                        f"./{project_name}_{self.target_board}.bit;" + \
-                        f"cd -;",
-                        shell=True)
-
-                    subprocess.call(
-                        f"cd {project_path}; " + \
-                        f"cp ./{project_name}_{self.target_board}_vivado/" + \
-                        f"{project_name}_{self.target_board}_vivado.srcs/" + \
-                        f"sources_1/bd/design_1/hw_handoff/design_1.hwh " + \
-                        f" ./{project_name}_{self.target_board}.hwh; " + \
-                        f"cd -;",
-                        shell=True)
+                    def implementation():
+                        print(vivado_tcl, file=open(vivado_tcl_script, "w"))
+
+                        self.run(
+                            f"cd {project_path}; " + \
+                            f"vivado -mode batch -source {vivado_tcl_script};"+\
+                            f" cd -;")
+
+                        print("project_path = ", project_path)
+
+                        self.run(
+                            f"cd {project_path}; " + \
+                            f"cp ./{project_name}_{self.target_board}_vivado/"+\
+                            f"{project_name}_{self.target_board}_vivado.runs/"+\
+                            f"impl_1/design_1_wrapper.bit " + \
+                            f"./{project_name}_{self.target_board}.bit;" + \
+                            f"cd -;")
+
+                        self.run(
+                            f"cd {project_path}; " + \
+                            f"cp ./{project_name}_{self.target_board}_vivado/"+\
+                            f"{project_name}_{self.target_board}_vivado.srcs/"+\
+                            f"sources_1/bd/design_1/hw_handoff/design_1.hwh " +\
+                            f" ./{project_name}_{self.target_board}.hwh; " + \
+                            f"cd -;")
+
+                    impl_digest = self.fingerprint(hls_digest, vivado_tcl,
+                                                   self.tool_version('vivado'))
+                    impl_outputs = [
+                        f"{project_path}/{project_name}_{self.target_board}" + \
+                        f".{ext}" for ext in ('bit', 'hwh') ]
+                    self.stage('impl', impl_digest, impl_outputs,
+                               implementation, force)
 
                 else:
-                    subprocess.call(
-                        f" cd {project_path}; " + \
-                        f" v++ -t hw --platform {platform} " + \
-                        f" --link {project_name}_{self.target_board}.xo " + \
-                        f" -o {project_name}_{self.target_board}.xclbin;cd -;",
-                        shell=True)
+                    def link():
+                        self.run(
+                            f" cd {project_path}; " + \
+                            f" v++ -t hw --platform {platform} " + \
+                            f" --link {project_name}_{self.target_board}.xo " +\
+                            f" -o {project_name}_{self.target_board}.xclbin;" +\
+                            f"cd -;")
+
+                    impl_digest = self.fingerprint(hls_digest, platform,
+                                                   self.tool_version('v++'))
+                    impl_outputs = [f"{project_path}/{project_name}_" + \
+                                    f"{self.target_board}.xclbin"]
+                    self.stage('impl', impl_digest, impl_outputs, link, force)
 
         else:
             raise NotImplementedError
 
-        if self.target_board == 'aws_f1':
+        if self.target_board == 'aws_f1' and run_syn:
 
-            print("Start creating Amazon FPGA Image (AFI)...")
-            subprocess.call(
-                f" cd {project_path}; " + \
-                f" {vitis_dir}/tools/create_vitis_afi.sh " + \
-                f" -xclbin={project_name}_{self.target_board}.xclbin " + \
-                f" -o={project_name}_{self.target_board} " + \
-                f" -s3_bucket={s3_bucket} -s3_dcp_key={s3_dcp} " + \
-                f" -s3_logs_key={s3_logs}; cd -;",
-                shell=True)
+            def afi():
+                print("Start creating Amazon FPGA Image (AFI)...")
+                self.run(
+                    f" cd {project_path}; " + \
+                    f" {vitis_dir}/tools/create_vitis_afi.sh " + \
+                    f" -xclbin={project_name}_{self.target_board}.xclbin " + \
+                    f" -o={project_name}_{self.target_board} " + \
+                    f" -s3_bucket={s3_bucket} -s3_dcp_key={s3_dcp} " + \
+                    f" -s3_logs_key={s3_logs}; cd -;")
 
-            print("Amazon FPGA Image (AFI) creation requested. ")
+                print("Amazon FPGA Image (AFI) creation requested. ")
 
-            list_of_files = glob.glob(f'{project_path}/*_afi_id.txt')
-            latest_afi = max(list_of_files, key=os.path.getctime)
+                list_of_files = glob.glob(f'{project_path}/*_afi_id.txt')
+                latest_afi = max(list_of_files, key=os.path.getctime)
 
-            afi_id = self.get_afi_id(latest_afi)
-            status = self.get_afi_status(afi_id)
+                afi_id = self.get_afi_id(latest_afi)
+                status = self.get_afi_status(afi_id)
 
-            print("Waiting for Amazon FPGA Image (AFI) creation... ")
+                print("Waiting for Amazon FPGA Image (AFI) creation... ")
 
-            while status == 'pending':
-                time.sleep(10)
-                status = self.get_afi_status(afi_id)
+                while status == 'pending':
+                    time.sleep(10)
+                    status = self.get_afi_status(afi_id)
 
-            if status == 'available':
-                print("Amazon FPGA Image (AFI) creation done. ")
-            else:
-                print(f"Error in AFI creation. Status: {status}. ")
+                if status == 'available':
+                    print("Amazon FPGA Image (AFI) creation done. ")
+                    with open(afi_file, 'w') as fout:
+                        fout.write(afi_id)
+                else:
+                    print(f"Error in AFI creation. Status: {status}. ")
+
+            # written only once the AFI is available
+            afi_file = f"{project_path}/{project_name}_" + \
+                       f"{self.target_board}.afi"
+            afi_digest = self.fingerprint(impl_digest, s3_bucket, s3_dcp)
+            self.stage('afi', afi_digest, [afi_file], afi, force)
+
+        return hls_record
 
 if __name__ == '__main__':
     plsysgen = PLSysGen(board='ultra96')
@@ -0,0 +1,97 @@
+import io
+import contextlib
+import numpy as np
+from pylog import *
+from config import WORKSPACE
+
+'''
+array_partition pragmas that autoopt mode infers for the local arrays
+accessed by the copies of unrolled loops, and the warnings for memory
+banks and AXI bundles with fewer ports than accesses per cycle.
+'''
+
+
+@pylog(mode='cgen autoopt')
+def pl_rows(a, c):
+    # buf[i][j] for j = 0..7 in one cycle: dimension 2 complete
+    buf = np.empty([64, 8], np.float32)
+    for i in range(64):
+        for j in range(8):
+            buf[i][j] = a[i][j]
+    for i in range(64):
+        s = 0.0
+        for j in range(8):
+            s += buf[i][j]
+        c[i][0] = s
+
+
+@pylog(mode='cgen autoopt')
+def pl_strided(a, c):
+    # buf[k * 16 + i] for k = 0..3 in one cycle: blocks of 16
+    buf = np.empty([64], np.float32)
+    for i in range(64):
+        buf[i] = a[i][0]
+    for i in range(16):
+        for k in range(4):
+            c[i][k] = buf[k * 16 + i]
+
+
+@pylog(mode='cgen autoopt')
+def pl_banks(a, c):
+    # big[k * 3 + i] for k = 0..7 in one cycle: cyclic, 8 banks; buf keeps
+    # the 2 banks of the user
+    buf = np.empty([64], np.float32)
+    pragma("HLS array_partition variable=buf cyclic factor=2 dim=1")
+    big = np.empty([256], np.float32)
+    for i in range(64):
+        buf[i] = a[i]
+        big[i] = a[i]
+    for i in range(8):
+        s = 0.0
+        for k in range(8):
+            s += buf[i * 8 + k] + big[k * 3 + i]
+        c[i] = s
+
+
+@pylog(mode='cgen autoopt')
+def pl_sum4(a, c):
+    # 4 reads of a per cycle through one AXI port
+    for i in range(16):
+        s = 0.0
+        for k in range(4):
+            s += a[i * 4 + k]
+        c[i] = s
+
+
+def compile_kernel(kernel, *args):
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        kernel(*args)
+    name = kernel.__name__
+    with open(f'{WORKSPACE}/{name}/{name}.cpp') as f:
+        return f.read(), log.getvalue()
+
+
+if __name__ == "__main__":
+    code, log = compile_kernel(pl_rows, np.zeros((64, 8), np.float32),
+                               np.zeros((64, 8), np.float32))
+    print('#pragma HLS array_partition variable=buf complete dim=2' in code)
+
+    code, log = compile_kernel(pl_strided, np.zeros((64, 4), np.float32),
+                               np.zeros((64, 4), np.float32))
+    print('#pragma HLS array_partition variable=buf block factor=4 dim=1' \
+          in code)
+
+    code, log = compile_kernel(pl_banks, np.zeros(64, np.float32),
+                               np.zeros(64, np.float32))
+    print('#pragma HLS array_partition variable=big cyclic factor=8 dim=1' \
+          in code,
+          code.count('array_partition variable=buf') == 1,
+          'WARNING: loop 1: 4 accesses per cycle to bank (0,) of buf ' + \
+          '(2 port(s)) limit the II to 2.' in log)
+
+    code, log = compile_kernel(pl_sum4, np.zeros(64, np.float32),
+                               np.zeros(16, np.float32))
+    print('array_partition' not in code,
+          'WARNING: loop 0: 4 accesses per cycle to bundle data0 ' + \
+          '(1 port(s)) limit the II to 4.' in log)
@@ -0,0 +1,70 @@
+import io
+import contextlib
+import numpy as np
+from pylog import *
+from config import WORKSPACE
+
+'''
+Automatic loop optimization (mode 'autoopt'): the innermost non-trivial
+loop of every loop nest is pipelined and the small loops below it are
+unrolled; loop nests the user pipelined or unrolled are left unchanged.
+'''
+
+
+@pylog(mode='cgen autoopt')
+def pl_nest(a, b, c):
+    for i in range(32):
+        for j in range(32):
+            s = 0.0
+            for k in range(4):
+                s += a[i][k] * b[k][j]
+            c[i][j] = s
+
+
+@pylog(mode='cgen autoopt')
+def pl_long(a, c):
+    # the inner loop is too long to unroll
+    for i in range(4):
+        for j in range(64):
+            c[i][j] = a[i][j] * 2.0
+
+
+@pylog(mode='cgen autoopt')
+def pl_user(a, c):
+    for i in range(32):
+        for j in range(4):
+            pragma("HLS PIPELINE")
+            for k in range(4):
+                c[i][j] = c[i][j] + a[i][k]
+
+
+def compile_kernel(kernel, *args):
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        kernel(*args)
+    name = kernel.__name__
+    with open(f'{WORKSPACE}/{name}/{name}.cpp') as f:
+        code = ' '.join(f.read().split())
+    return code, log.getvalue()
+
+
+if __name__ == "__main__":
+    code, log = compile_kernel(pl_nest, np.zeros((32, 4), np.float32),
+                               np.zeros((4, 32), np.float32),
+                               np.zeros((32, 32), np.float32))
+    print('loop 0.0.0 (k): unroll' in log, 'loop 0.0 (j): pipeline' in log,
+          'loop 0 (i)' not in log)
+    print('for (int j = 0; j < 32; j += 1) { #pragma HLS pipeline' in code,
+          'for (int k = 0; k < 4; k += 1) { #pragma HLS unroll' in code,
+          'for (int i = 0; i < 32; i += 1) { for' in code)
+
+    code, log = compile_kernel(pl_long, np.zeros((4, 64), np.float32),
+                               np.zeros((4, 64), np.float32))
+    print('loop 0.0 (j): pipeline' in log, 'unroll' not in code)
+
+    code, log = compile_kernel(pl_user, np.zeros((32, 4), np.float32),
+                               np.zeros((32, 4), np.float32))
+    print('loop 0 (i): unchanged (user directives)' in log,
+          code.count('#pragma HLS') == code.count('#pragma HLS INTERFACE') \
+                                       + 1,
+          'for (int j = 0; j < 4; j += 1) { #pragma HLS PIPELINE' in code)
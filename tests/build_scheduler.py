@@ -0,0 +1,70 @@
+import os
+import time
+import threading
+import numpy as np
+from pylog import *
+from scheduler import PLBuildScheduler
+
+'''
+Build scheduler: jobs run concurrently within the budget of cores, failed
+jobs are retried, cancelled jobs are stopped, and kernel builds go to a
+project per board and frequency.
+'''
+
+
+@pylog(mode='cgen')
+def pl_vecadd(a, b, c):
+    for i in range(1024):
+        c[i] = a[i] + b[i]
+
+
+if __name__ == "__main__":
+    scheduler = PLBuildScheduler(cores=2, memory=8)
+    lock = threading.Lock()
+    running = [0, 0]    # running now, most running at once
+
+    def sleep(job):
+        with lock:
+            running[0] += 1
+            running[1] = max(running[1], running[0])
+        job.run(f'sleep 0.5; echo {job.name}')
+        with lock:
+            running[0] -= 1
+
+    jobs = [ scheduler.submit(f'sleep{i}', sleep) for i in range(4) ]
+    start = time.time()
+    scheduler.wait()
+    elapsed = time.time() - start
+    print(all(job.status == 'done' for job in jobs), running[1] == 2,
+          1.0 <= elapsed < 2.0)
+    with open(jobs[0].log_file) as f:
+        print('sleep0' in f.read())
+
+    # fails once, then passes
+    def flaky(job):
+        job.run('exit 1' if job.attempts == 1 else 'true')
+
+    job = scheduler.submit('flaky', flaky, retries=1)
+    print(job.wait() == 'done', job.attempts == 2)
+
+    job = scheduler.submit('failing', lambda job: job.run('exit 3'))
+    print(job.wait() == 'failed', 'exited with 3' in job.error)
+
+    job = scheduler.submit('long', lambda job: job.run('sleep 60'))
+    time.sleep(0.5)
+    start = time.time()
+    scheduler.cancel(job)
+    print(job.wait(10) == 'cancelled', time.time() - start < 5)
+
+    # compilation only, into a project per board and frequency
+    a = np.zeros(1024, dtype=np.float32)
+    jobs = scheduler.add_sweep([(pl_vecadd, (a, a, a))],
+                               boards=['pynq-z2', 'ultra96'],
+                               freqs=(100.0, 150.0),
+                               run_hls=False, run_syn=False)
+    scheduler.wait()
+    print(all(job.status == 'done' for job in jobs),
+          len({ job.result['project_path'] for job in jobs }) == 4,
+          all(os.path.exists(f"{job.result['project_path']}/pl_vecadd.cpp") \
+              for job in jobs))
+    print(scheduler.summary())
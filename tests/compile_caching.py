@@ -0,0 +1,63 @@
+import io
+import sys
+import contextlib
+import subprocess
+import numpy as np
+from pylog import *
+from config import WORKSPACE
+from compile_cache import PYLOG_COMPILE_CACHE
+
+'''
+Compile cache of the @pylog wrapper: a repeated call, and a new process
+reading the cache on disk, get the same code without compiling; another
+argument shape or board compiles again.
+'''
+
+
+def kernel_for(board):
+    @pylog(mode='cgen', board=board)
+    def pl_scale(a, c):
+        c[:] = plmap(lambda x: x * 2.0, a)
+        return 0
+    return pl_scale
+
+
+def call(kernel, n):
+    '''Whether the call compiled, and the code in the project.'''
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        kernel(np.zeros(n, np.float32), np.zeros(n, np.float32))
+    with open(f'{WORKSPACE}/pl_scale/pl_scale.cpp') as f:
+        code = f.read()
+    return 'Compiling PyLog code' in log.getvalue(), code
+
+
+if __name__ == "__main__":
+    pl_scale = kernel_for('pynq-z2')
+
+    if sys.argv[1:] == ['child']:
+        compiled, code = call(pl_scale, 64)
+        print(compiled)
+        sys.stdout.write(code)
+        sys.exit()
+
+    PYLOG_COMPILE_CACHE.clear(WORKSPACE)
+    compiled, code = call(pl_scale, 64)
+    repeated, repeated_code = call(pl_scale, 64)
+    print(compiled, not repeated, repeated_code == code)
+
+    # a new process finds the entry on disk
+    child = subprocess.run([sys.executable, __file__, 'child'],
+                           capture_output=True, text=True).stdout
+    child_compiled, child_code = child.split('\n', 1)
+    print(child_compiled == 'False', child_code == code)
+
+    # another shape or board is another entry
+    other_shape, other_code = call(pl_scale, 32)
+    print(other_shape, 'float a[32]' in other_code)
+    other_board, _ = call(kernel_for('ultra96'), 64)
+    print(other_board)
+
+    # the first entry is still there, and its code is put back
+    again, again_code = call(pl_scale, 64)
+    print(not again, again_code == code)
@@ -0,0 +1,54 @@
+import io
+import contextlib
+import numpy as np
+from pylog import *
+from config import WORKSPACE
+
+'''
+DEPENDENCE pragmas from the loop dependence analysis: inserted into the
+loops pipelined in autoopt mode, and checked against those of the user.
+'''
+
+
+@pylog(mode='cgen autoopt')
+def pl_deps(a, out):
+    b = np.empty([64], np.float32)
+    c = np.empty([64], np.float32)
+    for i in range(64):
+        b[i] = a[i]
+        c[i] = a[i]
+    for i in range(2, 64):
+        b[i] = b[i - 2] + 1.0
+    for i in range(64):
+        c[i] = c[i] * 2.0
+    for i in range(64):
+        out[i] = b[i] + c[i]
+
+
+@pylog(mode='cgen')
+def pl_wrong(a, out):
+    for i in range(1, 64):
+        pragma("HLS DEPENDENCE variable=a inter false")
+        a[i] = a[i - 1] + 1.0
+    for i in range(64):
+        out[i] = a[i]
+
+
+if __name__ == "__main__":
+    a = np.zeros(64, dtype=np.float32)
+    out = np.zeros(64, dtype=np.float32)
+
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        pl_deps(a, out)
+    with open(f'{WORKSPACE}/pl_deps/pl_deps.cpp') as f:
+        code = f.read()
+    print('HLS DEPENDENCE variable=b inter RAW distance=2 true' in code,
+          'HLS DEPENDENCE variable=c inter false' in code)
+
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        pl_wrong(a, out)
+    print("WARNING: pragma 'HLS DEPENDENCE variable=a inter false' is " + \
+          "wrong: loop 0 (i) has a loop-carried RAW dependence on a " + \
+          "with distance 1." in log.getvalue())
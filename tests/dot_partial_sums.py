@@ -0,0 +1,77 @@
+import numpy as np
+from pylog import *
+from config import WORKSPACE
+
+'''
+dot() of floats accumulates into K partial sums (K = 4 for float adders at
+100 MHz) added up by an adder tree. Shapes with a multiple of K products
+are strip-mined into a pipelined loop over chunks of K; others use a
+modulo index and a DEPENDENCE pragma, unless a loop around the dot is
+pipelined or unrolled.
+'''
+
+
+@pylog(mode='cgen')
+def pl_dots(a, b, c):
+    c[0] = dot(a, b)
+    c[1] = dot(a[0:3, 0:3], b[0:3, 0:3])
+    return 0
+
+
+@pylog(mode='cgen')
+def pl_dots_pipelined(a, b, c):
+    for i in range(2).pipeline():
+        c[i] = dot(a[0:2, 0:16], b[0:2, 0:16])
+        c[i + 2] = dot(a[0:3, 0:3], b[0:3, 0:3])
+    return 0
+
+
+@pylog(mode='swemu')
+def pl_dots_swemu(a, b, c):
+    c[0] = dot(a, b)
+    c[1] = dot(a[0:3, 0:3], b[0:3, 0:3])
+    c[2] = dot(a[0:5, 0:7], b[0:5, 0:7])
+    return 0
+
+
+def code(name):
+    with open(f'{WORKSPACE}/{name}/{name}.cpp') as f:
+        return ' '.join(f.read().split())
+
+
+if __name__ == "__main__":
+    a = np.random.rand(8, 16).astype(np.float32)
+    b = np.random.rand(8, 16).astype(np.float32)
+    c = np.zeros(8, dtype=np.float32)
+
+    pl_dots(a, b, c)
+    cpp = code('pl_dots')
+    # strip-mined: a constant partial sum in each unrolled copy
+    print('#pragma HLS array_partition variable=tmp_dot_acc_0 complete ' + \
+          'dim=1' in cpp,
+          'for (int i_dot_chunk = 0; i_dot_chunk < 16; ' + \
+          'i_dot_chunk += 4) { #pragma HLS pipeline for (int i_acc = 0; ' + \
+          'i_acc < 4; i_acc += 1) { #pragma HLS unroll ' + \
+          'tmp_dot_acc_0[i_acc] +=' in cpp)
+    # adder tree
+    print('tmp_dot_acc_0[i_acc] = tmp_dot_acc_0[i_acc] + ' + \
+          'tmp_dot_acc_0[i_acc + 2];' in cpp,
+          'tmp_dot_acc_0[i_acc] = tmp_dot_acc_0[i_acc] + ' + \
+          'tmp_dot_acc_0[i_acc + 1];' in cpp,
+          'c[0] = tmp_dot_acc_0[0];' in cpp)
+    # 9 products: modulo index
+    print('#pragma HLS DEPENDENCE variable=tmp_dot_acc_1 inter ' + \
+          'distance=4 true tmp_dot_acc_1[((i_dot_0 * 3) + i_dot_1) % 4] +=' \
+          in cpp)
+
+    pl_dots_pipelined(a, b, c)
+    cpp = code('pl_dots_pipelined')
+    print('i_dot_chunk' in cpp, cpp.count('#pragma HLS pipeline') == 1,
+          'DEPENDENCE' not in cpp)
+
+    c = np.zeros(8, dtype=np.float32)
+    pl_dots_swemu(a, b, c)
+    print(np.allclose(c[:3], [np.sum(a * b),
+                              np.sum(a[0:3, 0:3] * b[0:3, 0:3]),
+                              np.sum(a[0:5, 0:7] * b[0:5, 0:7])],
+                      rtol=1e-5))
@@ -0,0 +1,84 @@
+import inspect
+import textwrap
+import numpy as np
+from pylog import *
+from pylog import pylog_arg_info, pylog_estimate
+from matmul import pl_matmul
+
+'''
+Analytical estimates (mode 'estimate'): loop trip counts and initiation
+intervals, and the effect of pipelining and partitioning on them.
+'''
+
+
+@pylog(mode='estimate')
+def pl_matmul_seq(a, b, c):
+    for i in range(32):
+        for j in range(32):
+            tmp = 0.0
+            for k in range(32):
+                tmp += a[i][k] * b[k][j]
+            c[i][j] = tmp
+
+
+@pylog(mode='estimate')
+def pl_matmul_pipe(a, b, c):
+    for i in range(32):
+        for j in range(32):
+            tmp = 0.0
+            for k in range(32).pipeline():
+                tmp += a[i][k] * b[k][j]
+            c[i][j] = tmp
+
+
+@pylog(mode='estimate')
+def pl_reduce(a, b):
+    buf = np.empty([64], float)
+    for i in range(64):
+        buf[i] = a[i]
+    for i in range(16).pipeline():
+        s = 0.0
+        for k in range(4):
+            s = s + buf[i * 4 + k]
+        b[i] = s
+
+
+@pylog(mode='estimate')
+def pl_reduce_part(a, b):
+    buf = np.empty([64], float)
+    pragma("HLS array_partition variable=buf cyclic factor=4 dim=1")
+    for i in range(64):
+        buf[i] = a[i]
+    for i in range(16).pipeline():
+        s = 0.0
+        for k in range(4):
+            s = s + buf[i * 4 + k]
+        b[i] = s
+
+
+if __name__ == "__main__":
+    # the kernel of tests/matmul.py
+    func = inspect.unwrap(pl_matmul)
+    src = textwrap.dedent(inspect.getsource(func))
+    a = np.zeros((1024, 64), pl_fixed(256, 256))
+    arg_info = pylog_arg_info((a, a, a), inspect.getfullargspec(func).args)
+    report = pylog_estimate(src, arg_info, 'vhls', 'pynq-z2', 100.0)
+    loops = report['loops']
+    print([ l['trip_count'] for l in loops ] == \
+          [64, 128, 128, 16, 128, 1024, 16, 128, 4, 8])
+    print([ l['pipelined'] for l in loops ] == \
+          [True, False, True, True, True, False, True, False, False, False])
+    print(all(l['latency'] >= (l['trip_count'] - 1) * l['ii'] + l['depth'] \
+              for l in loops if l['pipelined']))
+    print(report['latency'] > loops[-1]['latency'] >= 8 * 4 * 1024 * 128)
+
+    a = np.zeros((32, 32), dtype=np.float32)
+    seq = pl_matmul_seq(a, a, a)
+    pipe = pl_matmul_pipe(a, a, a)
+    print(pipe['latency'] < seq['latency'])
+
+    # four reads per cycle from a BRAM with two ports, or from four banks
+    a = np.zeros(64, dtype=np.float32)
+    b = np.zeros(16, dtype=np.float32)
+    print(pl_reduce(a, b)['loops'][-1]['ii'] == 2,
+          pl_reduce_part(a, b)['loops'][-1]['ii'] == 1)
@@ -0,0 +1,46 @@
+import inspect
+import json
+import textwrap
+import numpy as np
+from pylog import *
+from pylog import pylog_arg_info, pylog_dse, pylog_estimate
+from config import WORKSPACE
+from matmul import pl_matmul
+
+'''
+Design-space exploration (mode 'dse') of the kernel of tests/matmul.py:
+the Pareto front, and the chosen design applied with design=...
+'''
+
+
+def dominates(p, q):
+    keys = ('DSP', 'BRAM', 'LUT')
+    a = (p['latency'],) + tuple(p['resources'][k] for k in keys)
+    b = (q['latency'],) + tuple(q['resources'][k] for k in keys)
+    return a != b and all(x <= y for x, y in zip(a, b))
+
+
+if __name__ == "__main__":
+    func = inspect.unwrap(pl_matmul)
+    src = textwrap.dedent(inspect.getsource(func))
+    a = np.zeros((1024, 64), pl_fixed(256, 256))
+    arg_info = pylog_arg_info((a, a, a), inspect.getfullargspec(func).args)
+    board = 'alveo_u200'
+
+    result = pylog_dse(src, arg_info, 'vhls', board, 100.0, WORKSPACE)
+    front = result['pareto']
+    print(len(front) > 0,
+          [ p['latency'] for p in front ] == \
+          sorted(p['latency'] for p in front),
+          not any(dominates(p, q) for p in front for q in front))
+
+    # the chosen design is the fastest point, and is estimated alike when
+    # compiling with it
+    default = pylog_estimate(src, arg_info, 'vhls', board, 100.0)
+    chosen = pylog_estimate(src, arg_info, 'vhls', board, 100.0,
+                            design=result['design'])
+    print(result['design'] == front[0]['design'],
+          chosen['latency'] == front[0]['latency'] <= default['latency'])
+
+    with open(f'{WORKSPACE}/pl_matmul/pl_matmul_design.json') as f:
+        print(json.load(f)['design'] == result['design'])
@@ -0,0 +1,73 @@
+import numpy as np
+from pylog import *
+from config import WORKSPACE
+
+'''
+Fusion of consecutive plmaps in mode 'autoopt', checked against NumPy with
+software emulation. The number of loop nests in the generated code tells
+whether the maps were fused.
+'''
+
+
+@pylog(mode='swemu autoopt')
+def pl_fused(a, b, c):
+    # fused, t becomes a scalar
+    t = plmap(lambda x, y: x * y, a, b)
+    c[:, :] = plmap(lambda x: x + 1.0, t)
+    return 0
+
+
+@pylog(mode='swemu')
+def pl_unfused(a, b, c):
+    # fusion is left to mode 'autoopt'
+    t = plmap(lambda x, y: x * y, a, b)
+    c[:, :] = plmap(lambda x: x + 1.0, t)
+    return 0
+
+
+@pylog(mode='swemu autoopt')
+def pl_shifted(a, b, c):
+    # the second map reads t at neighbouring elements: not fused
+    t = plmap(lambda x: x * 2.0, a)
+    c[1:15, 1:7] = plmap(lambda x: x[-1, 0] + x[1, 0], t[1:15, 1:7])
+    return 0
+
+
+@pylog(mode='swemu autoopt')
+def pl_war(a, b, c):
+    # the second map overwrites b before the first one reads it: not fused
+    c[1:15, :] = plmap(lambda x: x[-1, 0] + x[1, 0], b[1:15, :])
+    b[1:15, :] = plmap(lambda x: x * 2.0, a[1:15, :])
+    return 0
+
+
+def loop_nests(name):
+    with open(f'{WORKSPACE}/{name}/{name}.cpp') as f:
+        return f.read().count('for (int i_map_0 ')
+
+
+if __name__ == "__main__":
+    a = np.random.rand(16, 8).astype(np.float32)
+    b = np.random.rand(16, 8).astype(np.float32)
+    c = np.zeros((16, 8), dtype=np.float32)
+    pl_fused(a, b, c)
+    print(np.allclose(c, a * b + 1.0), loop_nests('pl_fused') == 1)
+
+    c = np.zeros((16, 8), dtype=np.float32)
+    pl_unfused(a, b, c)
+    print(np.allclose(c, a * b + 1.0), loop_nests('pl_unfused') == 2)
+
+    c = np.zeros((16, 8), dtype=np.float32)
+    golden = c.copy()
+    golden[1:15, 1:7] = 2.0 * a[0:14, 1:7] + 2.0 * a[2:16, 1:7]
+    pl_shifted(a, b, c)
+    print(np.allclose(c, golden), loop_nests('pl_shifted') == 2)
+
+    c = np.zeros((16, 8), dtype=np.float32)
+    golden_c = c.copy()
+    golden_c[1:15, :] = b[0:14, :] + b[2:16, :]
+    golden_b = b.copy()
+    golden_b[1:15, :] = a[1:15, :] * 2.0
+    pl_war(a, b, c)
+    print(np.allclose(c, golden_c), np.allclose(b, golden_b),
+          loop_nests('pl_war') == 2)
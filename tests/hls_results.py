@@ -0,0 +1,100 @@
+import os
+import tempfile
+from utils import parse_hls_report
+from results_db import PLResultsDB, results_report
+
+'''
+HLS results database: a csynth report is parsed, recorded and queried,
+and a slower run of the same kernel is reported as a regression.
+'''
+
+REPORT = '''<?xml version="1.0" encoding="UTF-8"?>
+<profile>
+  <ReportVersion><Version>2020.2</Version></ReportVersion>
+  <UserAssignments>
+    <unit>ns</unit>
+    <Part>xc7z020-clg400-1</Part>
+    <TopModelName>top</TopModelName>
+    <TargetClockPeriod>10.00</TargetClockPeriod>
+    <ClockUncertainty>2.70</ClockUncertainty>
+  </UserAssignments>
+  <PerformanceEstimates>
+    <SummaryOfTimingAnalysis>
+      <unit>ns</unit>
+      <EstimatedClockPeriod>{period}</EstimatedClockPeriod>
+    </SummaryOfTimingAnalysis>
+    <SummaryOfOverallLatency>
+      <Best-caseLatency>{latency}</Best-caseLatency>
+      <Worst-caseLatency>{latency}</Worst-caseLatency>
+      <Interval-min>{interval}</Interval-min>
+      <Interval-max>{interval}</Interval-max>
+    </SummaryOfOverallLatency>
+    <SummaryOfLoopLatency>
+      <i_for>
+        <TripCount>64</TripCount>
+        <Latency>37888</Latency>
+        <IterationLatency>592</IterationLatency>
+        <j_for>
+          <TripCount><range><min>1</min><max>582</max></range></TripCount>
+          <Latency>590</Latency>
+          <IterationLatency>10</IterationLatency>
+          <PipelineII>1</PipelineII>
+          <PipelineDepth>10</PipelineDepth>
+        </j_for>
+      </i_for>
+    </SummaryOfLoopLatency>
+  </PerformanceEstimates>
+  <AreaEstimates>
+    <Resources>
+      <BRAM_18K>4</BRAM_18K>
+      <DSP48E>5</DSP48E>
+      <FF>2104</FF>
+      <LUT>3127</LUT>
+      <URAM>0</URAM>
+    </Resources>
+  </AreaEstimates>
+</profile>
+'''
+
+
+def hls_run(report_dir, latency, period=7.268):
+    with open(f'{report_dir}/top_csynth.xml', 'w') as fout:
+        fout.write(REPORT.format(latency=latency, interval=latency + 1,
+                                 period=period))
+    return parse_hls_report(report_dir, 'top')
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp:
+        record = hls_run(tmp, 37892)
+        print(record['top'] == 'top', record['latency'] == 37892,
+              record['interval'] == 37893,
+              record['resources']['DSP'] == 5,
+              record['timing']['slack'] == 0.032)
+        print([ (l['path'], l['trip_count'], l['ii'], l['pipelined']) \
+                for l in record['loops'] ] == \
+              [('i_for', 64, None, False), ('i_for/j_for', 582, 1, True)])
+
+        db = PLResultsDB(f'{tmp}/results.db')
+        first = db.record('key1', record, board='pynq-z2', freq=100.0,
+                          commit_id='a')
+        print(db.latest('key1')['latency'] == 37892,
+              db.latest('key1')['record'] == record,
+              [ l['path'] for l in db.loops(first) ] == \
+              ['i_for', 'i_for/j_for'])
+        print(db.regressions() == [])
+
+        # a faster run is no regression
+        db.record('key2', hls_run(tmp, 30000), board='pynq-z2', freq=100.0,
+                  commit_id='b')
+        print(db.regressions() == [])
+
+        # 20% slower and missing timing
+        db.record('key3', hls_run(tmp, 36000, period=7.5), board='pynq-z2',
+                  freq=100.0, commit_id='c')
+        print([ r['latency'] for r in db.history('top') ] == \
+              [37892, 30000, 36000])
+        print([ (previous['commit_id'], latest['commit_id'], worse) \
+                for previous, latest, worse in db.regressions() ] == \
+              [('b', 'c', ['latency', 'slack'])])
+        print(results_report(db.history('top', board='pynq-z2')))
@@ -0,0 +1,37 @@
+import numpy as np
+from pylog import *
+
+'''
+Software emulation of maps that read the array they write: iterations
+depend on each other, so the emulated loops must run in order.
+'''
+
+
+@pylog(mode='swemu')
+def pl_inplace_map(a):
+    a[1:4095, 0:1] = plmap(lambda x: x[-1, 0] + 1.0, a[1:4095, 0:1])
+    return 0
+
+
+@pylog(mode='swemu')
+def pl_map(a, b):
+    b[1:4095, 0:1] = plmap(lambda x: x[-1, 0] + 1.0, a[1:4095, 0:1])
+    return 0
+
+
+if __name__ == "__main__":
+    a = np.random.rand(4096, 2).astype(np.float32)
+    golden = a.copy()
+    for i in range(1, 4095):
+        golden[i, 0] = golden[i - 1, 0] + 1.0
+
+    pl_inplace_map(a)
+    print(np.allclose(a, golden))
+
+    a = np.random.rand(4096, 2).astype(np.float32)
+    b = np.zeros((4096, 2), dtype=np.float32)
+    golden = b.copy()
+    golden[1:4095, 0] = a[0:4094, 0] + 1.0
+
+    pl_map(a, b)
+    print(np.allclose(b, golden))
@@ -0,0 +1,60 @@
+import textwrap
+from pylog import pylog_compile
+from config import WORKSPACE
+from profiler import PLProfiler
+from compile_cache import PLCompileCache, PLIRCache, ir_key
+from codegen import PLCodeGenerator
+
+'''
+IR cache between the passes: a new PLIRCache reads the IR that another one
+stored on disk, so that compiling the kernel again runs only the code
+generator, and the restored IR generates the same code.
+'''
+
+src = textwrap.dedent('''
+    @pylog(mode='cgen')
+    def pl_ir_cached(a, b, c):
+        for i in range(32):
+            s = 0.0
+            for j in range(16):
+                s += a[i][j] * b[j]
+            c[i] = s
+        return 0
+''')
+
+arg_info = { 'a': ('float32', (32, 16)),
+             'b': ('float32', (16,)),
+             'c': ('float32', (32,)) }
+
+
+def compile_passes(ir_cache, board='pynq-z2'):
+    '''The generated code, and the passes that ran.'''
+    profiler = PLProfiler(memory=False)
+    hls_c = pylog_compile(src, arg_info, 'vhls', board, WORKSPACE,
+                          profiler=profiler, ir_cache=ir_cache)[-1]
+    return hls_c, [ r['name'] for r in profiler.results() ]
+
+
+if __name__ == "__main__":
+    key = ir_key(src, arg_info, 'optimized', 'vhls', None, 100.0)
+    # start without entries on disk (shared with the compile cache)
+    PLCompileCache().clear(WORKSPACE)
+
+    hls_c, passes = compile_passes(PLIRCache())
+    print('optimizer' in passes, 'codegen' in passes)
+
+    # a new cache, as in a new process, loads the IR from disk
+    cached_c, cached_passes = compile_passes(PLIRCache())
+    print(cached_passes == ['codegen'], cached_c == hls_c)
+
+    # the restored IR generates the same code
+    top_func, pylog_ir = PLIRCache().lookup(key, WORKSPACE)
+    codegen = PLCodeGenerator(arg_info, backend='vhls', board='pynq-z2')
+    print(top_func == 'pl_ir_cached',
+          codegen.codegen(pylog_ir, f'{WORKSPACE}/{top_func}') == hls_c)
+
+    # another board reuses the IR, another shape does not
+    _, board_passes = compile_passes(PLIRCache(), board='ultra96')
+    arg_info['a'] = ('float32', (64, 16))
+    _, shape_passes = compile_passes(PLIRCache())
+    print(board_passes == ['codegen'], 'optimizer' in shape_passes)
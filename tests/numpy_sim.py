@@ -0,0 +1,73 @@
+import numpy as np
+from pylog import *
+
+'''
+NumPy simulation of the typed PyLog IR (mode 'npsim'), checked against
+NumPy.
+'''
+
+
+@pylog(mode='npsim')
+def pl_stencil(a, b):
+    b[1:15, 1:15] = plmap(lambda x: x[-1, 0] + 2.0 * x[0, 0] - x[0, 1] \
+                                    if x[0, 0] > 0.5 else x[0, 0] + x[1, 1],
+                          a[1:15, 1:15])
+
+
+@pylog(mode='npsim')
+def pl_conv(c, w, data):
+    for i in range(4):
+        c[i, :, :] = plmap(lambda x: dot(x[0:4, -1:2, -1:2], w[i, :, :, :]),
+                           data[0, 1:23, 1:35])
+
+
+@pylog(mode='npsim')
+def pl_idiv(a, b):
+    for i in range(16):
+        b[i] = a[i] / 3 + a[i] % 3
+
+
+@pylog(mode='npsim')
+def pl_sum(a, b):
+    def sq(v):
+        return v * v + 1.0
+    b = plmap(lambda x: sq(x), a)
+    s = 0.0
+    for i in range(8):
+        if a[i] > 0.5:
+            s += a[i]
+    return s
+
+
+if __name__ == "__main__":
+    a = np.random.rand(16, 16).astype(np.float32)
+    b = np.zeros((16, 16), dtype=np.float32)
+    x = a[1:15, 1:15]
+    golden = b.copy()
+    golden[1:15, 1:15] = np.where(x > 0.5,
+                                  a[0:14, 1:15] + 2.0 * x - a[1:15, 2:16],
+                                  x + a[2:16, 2:16])
+    pl_stencil(a, b)
+    print(np.allclose(b, golden))
+
+    data = np.random.rand(4, 24, 36).astype(np.float32)
+    w = np.random.rand(4, 4, 3, 3).astype(np.float32)
+    c = np.zeros((4, 22, 34), dtype=np.float32)
+    golden = np.zeros_like(c)
+    for i in range(4):
+        for y in range(22):
+            for x in range(34):
+                golden[i, y, x] = np.sum(data[0:4, y:y + 3, x:x + 3] * w[i])
+    pl_conv(c, w, data)
+    print(np.allclose(c, golden, rtol=1e-4))
+
+    # integer division and modulo follow C
+    a = np.arange(-8, 8, dtype=np.int32)
+    b = np.zeros(16, dtype=np.int32)
+    pl_idiv(a, b)
+    print(np.array_equal(b, np.fix(a / 3).astype(np.int32) + np.fmod(a, 3)))
+
+    a = np.random.rand(8).astype(np.float32)
+    b = np.zeros(8, dtype=np.float32)
+    s = pl_sum(a, b)
+    print(np.allclose(b, a * a + 1.0), np.isclose(s, a[a > 0.5].sum()))
@@ -0,0 +1,69 @@
+import json
+import textwrap
+import tracemalloc
+from pylog import pylog_compile
+from config import WORKSPACE
+from profiler import PLProfiler
+
+'''
+Pass profiling of pylog_compile: the records of each pass, the report and
+the Chrome trace, and the peak memory of a caller tracing memory itself.
+'''
+
+src = textwrap.dedent('''
+    @pylog(mode='cgen')
+    def pl_profiled(a, c):
+        for i in range(32):
+            s = 0.0
+            for j in range(16):
+                s += a[i][j]
+            c[i] = s
+        return 0
+''')
+
+arg_info = { 'a': ('float32', (32, 16)),
+             'c': ('float32', (32,)) }
+
+passes = ['parse', 'ast_link_parent', 'analyzer', 'plnode_link_parent', 'typer',
+          'optimizer', 'chaining_rewriter', 'codegen']
+
+
+if __name__ == "__main__":
+    profiler = PLProfiler()
+    pylog_compile(src, arg_info, 'vhls', 'pynq-z2', WORKSPACE,
+                  profiler=profiler)
+    results = profiler.results()
+    print([ r['name'] for r in results ] == passes)
+    # the analyzer turns the Python AST into fewer PyLog IR nodes; the
+    # IR passes count the IR
+    analyzer = results[2]
+    print(results[0]['nodes_after'] == analyzer['nodes_before'] > \
+          analyzer['nodes_after'] > 0,
+          all(r['nodes_before'] == analyzer['nodes_after'] \
+              for r in results[3:5]),
+          all(r['wall_time'] >= 0 and r['peak_memory'] >= 0 \
+              for r in results))
+
+    report = profiler.report().split('\n')
+    print(len(report) == len(passes) + 2,
+          [ line.split()[0] for line in report[1:-1] ] == passes,
+          report[-1].startswith('total'))
+
+    trace_file = f'{WORKSPACE}/pl_profiled/pl_profiled_trace.json'
+    profiler.chrome_trace(trace_file)
+    with open(trace_file) as f:
+        events = json.load(f)['traceEvents']
+    print([ e['name'] for e in events ] == passes,
+          all(e['ph'] == 'X' and e['dur'] >= 0 for e in events),
+          [ e['args']['nodes_after'] for e in events ] == \
+          [ r['nodes_after'] for r in results ])
+
+    # the peak of a caller that traces memory survives the profiler
+    tracemalloc.start()
+    block = bytearray(64 * 1024 * 1024)
+    del block
+    peak = tracemalloc.get_traced_memory()[1]
+    pylog_compile(src, arg_info, 'vhls', 'pynq-z2', WORKSPACE,
+                  profiler=PLProfiler())
+    print(tracemalloc.get_traced_memory()[1] >= peak)
+    tracemalloc.stop()
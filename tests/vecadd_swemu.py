@@ -0,0 +1,58 @@
+import numpy as np
+from pylog import *
+
+'''
+Software emulation: the generated HLS C code is compiled with g++ and run 
+on the host, so results can be checked without an FPGA board. 
+'''
+
+
+@pylog(mode='swemu')
+def pl_vecadd(a, b, c):
+    c = plmap(lambda x, y: x + y, a, b)
+    return 0
+
+
+@pylog(mode='swemu')
+def pl_matmul(a, b, c):
+    for i in range(32):
+        for j in range(32):
+            tmp = 0.0
+            for k in range(32).pipeline():
+                tmp += a[i][k] * b[k][j]
+            c[i][j] = tmp
+
+
+@pylog(mode='swemu')
+def pl_axpb(a, s, n, c):
+    for i in range(1024):
+        c[i] = a[i] * s + n
+    return 0
+
+
+if __name__ == "__main__":
+    length = 1024
+    a = np.random.rand(length).astype(np.float32)
+    b = np.random.rand(length).astype(np.float32)
+    c = np.zeros(length, dtype=np.float32)
+
+    pl_vecadd(a, b, c)
+    print(np.allclose(c, a + b))
+
+    a = np.random.rand(32, 32).astype(np.float32)
+    b = np.random.rand(32, 32).astype(np.float32)
+    c = np.zeros((32, 32), dtype=np.float32)
+
+    pl_matmul(a, b, c)
+    print(np.allclose(c, a @ b, rtol=1e-4))
+
+    # scalar arguments: NumPy scalars and one-element arrays
+    a = np.random.rand(length).astype(np.float32)
+    c = np.zeros(length, dtype=np.float32)
+    pl_axpb(a, np.float32(2.5), np.int32(3), c)
+    print(np.allclose(c, a * 2.5 + 3))
+
+    c = np.zeros(length, dtype=np.float32)
+    pl_axpb(a, np.array([2.5], dtype=np.float32),
+            np.array([3], dtype=np.int32), c)
+    print(np.allclose(c, a * 2.5 + 3))
@@ -1,25 +1,27 @@
 import re
-import copy
 
 from utils import *
 from nodes import *
 import IPinforms
+from visitors import PLVisitor
 
 
-class PLTyper:
+class PLTyper(PLVisitor):
     def __init__(self, args_info, debug=False):
         self.args_info = args_info
         self.debug = debug
 
-    def visit(self, node, ctx={}, is_statement=False):
+    def visit(self, node, ctx=None, is_statement=False):
         """Visit a node."""
 
+        if ctx is None:
+            ctx = PLScope()
+
         if self.debug:
             print(f'Visiting {node.__class__.__name__}, {node}')
 
-        method = 'visit_' + node.__class__.__name__
-        visitor = getattr(self, method, self.generic_visit)
-        visit_return = visitor(node, ctx)
+        visitor = self.dispatch(node)
+        visit_return = visitor(self, node, ctx)
 
         return visit_return
 
@@ -42,7 +44,7 @@ class PLTyper:
         node.pl_shape = ()
         ctx[node.name] = (node.pl_type, node.pl_shape, node)
 
-        local_ctx = copy.copy(ctx)
+        local_ctx = ctx.push()
 
         if node.pl_top:
             # breakpoint()
@@ -629,6 +631,7 @@ class PLTyper:
                                   obj=node)
 
                 replace_child(node.parent, node, range_fn)
+                link_children(range_fn)
                 node = range_fn
 
                 # not dealing with chaining propagation here
@@ -684,7 +687,7 @@ class PLTyper:
         node.pl_shape = ()
 
         if all(hasattr(arg, 'pl_type') for arg in node.args):
-            local_ctx = copy.copy(ctx)
+            local_ctx = ctx.push()
             for arg in node.args:
                 arg.lambda_node = node
 
@@ -1,3 +1,4 @@
+import os
 import re
 
 #pytypes = {"None": None, "bool": bool, "int": int, "float": float, "str": str}
@@ -21,3 +22,232 @@ def np_pl_type_map(type_name):
         if type_name.startswith(pltype):
             return pltype
     return type_name
+
+
+def using_xrt(board):
+    '''Alveo and AWS F1 boards are driven through XRT, others are SoCs.'''
+    return board == 'aws_f1' or board.startswith('alveo')
+
+
+def parse_csynth_report(report_file):
+    '''Worst-case latency, interval and resource totals from a Vivado/Vitis
+       HLS {top}_csynth.rpt, as a dict with keys latency, interval, BRAM,
+       DSP, FF, LUT and URAM (missing values are None).'''
+    with open(report_file) as fin:
+        lines = fin.readlines()
+
+    def cells(line):
+        return [ c.strip() for c in line.strip().strip('|').split('|') ]
+
+    result = {'latency': None, 'interval': None, 'BRAM': None, 'DSP': None,
+              'FF': None, 'LUT': None, 'URAM': None}
+
+    for i in range(len(lines)):
+        line = lines[i].strip()
+        if line.startswith('+ Latency') and result['latency'] is None:
+            # first table row starting with a number: latency min | max |
+            # (absolute min | max |) interval min | max | pipeline type
+            for row in lines[i+1:i+12]:
+                values = cells(row)
+                if row.strip().startswith('|') and values[0].isdigit():
+                    numbers = [ v for v in values if v.isdigit() ]
+                    result['latency'] = int(numbers[1])
+                    result['interval'] = int(numbers[-1])
+                    break
+        if line == '== Utilization Estimates':
+            header = None
+            for row in lines[i+1:i+30]:
+                values = cells(row)
+                if values[0] == 'Name':
+                    header = values
+                elif values[0] == 'Total' and header is not None:
+                    for name, value in zip(header[1:], values[1:]):
+                        key = 'BRAM' if name.startswith('BRAM') else \
+                              'DSP' if name.startswith('DSP') else name
+                        if key in result and value.isdigit():
+                            result[key] = int(value)
+                    break
+    return result
+
+
+def parse_hls_report(report_dir, top_name):
+    '''Structured record of an HLS run from {top}_csynth.xml in report_dir
+       (solution1/syn/report), or from {top}_csynth.rpt when there is no XML
+       report: clock target, estimate, uncertainty and slack (ns), latency
+       and interval, resources, and a list of loops with path (nested loop
+       names joined by '/'), trip_count, latency, iteration_latency, ii and
+       pipelined. Returns None if neither report exists.'''
+    xml_file = f'{report_dir}/{top_name}_csynth.xml'
+    rpt_file = f'{report_dir}/{top_name}_csynth.rpt'
+    if os.path.exists(xml_file):
+        record = parse_csynth_xml(xml_file)
+    elif os.path.exists(rpt_file):
+        record = parse_csynth_rpt(rpt_file)
+    else:
+        return None
+
+    timing = record['timing']
+    if None not in (timing['target'], timing['estimated']):
+        timing['slack'] = round(timing['target'] - \
+                                (timing['uncertainty'] or 0.0) - \
+                                timing['estimated'], 3)
+    return record
+
+
+def empty_hls_record():
+    return {
+        'top': None,
+        'part': None,
+        'version': None,
+        'timing': {'target': None, 'estimated': None, 'uncertainty': None,
+                   'slack': None},
+        'latency': None,
+        'latency_min': None,
+        'interval': None,
+        'resources': {'BRAM': None, 'DSP': None, 'FF': None, 'LUT': None,
+                      'URAM': None},
+        'loops': []
+    }
+
+
+def report_number(text):
+    '''int or float in a report field; the upper end of a range (min ~ max,
+       or <range><max>); None for undef, '-' and the like.'''
+    if text is None:
+        return None
+    text = text.strip().split('~')[-1].split()[0] if text.strip() else ''
+    try:
+        return int(text)
+    except ValueError:
+        try:
+            return float(text)
+        except ValueError:
+            return None
+
+
+def parse_csynth_xml(xml_file):
+    import xml.etree.ElementTree as ET
+
+    root = ET.parse(xml_file).getroot()
+    record = empty_hls_record()
+
+    def value(node, tag):
+        elem = node.find(tag) if node is not None else None
+        if elem is None:
+            return None
+        if elem.find('range/max') is not None:
+            return report_number(elem.find('range/max').text)
+        return report_number(elem.text)
+
+    def text(path):
+        elem = root.find(path)
+        return elem.text.strip() if elem is not None and elem.text else None
+
+    record['top'] = text('UserAssignments/TopModelName')
+    record['part'] = text('UserAssignments/Part')
+    record['version'] = text('ReportVersion/Version')
+    record['timing']['target'] = value(root.find('UserAssignments'),
+                                       'TargetClockPeriod')
+    record['timing']['uncertainty'] = value(root.find('UserAssignments'),
+                                            'ClockUncertainty')
+
+    perf = root.find('PerformanceEstimates')
+    record['timing']['estimated'] = value(
+        perf.find('SummaryOfTimingAnalysis') if perf is not None else None,
+        'EstimatedClockPeriod')
+    overall = perf.find('SummaryOfOverallLatency') \
+              if perf is not None else None
+    record['latency'] = value(overall, 'Worst-caseLatency')
+    record['latency_min'] = value(overall, 'Best-caseLatency')
+    record['interval'] = value(overall, 'Interval-max')
+
+    def loops(node, prefix):
+        for loop in node:
+            # loops are the children with a trip count, the rest are fields
+            if loop.find('TripCount') is None:
+                continue
+            path = f'{prefix}/{loop.tag}' if prefix else loop.tag
+            ii = value(loop, 'PipelineII')
+            record['loops'].append({
+                'name': loop.tag,
+                'path': path,
+                'trip_count': value(loop, 'TripCount'),
+                'latency': value(loop, 'Latency'),
+                'iteration_latency': value(loop, 'IterationLatency'),
+                'ii': ii,
+                'pipelined': ii is not None
+            })
+            loops(loop, path)
+
+    summary = perf.find('SummaryOfLoopLatency') if perf is not None else None
+    if summary is not None:
+        loops(summary, '')
+
+    resources = root.find('AreaEstimates/Resources')
+    if resources is not None:
+        for elem in resources:
+            key = 'BRAM' if elem.tag.startswith('BRAM') else \
+                  'DSP' if elem.tag.startswith('DSP') else elem.tag
+            if key in record['resources']:
+                record['resources'][key] = report_number(elem.text)
+    return record
+
+
+def parse_csynth_rpt(rpt_file):
+    record = empty_hls_record()
+    summary = parse_csynth_report(rpt_file)
+    record['latency'] = summary['latency']
+    record['interval'] = summary['interval']
+    for key in record['resources']:
+        record['resources'][key] = summary[key]
+
+    with open(rpt_file) as fin:
+        lines = fin.readlines()
+
+    def cells(line):
+        return [ c.strip() for c in line.strip().strip('|').split('|') ]
+
+    def ns(text):
+        return report_number(text.replace('ns', ''))
+
+    for i in range(len(lines)):
+        line = lines[i].strip()
+        m = re.match(r"== (Vivado|Vitis) HLS Report for '(\w+)'", line)
+        if m:
+            record['top'] = m.group(2)
+        elif line.startswith('* Target device:'):
+            record['part'] = line.split(':', 1)[1].strip()
+        elif line.startswith('* Version:'):
+            record['version'] = line.split(':', 1)[1].split()[0]
+        elif line.startswith('|ap_clk') and \
+             record['timing']['target'] is None:
+            values = cells(line)
+            record['timing'].update(target=ns(values[1]),
+                                    estimated=ns(values[2]),
+                                    uncertainty=ns(values[3]))
+        elif line == '* Loop:':
+            # Loop Name | latency min | max | (absolute min | max |)
+            # iteration latency | II achieved | target | trip count |
+            # pipelined; nested loops are marked '+', '++', ...
+            parents = []
+            for row in lines[i+1:]:
+                if not row.strip():
+                    break
+                values = cells(row)
+                m = re.match(r'([-+]+)\s*(\S+)', values[0])
+                if not row.strip().startswith('|') or not m or \
+                   len(values) < 7:
+                    continue
+                depth = 0 if m.group(1) == '-' else len(m.group(1))
+                parents = parents[:depth] + [m.group(2)]
+                ii = report_number(values[-4])
+                record['loops'].append({
+                    'name': m.group(2),
+                    'path': '/'.join(parents),
+                    'trip_count': report_number(values[-2]),
+                    'latency': report_number(values[2]),
+                    'iteration_latency': report_number(values[-5]),
+                    'ii': ii,
+                    'pipelined': values[-1] == 'yes' or ii is not None
+                })
+    return record
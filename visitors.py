@@ -1,49 +1,160 @@
 import ast
+import sys
+import contextlib
+
+# visit method of each node class, per visitor class
+dispatch_tables = {}
+# field names of each node class
+node_fields = {}
+
+
+def fields_of(node):
+    '''Field names of node, looked up once per node class (PyLog IR nodes
+       set the same _fields in __init__ for every instance of a class).'''
+    cls = node.__class__
+    fields = node_fields.get(cls)
+    if fields is None:
+        fields = node_fields[cls] = tuple(getattr(node, '_fields', ()))
+    return fields
+
+
+def ast_children(node):
+    '''Child AST nodes of node, in field order.'''
+    children = []
+    for field in fields_of(node):
+        value = getattr(node, field, None)
+        if isinstance(value, list):
+            for item in value:
+                if isinstance(item, ast.AST):
+                    children.append(item)
+        elif isinstance(value, ast.AST):
+            children.append(value)
+    return children
+
+
+def tree_depth(node):
+    '''Depth of a Python AST or PyLog IR (lists count as a level).'''
+    depth = 0
+    stack = [(node, 1)]
+    while stack:
+        current, level = stack.pop()
+        depth = max(depth, level)
+        if isinstance(current, list):
+            stack.extend((item, level + 1) for item in current)
+        elif hasattr(current, '_fields'):
+            for field in fields_of(current):
+                value = getattr(current, field, None)
+                if isinstance(value, list) or hasattr(value, '_fields'):
+                    stack.append((value, level + 1))
+    return depth
+
+
+# Python frames a recursive visitor may use per level of the tree
+FRAMES_PER_LEVEL = 6
+
+
+@contextlib.contextmanager
+def recursion_budget(tree):
+    '''Raise the recursion limit while the visitors whose visit methods
+       recurse into their children (typer, optimizer, code generator) run on
+       tree, so that deep loop nests and long expressions do not hit it.'''
+    limit = sys.getrecursionlimit()
+    needed = 1000 + FRAMES_PER_LEVEL * tree_depth(tree)
+    if needed > limit:
+        sys.setrecursionlimit(needed)
+    try:
+        yield
+    finally:
+        sys.setrecursionlimit(limit)
+
+
+class PLVisitor():
+    '''Base of the visitors. dispatch(node) returns the visit_<class name>
+       method of the visitor (or generic_visit) for the class of node,
+       unbound; the method is looked up once per visitor and node class
+       instead of on every visit.'''
+
+    def dispatch(self, node):
+        cls = self.__class__
+        table = dispatch_tables.get(cls)
+        if table is None:
+            table = dispatch_tables[cls] = {}
+        node_cls = node.__class__
+        method = table.get(node_cls)
+        if method is None:
+            method = table[node_cls] = \
+                getattr(cls, 'visit_' + node_cls.__name__, cls.generic_visit)
+        return method
+
+    def generic_visit(self, node, config=None):
+        """Called if no explicit visitor function exists for a node."""
+        pass
+
+
+class PLPostorderVisitor(PLVisitor):
+    '''Visits the children of a node before the node. With iterative (the
+       default), the tree is walked with an explicit stack, so that deep
+       loop nests do not hit the recursion limit.'''
+
+    iterative = True
 
-class PLPostorderVisitor():
     def visit(self, node, config=None):
         """Visit a node."""
         if node == None:
             return None
+        if self.iterative:
+            return self.visit_iterative(node, config)
         # visit children first
-        for field, value in ast.iter_fields(node):
-            if isinstance(value, list):
-                for item in value:
-                    if isinstance(item, ast.AST):
-                        self.visit(item, config)
-            elif isinstance(value, ast.AST):
-                self.visit(value, config)
+        for child in ast_children(node):
+            self.visit(child, config)
         # visit current node after visiting children (postorder)
-        method = 'visit_' + node.__class__.__name__
-        visitor = getattr(self, method, self.generic_visit)
-        visit_return = visitor(node, config)
+        return self.visit_node(node, config)
+
+    def visit_iterative(self, node, config=None):
+        visit_return = None
+        stack = [(node, False)]
+        while stack:
+            current, children_done = stack.pop()
+            if children_done:
+                visit_return = self.visit_node(current, config)
+                continue
+            stack.append((current, True))
+            for child in reversed(ast_children(current)):
+                stack.append((child, False))
+        # the last node visited is node itself
+        return visit_return
+
+    def visit_node(self, node, config=None):
+        visit_return = self.dispatch(node)(self, node, config)
         if config == "DEBUG" and hasattr(node, "pl_data"):
             print(node.__class__.__name__+": ", node.pl_data)
         return visit_return
 
-    def generic_visit(self, node, config=None):
-        """Called if no explicit visitor function exists for a node."""
-        pass
 
-class PLPreorderVisitor():
+class PLPreorderVisitor(PLVisitor):
+    '''Visits a node before its children, iteratively by default (see
+       PLPostorderVisitor).'''
+
+    iterative = True
+
     def visit(self, node, config=None):
         """Visit a node."""
         if node == None:
             return None
-        method = 'visit_' + node.__class__.__name__
-        visitor = getattr(self, method, self.generic_visit)
-        visit_return = visitor(node, config)
+        if self.iterative:
+            return self.visit_iterative(node, config)
+        visit_return = self.dispatch(node)(self, node, config)
 
         # visit children nodes
-        for field, value in ast.iter_fields(node):
-            if isinstance(value, list):
-                for item in value:
-                    if isinstance(item, ast.AST):
-                        self.visit(item, config)
-            elif isinstance(value, ast.AST):
-                self.visit(value, config)
+        for child in ast_children(node):
+            self.visit(child, config)
         return visit_return
 
-    def generic_visit(self, node, config=None):
-        """Called if no explicit visitor function exists for a node."""
-        pass
+    def visit_iterative(self, node, config=None):
+        visit_return = self.dispatch(node)(self, node, config)
+        stack = list(reversed(ast_children(node)))
+        while stack:
+            current = stack.pop()
+            self.dispatch(current)(self, current, config)
+            stack.extend(reversed(ast_children(current)))
+        return visit_return